@@ -0,0 +1,453 @@
+import asyncio
+
+from eth_account import Account
+from web3 import AsyncWeb3, Web3
+
+from .chains import cache_static_requests, chain_registry
+from .event_log import EventType, events
+from .gas_limits import gas_estimator
+from .pool_index import pool_index
+from .telemetry import instrument_web3, span
+from .tx_monitor import monitor_for
+from .uniswap_router import (
+    DEFAULT_TICK_SPACING,
+    ERC20_ABI,
+    NATIVE_TOKEN_ADDRESS,
+    PERMIT2_ABI,
+    UNIVERSAL_ROUTER_ABI,
+    approve_gas_key,
+    compute_fee_caps,
+    encode_swap,
+    new_codec,
+    swap_gas_key,
+)
+
+
+class AsyncUniswap:
+    """Async counterpart of Uniswap built on AsyncWeb3.
+
+    Produces the same transactions, events and return values as the sync
+    client, but reads that don't depend on each other (decimals, balance,
+    allowances, block, fees, nonce) are issued together with asyncio.gather,
+    and the Permit2 signature is computed in a worker thread while the fee
+    quote is in flight. An in-flight trade holds no OS thread.
+
+    Construct with ``await AsyncUniswap.create(...)``. Sent transactions are
+    tracked, and stalled ones sped up or cancelled, by the wallet's TxMonitor,
+    the same one the sync client uses. It runs on a sync client: ``sync_web3``,
+    or the chain's shared client from the chain registry.
+    """
+
+    def __init__(self, wallet_address, private_key, provider, web3=None, monitor=None, chain_id=None):
+        self.wallet_address = wallet_address
+        self.private_key = private_key
+        self.account = Account.from_key(private_key)
+        self.address = Web3.to_checksum_address(wallet_address)
+
+        self.w3 = web3 if web3 else AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(provider))
+        instrument_web3(self.w3)
+        cache_static_requests(self.w3)
+
+        self.monitor = monitor
+        self.chain_id = None
+        self.chain_config = None
+        if chain_id is not None:
+            self._bind_chain(chain_id)
+
+    def _bind_chain(self, chain_id):
+        """Select router, Permit2, WETH, gas policy and token cache for ``chain_id``."""
+        self.chain_config = chain_registry.get(chain_id)
+        self.chain_id = self.chain_config.chain_id
+        self.chain = self.chain_config.name
+        self.router_address = self.chain_config.router_address
+        self.router = self.w3.eth.contract(address=self.router_address, abi=UNIVERSAL_ROUTER_ABI)
+        self.permit2 = self.w3.eth.contract(address=self.chain_config.permit2_address, abi=PERMIT2_ABI)
+        self.weth_address = self.chain_config.weth_address
+
+    @classmethod
+    async def create(cls, wallet_address, private_key, provider, web3=None, monitor=None, chain_id=None,
+                     sync_web3=None):
+        """Build the client, check the connection and attach the wallet's tx monitor.
+
+        Without ``monitor``, it is ``monitor_for`` on ``sync_web3`` or the chain
+        registry's client, or None when TX_MONITOR_POLICY is "off".
+        """
+        self = cls(wallet_address, private_key, provider, web3, monitor, chain_id)
+        connected, actual_chain_id = await asyncio.gather(self.w3.is_connected(), self.w3.eth.chain_id)
+        assert connected, "❌ Web3 connection failed"
+        if self.chain_config is None:
+            self._bind_chain(actual_chain_id)
+        if self.monitor is None:
+            sync_web3 = sync_web3 if sync_web3 is not None else chain_registry.client(self.chain_id)
+            # Creating the monitor can open the shared store, so keep it off the event loop
+            self.monitor = await asyncio.to_thread(
+                monitor_for, sync_web3, self.account, self.chain_config.gas_policy, self.chain_id
+            )
+        return self
+
+    async def _chain_nonce(self):
+        """The wallet's transaction count, a read that can be gathered with other lookups."""
+        if self.monitor is None:
+            return await self.w3.eth.get_transaction_count(self.account.address)
+        return await self.w3.eth.get_transaction_count(self.account.address, "pending")
+
+    async def _next_nonce(self, chain_nonce):
+        """Reserve the nonce to send with, off the event loop since a shared store takes a SQLite lock.
+
+        Call it only once nothing but the send can fail, so a failed trade doesn't hold a nonce.
+        """
+        if self.monitor is None:
+            return chain_nonce
+        return await asyncio.to_thread(self.monitor.next_nonce, chain_nonce)
+
+    def _track(self, tx, tx_hash, kind):
+        if self.monitor is not None:
+            self.monitor.track(tx, tx_hash, kind)
+
+    async def _release_nonce(self, nonce):
+        """Give a reserved nonce back to the monitor when its transaction wasn't sent."""
+        if self.monitor is not None:
+            await asyncio.to_thread(self.monitor.release, nonce)
+
+    async def _send(self, tx):
+        """Sign and send ``tx``; if that fails, its nonce goes back to the monitor for the next trade."""
+        try:
+            with span("sign.tx"):
+                signed_tx = self.w3.eth.account.sign_transaction(tx, self.account.key)
+            return await self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        except Exception:
+            await self._release_nonce(tx["nonce"])
+            raise
+
+    async def _chain_id(self):
+        if self.chain_id is None:
+            self.chain_id = await self.w3.eth.chain_id
+        return self.chain_id
+
+    async def get_token_decimals(self, token_address):
+        decimals = self.chain_config.tokens.decimals(token_address)
+        if decimals is None:
+            token_contract = self.w3.eth.contract(address=Web3.to_checksum_address(token_address), abi=ERC20_ABI)
+            decimals = await token_contract.functions.decimals().call()
+            self.chain_config.tokens.set_decimals(token_address, decimals)
+        return decimals
+
+    async def check_permit2_allowance(self, token_address):
+        """
+        Check if token has already been approved for Permit2
+        Returns: True if sufficient allowance exists, False otherwise
+        """
+        token_address = Web3.to_checksum_address(token_address)
+        token_contract = self.w3.eth.contract(address=token_address, abi=ERC20_ABI)
+        permit2_allowance = await token_contract.functions.allowance(
+            self.wallet_address,
+            self.permit2.address
+        ).call()
+        events.emit(EventType.PERMIT2_ALLOWANCE_CHECKED, "debug", token=token_address, allowance=permit2_allowance)
+
+        # Any number larger than this is considered "infinite"
+        return permit2_allowance > 2**200
+
+    async def approve_permit2(self, token_address, amount):
+        """
+        Approve the Permit2 contract to spend tokens (one-time approval)
+        """
+        token_address = Web3.to_checksum_address(token_address)
+        token_contract = self.w3.eth.contract(address=token_address, abi=ERC20_ABI)
+        contract_function = token_contract.functions.approve(self.permit2.address, 2**256 - 1)
+
+        gas_key = approve_gas_key(self.chain_id, token_address, self.permit2.address)
+        gas_limit = await gas_estimator.estimate_async(self.w3, gas_key, {
+            "from": self.account.address,
+            "to": token_address,
+            "data": token_contract.encode_abi("approve", args=[self.permit2.address, 2**256 - 1]),
+            "value": 0,
+        })
+        gas_params, chain_nonce, chain_id = await asyncio.gather(
+            self.calculate_gas_parameters(estimated_gas_limit=gas_limit),
+            self._chain_nonce(),
+            self._chain_id(),
+        )
+        if not gas_params or not gas_params['has_sufficient_balance']:
+            return False
+        nonce = await self._next_nonce(chain_nonce)
+
+        try:
+            tx_params = await contract_function.build_transaction({
+                "from": self.account.address,
+                "gas": gas_params['estimated_total_wei'],
+                "maxPriorityFeePerGas": gas_params['max_priority_fee_per_gas'],
+                "maxFeePerGas": gas_params['max_fee_per_gas'],
+                "type": 2,
+                "chainId": chain_id,
+                "value": 0,
+                "nonce": nonce,
+            })
+        except Exception:
+            await self._release_nonce(nonce)
+            raise
+        tx_hash = await self._send(tx_params)
+        events.emit(EventType.TX_SENT, kind="permit2_approve", tx_hash=tx_hash, nonce=nonce, token=token_address)
+        self._track(tx_params, tx_hash, "permit2_approve")
+        gas_estimator.remember(tx_hash, gas_key, tx_params["gas"])
+
+        try:
+            with span("wait.receipt"):
+                receipt = await self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
+            if self.monitor is None:
+                # Without a monitor no receipt listener sees it, so learn from it here
+                gas_estimator.observe(gas_key, receipt.gasUsed, tx_params["gas"], receipt.status)
+            if receipt.status == 1:
+                events.emit(EventType.PERMIT2_APPROVAL_CONFIRMED, tx_hash=tx_hash, block=receipt.blockNumber)
+                await asyncio.sleep(2)  # Wait for state update
+                return True
+            events.emit(EventType.PERMIT2_APPROVAL_FAILED, "error", tx_hash=tx_hash, reason="reverted")
+        except Exception as e:
+            events.emit(EventType.PERMIT2_APPROVAL_FAILED, "error", tx_hash=tx_hash, reason=str(e))
+        return False
+
+    async def create_permit_signature(self, token_address):
+        """
+        Create a Permit2 signature for a specific transaction (needed for each swap).
+        Signing runs in a worker thread so it overlaps with whatever else is awaited.
+        """
+        token_address = Web3.to_checksum_address(token_address)
+        (p2_amount, p2_expiration, p2_nonce), chain_id = await asyncio.gather(
+            self.permit2.functions.allowance(self.wallet_address, token_address, self.router_address).call(),
+            self._chain_id(),
+        )
+
+        def sign():
+            codec = new_codec()
+            permit_data, signable_message = codec.create_permit2_signable_message(
+                token_address,
+                2**160 - 1,  # max/infinite
+                codec.get_default_expiration(),
+                p2_nonce,
+                self.router_address,
+                codec.get_default_deadline(),
+                chain_id,
+            )
+            with span("sign.permit"):
+                return permit_data, self.account.sign_message(signable_message)
+
+        permit_data, signed_message = await asyncio.to_thread(sign)
+        events.emit(EventType.PERMIT_SIGNED, "debug", token=token_address, p2_amount=p2_amount,
+                    p2_expiration=p2_expiration, p2_nonce=p2_nonce)
+        return permit_data, signed_message
+
+    async def _fetch_fees(self):
+        """Fetch block, priority fee and balance together; returns (latest_block, max_fee, priority_fee, balance)."""
+        block, priority_fee, balance = await asyncio.gather(
+            self.w3.eth.get_block("latest"),
+            self.w3.eth.max_priority_fee,
+            self.w3.eth.get_balance(self.account.address),
+        )
+        max_fee_per_gas, max_priority_fee = compute_fee_caps(
+            block["baseFeePerGas"], priority_fee, self.chain_config.gas_policy
+        )
+        return block, max_fee_per_gas, max_priority_fee, balance
+
+    def _gas_params(self, estimated_gas_limit, value, max_fee_per_gas, max_priority_fee, balance):
+        """Gas params dict of the sync client, checking ``balance`` covers gas and ``value``."""
+        total_gas_wei = int(estimated_gas_limit * max_fee_per_gas)
+        has_sufficient_balance = balance >= total_gas_wei + value
+        events.emit(EventType.GAS_QUOTED, max_fee_per_gas=max_fee_per_gas,
+                    max_priority_fee_per_gas=max_priority_fee, gas_limit=int(estimated_gas_limit),
+                    total_gas_wei=total_gas_wei, balance_wei=balance)
+        if not has_sufficient_balance:
+            events.emit(EventType.INSUFFICIENT_BALANCE, "error", purpose="gas",
+                        balance_wei=balance, required_wei=total_gas_wei + value)
+        return {
+            'max_fee_per_gas': max_fee_per_gas,
+            'max_priority_fee_per_gas': max_priority_fee,
+            'estimated_total_wei': int(estimated_gas_limit),  # gas limit, named as in the sync client
+            'has_sufficient_balance': has_sufficient_balance,
+        }
+
+    async def calculate_gas_parameters(self, estimated_gas_limit=21000, value=0):
+        """
+        Calculate optimal gas parameters and check balance sufficiency.
+        Returns the same dict as Uniswap.calculate_gas_parameters, or None on error.
+        """
+        try:
+            _, max_fee_per_gas, max_priority_fee, balance = await self._fetch_fees()
+            return self._gas_params(estimated_gas_limit, value, max_fee_per_gas, max_priority_fee, balance)
+        except Exception as e:
+            events.emit(EventType.GAS_QUOTE_FAILED, "error", reason=str(e))
+            return None
+
+    async def make_trade(self, from_token, to_token, amount, fee, slippage, pool_version="v3", tick_spacing=None):
+        """
+        Execute an exact input swap using Universal Router with RouterCodec.
+
+        Args:
+            from_token (str): Address of token to swap from
+            to_token (str): Address of token to swap to
+            amount (int): Amount in wei (already converted to smallest unit)
+            fee (int): Fee tier (e.g., 3000 for 0.3%)
+            slippage (float): Slippage tolerance in percent
+            tick_spacing (int): V4 pool tick spacing, looked up in the pool index when not given
+
+        Returns:
+            HexBytes: The swap transaction hash, or None if approval or the gas quote failed
+        """
+        from_token = Web3.to_checksum_address(from_token)
+        to_token = Web3.to_checksum_address(to_token)
+        amount_in_wei = int(amount)
+        events.emit(EventType.TRADE_STARTED, from_token=from_token, to_token=to_token, amount_wei=amount_in_wei,
+                    fee=fee, slippage=slippage, pool_version=pool_version)
+
+        token_contract = self.w3.eth.contract(address=from_token, abi=ERC20_ABI)
+        decimals_in, balance, has_permit2_allowance = await asyncio.gather(
+            self.get_token_decimals(from_token),
+            token_contract.functions.balanceOf(self.wallet_address).call(),
+            self.check_permit2_allowance(from_token),
+        )
+        events.emit(EventType.BALANCE_CHECKED, "debug", token=from_token, decimals=decimals_in,
+                    balance_wei=balance, amount_wei=amount_in_wei)
+
+        if balance < amount_in_wei:
+            events.emit(EventType.TRADE_FAILED, "error", reason="insufficient_token_balance",
+                        balance_wei=balance, amount_wei=amount_in_wei)
+            raise ValueError(f"Insufficient balance. Have: {balance / (10 ** decimals_in)}, Need: {amount_in_wei / (10 ** decimals_in)}")
+
+        if not has_permit2_allowance:
+            events.emit(EventType.PERMIT2_APPROVAL_NEEDED, token=from_token)
+            if not await self.approve_permit2(from_token, amount_in_wei):
+                events.emit(EventType.TRADE_FAILED, "error", reason="permit2_approval_failed")
+                return None
+            await asyncio.sleep(2)  # Wait for approval to be mined
+
+        # Permit signing overlaps with the fee quote and the transaction count; the nonce itself
+        # is only taken once the swap is ready to send, so a failure here doesn't hold one
+        try:
+            (permit_data, signed_message), (block, max_fee_per_gas, max_priority_fee, eth_balance), chain_nonce, chain_id = (
+                await asyncio.gather(
+                    self.create_permit_signature(from_token),
+                    self._fetch_fees(),
+                    self._chain_nonce(),
+                    self._chain_id(),
+                )
+            )
+        except Exception as e:
+            events.emit(EventType.GAS_QUOTE_FAILED, "error", reason=str(e))
+            events.emit(EventType.TRADE_FAILED, "error", reason="gas_quote_or_balance")
+            return None
+        if not permit_data or not signed_message:
+            events.emit(EventType.TRADE_FAILED, "error", reason="permit_signature_failed")
+            return None
+
+        #add slippage and correct min_amount_out with calculation using uniswap quoters
+        min_amount_out = 0
+        deadline = block["timestamp"] + 300
+        if tick_spacing is None:
+            tick_spacing = DEFAULT_TICK_SPACING
+            if pool_version.lower() == "v4":
+                # A local SQLite query, cheap enough to run on the event loop
+                pool = pool_index.route(self.chain_id, from_token, to_token, version="v4", fee=fee)
+                tick_spacing = pool.tick_spacing if pool else DEFAULT_TICK_SPACING
+        encoded_data = encode_swap(permit_data, signed_message, from_token, to_token, amount_in_wei,
+                                   min_amount_out, fee, pool_version, deadline, tick_spacing)
+        events.emit(EventType.SWAP_ENCODED, "debug", pool_version=pool_version, deadline=deadline,
+                    min_amount_out=min_amount_out)
+
+        # Gas limit learned for this route shape and pair; the first swap of a kind estimates its exact calldata
+        value = amount_in_wei if from_token.lower() == NATIVE_TOKEN_ADDRESS else 0
+        gas_key = swap_gas_key(self.chain_id, from_token, to_token, pool_version)
+        gas_limit = await gas_estimator.estimate_async(self.w3, gas_key, {
+            "from": self.account.address,
+            "to": self.router_address,
+            "data": encoded_data,
+            "value": value,
+        })
+        gas_params = self._gas_params(gas_limit, value, max_fee_per_gas, max_priority_fee, eth_balance)
+        if not gas_params['has_sufficient_balance']:
+            events.emit(EventType.TRADE_FAILED, "error", reason="gas_quote_or_balance")
+            return None
+
+        nonce = await self._next_nonce(chain_nonce)
+        tx = {
+            "from": self.account.address,
+            "to": self.router_address,
+            "data": encoded_data,
+            "value": value,
+            "nonce": nonce,
+            "gas": gas_params['estimated_total_wei'],
+            "maxFeePerGas": gas_params['max_fee_per_gas'],
+            "maxPriorityFeePerGas": gas_params['max_priority_fee_per_gas'],
+            "type": 2,  # EIP-1559 transaction type
+            "chainId": chain_id,
+        }
+        tx_hash = await self._send(tx)
+        events.emit(EventType.TX_SENT, kind="swap", tx_hash=tx_hash, nonce=nonce,
+                    from_token=from_token, to_token=to_token, amount_wei=amount_in_wei)
+        self._track(tx, tx_hash, "swap")
+        gas_estimator.remember(tx_hash, gas_key, tx["gas"])
+        return tx_hash
+
+    async def buy(self, token_address, amount_eth_in_wei, fee=3000, slippage=0.5, pool_version="v3"):
+        """Buy ``token_address`` with WETH, like UniswapActionProvider.buy_token."""
+        return await self.make_trade(self.weth_address, token_address, int(amount_eth_in_wei), fee, slippage, pool_version)
+
+    async def sell(self, token_address, amount_tokens_in_wei, fee=3000, slippage=0.5, pool_version="v3"):
+        """Sell ``token_address`` for WETH, like UniswapActionProvider.sell_token."""
+        return await self.make_trade(token_address, self.weth_address, int(amount_tokens_in_wei), fee, slippage, pool_version)
+
+    async def cancel_transaction(self, stuck_nonce):
+        """
+        Cancel stuck transaction by sending 0 ETH to self
+        """
+        try:
+            block, priority_fee, balance, chain_id = await asyncio.gather(
+                self.w3.eth.get_block("latest"),
+                self.w3.eth.max_priority_fee,
+                self.w3.eth.get_balance(self.account.address),
+                self._chain_id(),
+            )
+            new_max_fee_per_gas = max(block["baseFeePerGas"] * 8 + priority_fee * 3, Web3.to_wei(0.1, "gwei"))
+            new_max_priority_fee = max(priority_fee * 5, Web3.to_wei(0.005, "gwei"))
+            gas_limit = 21000
+            total_gas_wei = gas_limit * new_max_fee_per_gas
+            events.emit(EventType.GAS_QUOTED, "debug", purpose="cancel", nonce=stuck_nonce,
+                        max_fee_per_gas=new_max_fee_per_gas, max_priority_fee_per_gas=new_max_priority_fee,
+                        gas_limit=gas_limit, total_gas_wei=total_gas_wei, balance_wei=balance)
+            if balance < total_gas_wei:
+                events.emit(EventType.INSUFFICIENT_BALANCE, "error", purpose="cancel", nonce=stuck_nonce,
+                            balance_wei=balance, required_wei=total_gas_wei)
+                return
+
+            cancel_tx = {
+                "from": self.account.address,
+                "to": self.account.address,
+                "value": 0,
+                "gas": gas_limit,
+                "maxPriorityFeePerGas": new_max_priority_fee,
+                "maxFeePerGas": new_max_fee_per_gas,
+                "type": 2,
+                "chainId": chain_id,
+                "nonce": stuck_nonce
+            }
+            with span("sign.tx"):
+                signed_tx = self.w3.eth.account.sign_transaction(cancel_tx, self.account.key)
+            tx_hash = await self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            events.emit(EventType.TX_SENT, kind="cancel", tx_hash=tx_hash, nonce=stuck_nonce,
+                        max_fee_per_gas=new_max_fee_per_gas)
+        except Exception as e:
+            events.emit(EventType.CANCEL_FAILED, "error", nonce=stuck_nonce, reason=str(e))
+
+    async def check_for_stuck_transactions(self):
+        """
+        Check for stuck transactions by comparing pending vs latest nonce
+        Returns: stuck nonce if found, None if no stuck transactions
+        """
+        try:
+            pending_nonce, latest_nonce = await asyncio.gather(
+                self.w3.eth.get_transaction_count(self.account.address, 'pending'),
+                self.w3.eth.get_transaction_count(self.account.address, 'latest'),
+            )
+            events.emit(EventType.STUCK_TX_CHECKED, "debug", pending_nonce=pending_nonce, latest_nonce=latest_nonce)
+            return latest_nonce if pending_nonce > latest_nonce else None
+        except Exception as e:
+            events.emit(EventType.STUCK_TX_CHECKED, "warning", error=str(e))
+            return None
@@ -0,0 +1,287 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from web3 import Web3
+from web3._utils.caching import handle_request_caching
+from web3.providers.base import BaseProvider
+
+from .event_log import EventType, events
+from .gas import GasPolicy
+from .telemetry import instrument_web3
+
+PERMIT2_ADDRESS = "0x000000000022D473030F116dDEE9F6B43aC78BA3"
+# Uniswap V3 factory address shared by Ethereum, Optimism, Polygon and Arbitrum
+V3_FACTORY_ADDRESS = "0x1F98431c8aD98523631AE4a59f267346ea31F984"
+
+# Answers that never change for an endpoint. web3's validation middleware asks for
+# eth_chainId before every call and transaction, which is ~10 round trips per trade.
+STATIC_REQUESTS = {"eth_chainId", "net_version"}
+
+
+def cache_static_requests(w3):
+    """Let the client's provider cache STATIC_REQUESTS (idempotent, sync and async clients)."""
+    provider = w3.provider
+    provider.cache_allowed_requests = True
+    provider.cacheable_requests = STATIC_REQUESTS
+
+
+class TokenCache:
+    """Per-chain cache of immutable token metadata (decimals), so repeat trades skip the lookup."""
+
+    def __init__(self):
+        self._decimals = {}
+
+    def decimals(self, token_address):
+        return self._decimals.get(token_address.lower())
+
+    def set_decimals(self, token_address, decimals):
+        self._decimals[token_address.lower()] = decimals
+
+    def clear(self):
+        self._decimals.clear()
+
+
+class ChainConfig:
+    """Everything the trade path needs to know about one chain."""
+
+    def __init__(self, chain_id, name, router_address, weth_address, default_rpc_url, url_hints=(),
+                 gas_policy=None, permit2_address=PERMIT2_ADDRESS, v3_factory_address=V3_FACTORY_ADDRESS,
+                 v4_pool_manager_address=None, v4_state_view_address=None, pools_start_block=0):
+        self.chain_id = chain_id
+        self.name = name
+        self.router_address = Web3.to_checksum_address(router_address)
+        # Wrapped native token (WETH, or WPOL on Polygon): the input of a buy and the output of a sell
+        self.weth_address = Web3.to_checksum_address(weth_address)
+        self.permit2_address = Web3.to_checksum_address(permit2_address)
+        # Sources of the pool index (actions/pool_index.py): V3 PoolCreated and V4 Initialize logs,
+        # scanned from the block the older of the two was deployed at
+        self.v3_factory_address = Web3.to_checksum_address(v3_factory_address)
+        self.v4_pool_manager_address = (
+            Web3.to_checksum_address(v4_pool_manager_address) if v4_pool_manager_address else None
+        )
+        self.pools_start_block = pools_start_block
+        # V4 lens contract for reading a pool's slot0 and liquidity (actions/pool_state.py)
+        self.v4_state_view_address = (
+            Web3.to_checksum_address(v4_state_view_address) if v4_state_view_address else None
+        )
+        self.default_rpc_url = default_rpc_url
+        # Substrings of RPC URLs that identify the chain, most specific chains listed first in CHAINS
+        self.url_hints = url_hints or (name,)
+        self.gas_policy = gas_policy or GasPolicy()
+        self.tokens = TokenCache()
+
+
+# Uniswap Universal Router (v4) deployments, keyed by chain ID
+CHAINS = {
+    config.chain_id: config
+    for config in (
+        ChainConfig(
+            84532, "base-sepolia",
+            router_address="0x492e6456d9528771018deb9e87ef7750ef184104",
+            weth_address="0x4200000000000000000000000000000000000006",
+            default_rpc_url="https://sepolia.base.org",
+            v3_factory_address="0x4752ba5DBc23f44D87826276BF6Fd6b1C372aD24",
+            v4_pool_manager_address="0x05E73354cFDd6745C338b50BcFDfA3Aa6fA03408",
+            v4_state_view_address="0x571291b572ed32ce6751a2cb2486ebee8defb9b4",
+            url_hints=("base-sepolia", "sepolia.base"),
+        ),
+        ChainConfig(
+            8453, "base",
+            router_address="0x6ff5693b99212da76ad316178a184ab56d299b43",
+            weth_address="0x4200000000000000000000000000000000000006",
+            default_rpc_url="https://mainnet.base.org",
+            v3_factory_address="0x33128a8fC17869897dcE68Ed026d694621f6FDfD",
+            v4_pool_manager_address="0x498581fF718922c3f8e6A244956aF099B2652b2b",
+            v4_state_view_address="0xa3c0c9b65bad0b08107aa264b0f3db444b867a71",
+            pools_start_block=1371680,
+        ),
+        ChainConfig(
+            10, "optimism",
+            router_address="0x851116d9223fabed8e56c0e6b8ad0c31d98b3507",
+            weth_address="0x4200000000000000000000000000000000000006",
+            default_rpc_url="https://mainnet.optimism.io",
+            v4_pool_manager_address="0x9a13f98cb987694c9f086b1f5eb990eea8264ec3",
+            v4_state_view_address="0xc18a3169788f4f75a170290584eca6395c75ecdb",
+        ),
+        ChainConfig(
+            137, "polygon",
+            router_address="0x1095692a6237d83c6a72f3f5efedb9a670c49223",
+            # Wrapped POL, the native token; WETH on Polygon is a bridged ERC20
+            weth_address="0x0d500B1d8E8eF31E21C99d1Db9A6444d3ADf1270",
+            default_rpc_url="https://polygon-rpc.com",
+            v4_pool_manager_address="0x67366782805870060151383f4bbff9dab53e5cd6",
+            v4_state_view_address="0x5ea1bd7974c8a611cbab0bdcafcb1d9cc9b3ba5a",
+            pools_start_block=22757547,
+            # Polygon PoS validators reject tips below 25 gwei
+            gas_policy=GasPolicy(min_max_fee_gwei=30, min_priority_fee_gwei=30),
+        ),
+        ChainConfig(
+            42161, "arbitrum",
+            router_address="0xa51afafe0263b40edaef0df8781ea9aa03e381a3",
+            weth_address="0x82aF49447D8a07e3bd95BD0d56f35241523fBab1",
+            default_rpc_url="https://arb1.arbitrum.io/rpc",
+            v4_pool_manager_address="0x360e68faccca8ca495c1b759fd9eee466db9fb32",
+            v4_state_view_address="0x76fd297e2d437cd7f76d50f01afe6160f86e9990",
+            pools_start_block=165,
+        ),
+        ChainConfig(
+            1, "ethereum",
+            router_address="0x66a9893cc07d91d95644aedd05d03f95e1dba8af",
+            weth_address="0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2",
+            default_rpc_url="https://ethereum-rpc.publicnode.com",
+            v4_pool_manager_address="0x000000000004444c5dc75cB358380D2e3dE08A90",
+            v4_state_view_address="0x7ffe42c4a5deea5b0fec41c94c136cf115597227",
+            pools_start_block=12369621,
+            url_hints=("ethereum", "mainnet.infura", "eth-mainnet"),
+            # The base fee can rise 12.5% per block on mainnet
+            gas_policy=GasPolicy(base_multiplier=1.25, min_max_fee_gwei=0.1, min_priority_fee_gwei=0.01),
+        ),
+    )
+}
+
+
+class RpcPool(BaseProvider):
+    """Provider over several RPC endpoints of one chain.
+
+    Requests go to the current endpoint; a connection error, timeout, HTTP 429
+    or 5xx moves the pool to the next endpoint and retries there, so one
+    flaky provider doesn't fail a trade. The pool stays on whichever endpoint
+    last worked.
+    """
+
+    def __init__(self, urls):
+        super().__init__()
+        if not urls:
+            raise ValueError("RpcPool needs at least one endpoint")
+        # With a fallback endpoint, failing over beats web3's retries with backoff on the same one
+        retries = {"exception_retry_configuration": None} if len(urls) > 1 else {}
+        self.providers = [Web3.HTTPProvider(url, **retries) for url in urls]
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint_uri(self):
+        return self.providers[self._active].endpoint_uri
+
+    @handle_request_caching
+    def make_request(self, method, params):
+        start = self._active
+        last_error = None
+        for offset in range(len(self.providers)):
+            index = (start + offset) % len(self.providers)
+            try:
+                response = self.providers[index].make_request(method, params)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status != 429 and (status is None or status < 500):
+                    raise
+                last_error = e
+            else:
+                if index != start:
+                    with self._lock:
+                        self._active = index
+                return response
+            events.emit(EventType.RPC_FAILOVER, "warning", endpoint=self.providers[index].endpoint_uri,
+                        method=method, reason=str(last_error))
+        raise last_error
+
+    def is_connected(self, show_traceback=False):
+        return any(provider.is_connected(show_traceback) for provider in self.providers)
+
+
+class ChainRegistry:
+    """Chain configs, RPC pools and warm web3 clients keyed by chain ID.
+
+    Enabled chains come from CHAIN_IDS (comma separated, defaults to CHAIN_ID),
+    and each chain's endpoints from RPC_URLS_<chain_id> (comma separated). For
+    CHAIN_ID, PROVIDER_URL is used when RPC_URLS_<chain_id> is not set. The
+    environment is read when a chain is first used, so values loaded from
+    .env after import still apply.
+    """
+
+    def __init__(self, chains=CHAINS):
+        self.chains = chains
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, chain_id):
+        config = self.chains.get(int(chain_id))
+        if config is None:
+            raise ValueError(f"❌ Unsupported chain: {chain_id}")
+        return config
+
+    def enabled_ids(self):
+        raw = os.getenv("CHAIN_IDS") or os.getenv("CHAIN_ID", "8453")
+        return [int(chain_id) for chain_id in raw.split(",") if chain_id.strip()]
+
+    def __contains__(self, chain_id):
+        try:
+            return int(chain_id) in self.chains and int(chain_id) in self.enabled_ids()
+        except (TypeError, ValueError):
+            return False
+
+    def for_url(self, provider_url):
+        """Identify the chain from an RPC URL; raises ValueError instead of guessing."""
+        url = (provider_url or "").lower()
+        for config in self.chains.values():
+            if any(hint in url for hint in config.url_hints):
+                return config
+        raise ValueError(f"❌ Can't tell the chain from RPC URL {provider_url!r}; pass chain_id")
+
+    def rpc_urls(self, chain_id):
+        chain_id = int(chain_id)
+        raw = os.getenv(f"RPC_URLS_{chain_id}")
+        if not raw and str(chain_id) == os.getenv("CHAIN_ID", "8453"):
+            raw = os.getenv("PROVIDER_URL")
+        urls = [url.strip() for url in (raw or "").split(",") if url.strip()]
+        return urls or [self.get(chain_id).default_rpc_url]
+
+    def register_client(self, chain_id, w3):
+        """Use an existing client (e.g. the wallet provider's) for ``chain_id``."""
+        instrument_web3(w3)
+        cache_static_requests(w3)
+        with self._lock:
+            self._clients[int(chain_id)] = w3
+
+    def client(self, chain_id):
+        """Return the shared web3 client for ``chain_id``, creating it on first use."""
+        chain_id = int(chain_id)
+        w3 = self._clients.get(chain_id)
+        if w3 is not None:
+            return w3
+        self.get(chain_id)
+        with self._lock:
+            if chain_id not in self._clients:
+                w3 = Web3(RpcPool(self.rpc_urls(chain_id)))
+                instrument_web3(w3)
+                cache_static_requests(w3)
+                self._clients[chain_id] = w3
+            return self._clients[chain_id]
+
+    def warm(self, chain_ids=None):
+        """Create clients for every enabled chain and check that each endpoint serves the expected chain.
+
+        Returns {chain_id: error message or None}.
+        """
+        chain_ids = list(chain_ids or self.enabled_ids())
+
+        def check(chain_id):
+            try:
+                actual = self.client(chain_id).eth.chain_id
+            except Exception as e:
+                return str(e)
+            if actual != chain_id:
+                return f"RPC endpoint serves chain {actual}, expected {chain_id}"
+            return None
+
+        if not chain_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(chain_ids)) as executor:
+            return dict(zip(chain_ids, executor.map(check, chain_ids)))
+
+
+chain_registry = ChainRegistry()
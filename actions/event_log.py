@@ -0,0 +1,179 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+class EventType(str, Enum):
+    """Every event the trade path can emit."""
+
+    TRADE_STARTED = "trade_started"
+    BALANCE_CHECKED = "balance_checked"
+    PERMIT2_ALLOWANCE_CHECKED = "permit2_allowance_checked"
+    PERMIT2_APPROVAL_NEEDED = "permit2_approval_needed"
+    PERMIT2_APPROVAL_CONFIRMED = "permit2_approval_confirmed"
+    PERMIT2_APPROVAL_FAILED = "permit2_approval_failed"
+    PERMIT_SIGNED = "permit_signed"
+    SWAP_ENCODED = "swap_encoded"
+    GAS_QUOTED = "gas_quoted"
+    GAS_QUOTE_FAILED = "gas_quote_failed"
+    GAS_LIMIT_ESTIMATED = "gas_limit_estimated"
+    GAS_ESTIMATE_FAILED = "gas_estimate_failed"
+    GAS_USAGE_LEARNED = "gas_usage_learned"
+    INSUFFICIENT_BALANCE = "insufficient_balance"
+    TX_SENT = "tx_sent"
+    TRADE_FAILED = "trade_failed"
+    STUCK_TX_CHECKED = "stuck_tx_checked"
+    STUCK_TX_DETECTED = "stuck_tx_detected"
+    CANCEL_FAILED = "cancel_failed"
+    TX_CONFIRMED = "tx_confirmed"
+    TX_DROPPED = "tx_dropped"
+    TX_REPLACED = "tx_replaced"
+    TX_REPLACEMENT_FAILED = "tx_replacement_failed"
+    RECEIPT_LISTENER_FAILED = "receipt_listener_failed"
+    RPC_FAILOVER = "rpc_failover"
+    POOL_INDEX_PAGE = "pool_index_page"
+    POOL_INDEX_PAGE_REJECTED = "pool_index_page_rejected"
+    POOL_INDEX_SYNCED = "pool_index_synced"
+    POOL_INDEX_FAILED = "pool_index_failed"
+    POOL_STATE_SEEDED = "pool_state_seeded"
+    POOL_STATE_REORG = "pool_state_reorg"
+    POOL_STATE_FAILED = "pool_state_failed"
+    EVENT_LOG_LEVEL_INVALID = "event_log_level_invalid"
+
+
+_correlation = ContextVar("xalpha_event_correlation", default={})
+
+
+@contextmanager
+def correlation(**ids):
+    """Attach correlation IDs (request_id, thread_id, ...) to every event emitted in this context."""
+    token = _correlation.set({**_correlation.get(), **ids})
+    try:
+        yield
+    finally:
+        _correlation.reset(token)
+
+
+class EventLog:
+    """Structured event logger with a background writer.
+
+    ``emit`` only checks the level and appends a tuple to a queue; JSON
+    encoding and the write to the stream happen on a daemon thread, so
+    request threads never contend on the stdout lock and events from
+    concurrent trades come out as whole lines. Events below the configured
+    level are dropped before anything is allocated for them.
+
+    A stream or level not passed in comes from EVENT_LOG_FILE (else stdout)
+    and EVENT_LOG_LEVEL (default info) when the first event is emitted, so
+    values loaded from .env after import still apply.
+    """
+
+    def __init__(self, stream=None, level=None):
+        self.stream = stream
+        self.level = LEVELS[level] if level is not None else None
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def configure(self):
+        """Fill in the stream and level that weren't set from the environment. Called on first use."""
+        invalid = None
+        with self._writer_lock:
+            if self.stream is None:
+                path = os.getenv("EVENT_LOG_FILE")
+                self.stream = open(path, "a", buffering=1) if path else sys.stdout
+            if self.level is None:
+                name = (os.getenv("EVENT_LOG_LEVEL") or "info").lower()
+                # A typo in the level shouldn't stop the app from starting
+                invalid = name if name not in LEVELS else None
+                self.level = LEVELS.get(name, LEVELS["info"])
+        if invalid is not None:
+            self.emit(EventType.EVENT_LOG_LEVEL_INVALID, "warning", value=invalid, expected=list(LEVELS),
+                      using="info")
+
+    def enabled(self, level):
+        """Return True if events at ``level`` would be written. Use to guard costly field values."""
+        if self.level is None:
+            self.configure()
+        return LEVELS[level] >= self.level
+
+    def emit(self, event, level="info", **fields):
+        if self.level is None:
+            self.configure()
+        if LEVELS[level] < self.level:
+            return
+        if self._writer is None:
+            self._start_writer()
+        self._queue.put((time.time(), level, event, threading.current_thread().name,
+                         _correlation.get(), fields))
+
+    def flush(self, timeout=5.0):
+        """Block until every event emitted so far has been written."""
+        if self._writer is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _start_writer(self):
+        if self.stream is None:
+            self.configure()
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # Drain whatever else is queued so a burst becomes one write
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines, waiters = [], []
+            for item in items:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    lines.append(self._format(*item))
+            if lines:
+                try:
+                    self.stream.write("".join(lines))
+                    self.stream.flush()
+                except Exception:
+                    pass
+            for waiter in waiters:
+                waiter.set()
+
+    @staticmethod
+    def _format(ts, level, event, thread, ids, fields):
+        record = {
+            "ts": round(ts, 6),
+            "level": level,
+            "event": event.value if isinstance(event, EventType) else event,
+            "thread": thread,
+            **ids,
+            **fields,
+        }
+        return json.dumps(record, default=_json_default) + "\n"
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + bytes(value).hex()
+    return str(value)
+
+
+events = EventLog()
+atexit.register(events.flush)
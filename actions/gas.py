@@ -0,0 +1,43 @@
+from web3 import Web3
+
+
+class GasPolicy:
+    """EIP-1559 fee settings for one chain: multipliers over the current quote and floors in gwei."""
+
+    def __init__(self, base_multiplier=1.2, priority_multiplier=1.1, min_max_fee_gwei=0.003,
+                 min_priority_fee_gwei=0.001):
+        self.base_multiplier = base_multiplier
+        self.priority_multiplier = priority_multiplier
+        self.min_max_fee = Web3.to_wei(min_max_fee_gwei, 'gwei')
+        self.min_priority_fee = Web3.to_wei(min_priority_fee_gwei, 'gwei')
+
+
+# Tuned for Base: blocks are cheap and fast, so small multipliers over the quote are enough
+DEFAULT_GAS_POLICY = GasPolicy()
+
+
+def compute_fee_caps(base_fee, priority_fee, policy=None):
+    """
+    EIP-1559 fee caps for a swap or approval given the latest base fee and the node's priority fee.
+
+    Args:
+        policy (GasPolicy): Multipliers and floors of the chain, defaults to Base's
+
+    Returns:
+        tuple: (max_fee_per_gas, max_priority_fee_per_gas) in wei
+    """
+    policy = policy or DEFAULT_GAS_POLICY
+
+    # Calculate new gas prices (in wei) and convert to integers
+    new_max_fee_per_gas = int(base_fee * policy.base_multiplier + priority_fee * policy.priority_multiplier)
+    new_max_priority_fee = int(priority_fee * policy.priority_multiplier)
+
+    # Use maximum between calculated and minimum values
+    new_max_fee_per_gas = max(new_max_fee_per_gas, policy.min_max_fee)
+    new_max_priority_fee = max(new_max_priority_fee, policy.min_priority_fee)
+
+    # Ensure max fee is higher than priority fee
+    if new_max_fee_per_gas < new_max_priority_fee:
+        new_max_fee_per_gas = new_max_priority_fee * 2
+
+    return int(new_max_fee_per_gas), int(new_max_priority_fee)
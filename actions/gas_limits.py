@@ -0,0 +1,141 @@
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+
+from .event_log import EventType, events
+from .telemetry import span
+from .tx_monitor import add_receipt_listener
+
+# Gas limit used when eth_estimateGas fails and nothing has been learned yet (the old fixed limit)
+FALLBACK_GAS_LIMIT = 500000
+
+# A reverted transaction that used this share of its limit most likely ran out of gas
+OUT_OF_GAS_SHARE = 0.97
+
+# Sent transactions remembered until their receipt arrives
+MAX_IN_FLIGHT = 1024
+
+
+class GasEstimator:
+    """Gas limits per route shape and token pair, learned from receipts.
+
+    The first transaction of a kind (keyed by chain, route shape, e.g. which
+    Universal Router commands it runs, and tokens) gets ``eth_estimateGas``
+    on its exact calldata. The receipt of a transaction sent with
+    ``remember`` adds its gas used as a sample, and once a key has receipts
+    its limit is the highest of the last ``samples`` times ``margin``. The
+    margin also covers gas refunds, which lower gasUsed below what the
+    execution needs up front. After the first transaction no extra RPC is
+    made, and the balance check reserves what the trade will really use
+    instead of a fixed 500000 gas.
+
+    A receipt that reverted at its gas limit counts as a sample of 1.5x that
+    limit, so the next estimate grows instead of failing again. Only the
+    receipt of a remembered hash is learned from: when the tx monitor sped
+    up or cancelled the transaction, the version that was mined isn't the
+    one that was estimated (a cancel is a 21000 gas self-transfer).
+    """
+
+    def __init__(self, margin=None, samples=20):
+        self._margin = margin
+        self.samples = samples
+        self._estimates = {}
+        self._used = {}
+        self._in_flight = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def margin(self):
+        return self._margin or float(os.getenv("GAS_LIMIT_MARGIN") or "1.25")
+
+    def cached(self, key):
+        """Gas limit for ``key`` from receipts or an earlier estimate, or None if it's new."""
+        with self._lock:
+            used = self._used.get(key)
+            base = max(used) if used else self._estimates.get(key)
+        return math.ceil(base * self.margin) if base else None
+
+    def estimate(self, w3, key, tx):
+        """Gas limit for ``tx``: the cached one, else eth_estimateGas on ``tx`` (without its gas field).
+
+        Falls back to FALLBACK_GAS_LIMIT when the estimate fails; that is not cached.
+        """
+        limit = self.cached(key)
+        if limit is not None:
+            return limit
+        tx = {field: value for field, value in tx.items() if field not in ("gas", "nonce")}
+        try:
+            with span("rpc.estimate_gas"):
+                estimate = w3.eth.estimate_gas(tx)
+        except Exception as e:
+            events.emit(EventType.GAS_ESTIMATE_FAILED, "warning", key=key, reason=str(e),
+                        gas_limit=FALLBACK_GAS_LIMIT)
+            return FALLBACK_GAS_LIMIT
+        return self.record_estimate(key, estimate)
+
+    async def estimate_async(self, w3, key, tx):
+        """``estimate`` for an AsyncWeb3 client."""
+        limit = self.cached(key)
+        if limit is not None:
+            return limit
+        tx = {field: value for field, value in tx.items() if field not in ("gas", "nonce")}
+        try:
+            with span("rpc.estimate_gas"):
+                estimate = await w3.eth.estimate_gas(tx)
+        except Exception as e:
+            events.emit(EventType.GAS_ESTIMATE_FAILED, "warning", key=key, reason=str(e),
+                        gas_limit=FALLBACK_GAS_LIMIT)
+            return FALLBACK_GAS_LIMIT
+        return self.record_estimate(key, estimate)
+
+    def record_estimate(self, key, estimate):
+        """Store an eth_estimateGas result for ``key`` and return the gas limit to use."""
+        with self._lock:
+            self._estimates[key] = estimate
+        limit = math.ceil(estimate * self.margin)
+        events.emit(EventType.GAS_LIMIT_ESTIMATED, "debug", key=key, estimate=estimate, gas_limit=limit)
+        return limit
+
+    def reset(self):
+        """Forget every estimate and sample, e.g. after a network upgrade repriced gas."""
+        with self._lock:
+            self._estimates.clear()
+            self._used.clear()
+
+    def remember(self, tx_hash, key, gas_limit=None):
+        """Learn from the receipt of ``tx_hash`` (delivered by the tx monitor) under ``key``.
+
+        ``gas_limit`` is the limit it was sent with, to tell an out-of-gas revert from another one.
+        """
+        with self._lock:
+            self._in_flight[bytes(tx_hash)] = (key, gas_limit)
+            while len(self._in_flight) > MAX_IN_FLIGHT:
+                self._in_flight.popitem(last=False)
+
+    def observe(self, key, gas_used, gas_limit=None, status=1):
+        """Add a receipt's gas used as a sample for ``key``."""
+        if not status:
+            if not gas_limit or gas_used < gas_limit * OUT_OF_GAS_SHARE:
+                return  # reverted for another reason; its gas used says nothing about success
+            gas_used = math.ceil(gas_limit * 1.5)
+        with self._lock:
+            samples = self._used.get(key)
+            if samples is None:
+                samples = self._used[key] = deque(maxlen=self.samples)
+            samples.append(gas_used)
+        events.emit(EventType.GAS_USAGE_LEARNED, "debug", key=key, gas_used=gas_used, status=status)
+
+    def on_receipt(self, pending, receipt):
+        """Receipt listener for the tx monitor."""
+        with self._lock:
+            remembered = {bytes(tx_hash): self._in_flight.pop(bytes(tx_hash), None) for tx_hash in pending.hashes}
+        # A replacement's receipt is never remembered, so a mined cancel teaches nothing
+        mined = remembered.get(bytes(receipt["transactionHash"]))
+        if mined is not None:
+            key, gas_limit = mined
+            self.observe(key, receipt["gasUsed"], gas_limit, receipt["status"])
+
+
+gas_estimator = GasEstimator()
+add_receipt_listener(gas_estimator.on_receipt)
@@ -0,0 +1,316 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+import requests
+from eth_abi import decode
+from web3 import Web3
+from web3.exceptions import Web3RPCError
+
+from .event_log import EventType, events
+from .telemetry import span
+
+POOL_CREATED_TOPIC = Web3.keccak(text="PoolCreated(address,address,uint24,int24,address)")
+INITIALIZE_TOPIC = Web3.keccak(text="Initialize(bytes32,address,address,uint24,int24,address,uint160,int24)")
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# Fee tiers in the order pools are tried when the index knows several for a pair
+FEE_PREFERENCE = (3000, 500, 10000, 100)
+
+# ``pool`` is the V3 pool address or the V4 pool id; addresses are stored as raw bytes.
+# Lookups name their index: without ANALYZE statistics SQLite prefers the chain_id
+# prefix of the primary key and scans every pool of the chain.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    chain_id INTEGER NOT NULL,
+    pool BLOB NOT NULL,
+    version TEXT NOT NULL,
+    token0 BLOB NOT NULL,
+    token1 BLOB NOT NULL,
+    fee INTEGER NOT NULL,
+    tick_spacing INTEGER NOT NULL,
+    hooks BLOB,
+    block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, pool)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pools_by_token0 ON pools (chain_id, token0, token1);
+CREATE INDEX IF NOT EXISTS pools_by_token1 ON pools (chain_id, token1);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    chain_id INTEGER PRIMARY KEY,
+    block INTEGER NOT NULL
+);
+"""
+
+Pool = namedtuple("Pool", "chain_id pool version token0 token1 fee tick_spacing hooks block")
+
+
+def _address_bytes(address):
+    return bytes.fromhex(address[2:].lower() if address.startswith("0x") else address.lower())
+
+
+def _pool(row):
+    chain_id, pool, version, token0, token1, fee, tick_spacing, hooks, block = row
+    return Pool(chain_id, "0x" + pool.hex(), version, "0x" + token0.hex(), "0x" + token1.hex(), fee,
+                tick_spacing, "0x" + hooks.hex() if hooks else ZERO_ADDRESS, block)
+
+
+def decode_pool_log(log):
+    """Turn a PoolCreated or Initialize log into the ``pools`` row values (without chain_id)."""
+    topics, data = log["topics"], bytes(log["data"])
+    if topics[0] == POOL_CREATED_TOPIC:
+        # PoolCreated(address indexed token0, address indexed token1, uint24 indexed fee, int24 tickSpacing, address pool)
+        tick_spacing, pool = decode(["int24", "address"], data)
+        return (_address_bytes(pool), "v3", bytes(topics[1][12:]), bytes(topics[2][12:]),
+                int.from_bytes(topics[3], "big"), tick_spacing, None, log["blockNumber"])
+    # Initialize(PoolId indexed id, Currency indexed currency0, Currency indexed currency1,
+    #            uint24 fee, int24 tickSpacing, IHooks hooks, uint160 sqrtPriceX96, int24 tick)
+    fee, tick_spacing, hooks = decode(["uint24", "int24", "address", "uint160", "int24"], data)[:3]
+    hooks = _address_bytes(hooks)
+    return (bytes(topics[1]), "v4", bytes(topics[2][12:]), bytes(topics[3][12:]), fee, tick_spacing,
+            hooks if any(hooks) else None, log["blockNumber"])
+
+
+class PoolIndex:
+    """Local SQLite index of every Uniswap V3 and V4 pool, keyed by chain and token.
+
+    Filled by ``PoolIndexer`` from factory logs. Lookups are local indexed
+    queries, so finding the pools of a token costs microseconds and no RPC.
+    The database runs in WAL mode with one connection per thread, so the
+    indexer can write while request threads read. The path comes from
+    POOL_INDEX_PATH when the index is first used; until the indexer has
+    created the file, lookups return nothing instead of creating it.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path or os.getenv("POOL_INDEX_PATH", "pool_index.sqlite3")
+
+    def _connection(self, create=False):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        if not create and not os.path.exists(self.path):
+            return None
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        return conn
+
+    # -- writes (PoolIndexer) -- #
+
+    def checkpoint(self, chain_id):
+        """Last block fully indexed for ``chain_id``, or None before the first page."""
+        conn = self._connection()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT block FROM checkpoints WHERE chain_id = ?", (chain_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_page(self, chain_id, rows, to_block):
+        """Store the pools of one page of logs and advance the checkpoint to ``to_block`` atomically.
+
+        Returns the number of pools that were not indexed yet.
+        """
+        conn = self._connection(create=True)
+        with self._write_lock, conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO pools VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(chain_id, *row) for row in rows],
+            )
+            added = conn.total_changes - before
+            conn.execute(
+                "INSERT INTO checkpoints VALUES (?, ?) ON CONFLICT (chain_id) DO UPDATE SET block = excluded.block",
+                (chain_id, to_block),
+            )
+        return added
+
+    def add_pools(self, chain_id, rows):
+        """Store pools found outside the log scan (e.g. asked from the factory); the checkpoint is unchanged."""
+        conn = self._connection(create=True)
+        with self._write_lock, conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO pools VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(chain_id, *row) for row in rows],
+            )
+
+    # -- lookups -- #
+
+    def pools_for_token(self, chain_id, token):
+        """Every indexed pool on ``chain_id`` that has ``token`` on either side."""
+        conn = self._connection()
+        if conn is None:
+            return []
+        token = _address_bytes(token)
+        rows = conn.execute(
+            "SELECT * FROM pools INDEXED BY pools_by_token0 WHERE chain_id = ? AND token0 = ? "
+            "UNION ALL SELECT * FROM pools INDEXED BY pools_by_token1 WHERE chain_id = ? AND token1 = ?",
+            (chain_id, token, chain_id, token),
+        ).fetchall()
+        return [_pool(row) for row in rows]
+
+    def pools_for_pair(self, chain_id, token_a, token_b, version=None):
+        """Indexed pools between two tokens, optionally only ``version`` ("v3" or "v4")."""
+        conn = self._connection()
+        if conn is None:
+            return []
+        token0, token1 = sorted((_address_bytes(token_a), _address_bytes(token_b)))
+        query = "SELECT * FROM pools INDEXED BY pools_by_token0 WHERE chain_id = ? AND token0 = ? AND token1 = ?"
+        params = [chain_id, token0, token1]
+        if version:
+            query += " AND version = ?"
+            params.append(version.lower())
+        return [_pool(row) for row in conn.execute(query, params).fetchall()]
+
+    def route(self, chain_id, token_in, token_out, version=None, fee=None):
+        """Pick the pool a single-hop swap should use, or None if the index has no usable one.
+
+        V4 pools with hooks are skipped, since a hook may reject the router's swap.
+        V3 pools come before V4 ones (the trade path's default), then fee tiers
+        in FEE_PREFERENCE order. The index knows which pools exist, not their
+        liquidity, so this is a best guess for tokens that have a single main pool.
+        """
+        candidates = [
+            pool for pool in self.pools_for_pair(chain_id, token_in, token_out, version)
+            if pool.hooks == ZERO_ADDRESS and (fee is None or pool.fee == fee)
+        ]
+        if not candidates:
+            return None
+
+        def rank(pool):
+            fee_rank = FEE_PREFERENCE.index(pool.fee) if pool.fee in FEE_PREFERENCE else len(FEE_PREFERENCE)
+            return (pool.version != "v3", fee_rank, pool.fee)
+
+        return min(candidates, key=rank)
+
+
+class PoolIndexer:
+    """Streams PoolCreated (V3 factory) and Initialize (V4 PoolManager) logs of one chain into a PoolIndex.
+
+    Each ``eth_getLogs`` page covers both sources over a block range. A page's
+    pools and the new checkpoint are committed in one transaction, so an
+    interrupted sync resumes after the last complete page. The page size
+    doubles after each page that succeeds and halves when the node rejects a
+    range (too many results, range too large, timeout), after which it stays
+    below the rejected size. The index stays
+    ``confirmations`` blocks behind the head, so reorged pool creations are
+    not indexed.
+    """
+
+    def __init__(self, w3, chain_config, index=None, page_blocks=2000, max_page_blocks=50000, confirmations=12):
+        self.w3 = w3
+        self.chain = chain_config
+        self.index = index or pool_index
+        self.page_blocks = page_blocks
+        self.max_page_blocks = max_page_blocks
+        self.confirmations = confirmations
+        self.addresses = [
+            address for address in (chain_config.v3_factory_address, chain_config.v4_pool_manager_address)
+            if address
+        ]
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sync(self, to_block=None):
+        """Index everything up to ``to_block`` (default: the head minus confirmations). Returns pools added."""
+        chain_id = self.chain.chain_id
+        if to_block is None:
+            to_block = self.w3.eth.block_number - self.confirmations
+        checkpoint = self.index.checkpoint(chain_id)
+        from_block = self.chain.pools_start_block if checkpoint is None else checkpoint + 1
+        added = 0
+        while from_block <= to_block and not self._stopped.is_set():
+            page_end = min(from_block + self.page_blocks - 1, to_block)
+            try:
+                with span("pool_index.page"):
+                    logs = self.w3.eth.get_logs({
+                        "fromBlock": from_block,
+                        "toBlock": page_end,
+                        "address": self.addresses,
+                        "topics": [[Web3.to_hex(POOL_CREATED_TOPIC), Web3.to_hex(INITIALIZE_TOPIC)]],
+                    })
+            except (Web3RPCError, requests.Timeout) as e:
+                if page_end == from_block:
+                    raise
+                # Don't grow back to a size the node has rejected
+                self.page_blocks = self.max_page_blocks = max(1, (page_end - from_block + 1) // 2)
+                events.emit(EventType.POOL_INDEX_PAGE_REJECTED, "debug", chain_id=chain_id,
+                            from_block=from_block, to_block=page_end, page_blocks=self.page_blocks, reason=str(e))
+                continue
+            page_added = self.index.add_page(chain_id, [decode_pool_log(log) for log in logs], page_end)
+            added += page_added
+            events.emit(EventType.POOL_INDEX_PAGE, "debug", chain_id=chain_id, from_block=from_block,
+                        to_block=page_end, logs=len(logs), pools_added=page_added)
+            from_block = page_end + 1
+            self.page_blocks = min(self.page_blocks * 2, self.max_page_blocks)
+        events.emit(EventType.POOL_INDEX_SYNCED, chain_id=chain_id, block=from_block - 1, pools_added=added)
+        return added
+
+    def start(self, poll_interval=30.0):
+        """Catch up, then keep following the chain on a daemon thread."""
+
+        def run():
+            while not self._stopped.is_set():
+                try:
+                    self.sync()
+                except Exception as e:
+                    events.emit(EventType.POOL_INDEX_FAILED, "warning", chain_id=self.chain.chain_id,
+                                reason=str(e))
+                self._stopped.wait(poll_interval)
+
+        self._thread = threading.Thread(target=run, name=f"pool-indexer-{self.chain.chain_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+
+pool_index = PoolIndex()
+
+_indexers = {}
+_indexers_lock = threading.Lock()
+
+
+def start_indexers(chain_registry, chain_ids=None):
+    """Start a background PoolIndexer for each chain that doesn't have one yet.
+
+    Configured from POOL_INDEX_PAGE_BLOCKS, POOL_INDEX_CONFIRMATIONS and
+    POOL_INDEX_POLL_SECONDS. Returns {chain_id: PoolIndexer}.
+    """
+    page_blocks = int(os.getenv("POOL_INDEX_PAGE_BLOCKS", "2000"))
+    confirmations = int(os.getenv("POOL_INDEX_CONFIRMATIONS", "12"))
+    poll_interval = float(os.getenv("POOL_INDEX_POLL_SECONDS", "30"))
+    with _indexers_lock:
+        for chain_id in chain_ids or chain_registry.enabled_ids():
+            if chain_id not in _indexers:
+                _indexers[chain_id] = PoolIndexer(
+                    chain_registry.client(chain_id), chain_registry.get(chain_id), page_blocks=page_blocks,
+                    confirmations=confirmations,
+                ).start(poll_interval)
+        return dict(_indexers)
+
+
+if __name__ == "__main__":
+    # Backfill the index once, e.g. `python -m actions.pool_index 8453 10`
+    import sys
+
+    from dotenv import load_dotenv
+
+    from .chains import chain_registry
+
+    load_dotenv()
+    for chain_id in [int(arg) for arg in sys.argv[1:]] or chain_registry.enabled_ids():
+        indexer = PoolIndexer(chain_registry.client(chain_id), chain_registry.get(chain_id),
+                              page_blocks=int(os.getenv("POOL_INDEX_PAGE_BLOCKS", "2000")),
+                              confirmations=int(os.getenv("POOL_INDEX_CONFIRMATIONS", "12")))
+        print(f"chain {chain_id}: {indexer.sync()} pools added, index at {pool_index.path}")
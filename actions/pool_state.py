@@ -0,0 +1,414 @@
+import os
+import threading
+from collections import deque
+
+from eth_abi import decode, encode
+from web3 import Web3
+
+from .chains import chain_registry
+from .event_log import EventType, events
+from .pool_index import FEE_PREFERENCE, ZERO_ADDRESS, pool_index
+from .telemetry import span
+
+V3_SWAP_TOPIC = Web3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)")
+V3_MINT_TOPIC = Web3.keccak(text="Mint(address,address,int24,int24,uint128,uint256,uint256)")
+V3_BURN_TOPIC = Web3.keccak(text="Burn(address,int24,int24,uint128,uint256,uint256)")
+V4_SWAP_TOPIC = Web3.keccak(text="Swap(bytes32,address,int128,int128,uint160,uint128,int24,uint24)")
+V4_MODIFY_LIQUIDITY_TOPIC = Web3.keccak(text="ModifyLiquidity(bytes32,address,int24,int24,int256,bytes32)")
+
+V3_TOPICS = [Web3.to_hex(topic) for topic in (V3_SWAP_TOPIC, V3_MINT_TOPIC, V3_BURN_TOPIC)]
+V4_TOPICS = [Web3.to_hex(topic) for topic in (V4_SWAP_TOPIC, V4_MODIFY_LIQUIDITY_TOPIC)]
+
+SLOT0_SELECTOR = Web3.keccak(text="slot0()")[:4]
+LIQUIDITY_SELECTOR = Web3.keccak(text="liquidity()")[:4]
+GET_SLOT0_SELECTOR = Web3.keccak(text="getSlot0(bytes32)")[:4]
+GET_LIQUIDITY_SELECTOR = Web3.keccak(text="getLiquidity(bytes32)")[:4]
+GET_POOL_SELECTOR = Web3.keccak(text="getPool(address,address,uint24)")[:4]
+DECIMALS_SELECTOR = Web3.keccak(text="decimals()")[:4]
+
+# Tick spacing the V3 factory assigns to each fee tier
+V3_TICK_SPACINGS = {100: 1, 500: 10, 3000: 60, 10000: 200}
+
+Q96 = 2**96
+
+
+def _int24_topic(topic):
+    return decode(["int24"], bytes(topic))[0]
+
+
+class PoolState:
+    """Current price and in-range liquidity of one pool, as of ``block``."""
+
+    __slots__ = ("pool", "sqrt_price_x96", "tick", "liquidity", "block")
+
+    def __init__(self, pool, sqrt_price_x96, tick, liquidity, block):
+        self.pool = pool
+        self.sqrt_price_x96 = sqrt_price_x96
+        self.tick = tick
+        self.liquidity = liquidity
+        self.block = block
+
+    def snapshot(self):
+        return (self.sqrt_price_x96, self.tick, self.liquidity, self.block)
+
+    def restore(self, snapshot):
+        self.sqrt_price_x96, self.tick, self.liquidity, self.block = snapshot
+
+    def copy(self):
+        return PoolState(self.pool, *self.snapshot())
+
+    def price(self, token_in, decimals0, decimals1):
+        """Units of the other token per unit of ``token_in``, adjusted for decimals."""
+        price = (self.sqrt_price_x96 / Q96) ** 2 * 10 ** (decimals0 - decimals1)
+        if token_in.lower() == self.pool.token0:
+            return price
+        return 1 / price if price else 0.0
+
+    def as_dict(self):
+        return {
+            "pool": self.pool.pool,
+            "version": self.pool.version,
+            "fee": self.pool.fee,
+            "tick_spacing": self.pool.tick_spacing,
+            "token0": self.pool.token0,
+            "token1": self.pool.token1,
+            "sqrt_price_x96": self.sqrt_price_x96,
+            "tick": self.tick,
+            "liquidity": self.liquidity,
+            "block": self.block,
+        }
+
+
+class PoolStateTracker:
+    """Keeps the state of watched pools of one chain current from their logs.
+
+    ``watch`` seeds a pool once with two reads (slot0 and liquidity, or
+    StateView's getSlot0/getLiquidity for V4) pinned to the tracker's block.
+    From then on a daemon thread fetches the Swap, Mint and Burn logs (V4:
+    Swap and ModifyLiquidity) of all watched pools with one ``eth_getLogs``
+    per pool version and applies them block by block: a swap sets price,
+    tick and liquidity, and a liquidity change inside the current tick
+    range adjusts liquidity. Reading a state or a spot price is an in-memory
+    lookup.
+
+    Reorgs: the tracker remembers the hash of every head it processed and an
+    undo record for every block whose logs it applied, ``reorg_depth``
+    blocks back. When the last processed head is no longer canonical it
+    walks back to the newest remembered block that still is, undoes every
+    later block and replays from there. A deeper reorg, or a gap of more
+    than ``max_catchup_blocks``, reseeds every pool instead.
+
+    Updates (``watch``, ``poll``) run one at a time and make their RPCs
+    without holding the lock readers take, which is held only while decoded
+    logs or seeded states are applied. A read never waits on the node.
+    """
+
+    def __init__(self, w3, chain_config, index=None, poll_interval=2.0, reorg_depth=64, max_catchup_blocks=1000):
+        self.w3 = w3
+        self.chain = chain_config
+        self.index = index or pool_index
+        self.poll_interval = poll_interval
+        self.reorg_depth = reorg_depth
+        self.max_catchup_blocks = max_catchup_blocks
+        self.block = None
+        self._states = {}
+        # pool id -> block its state was read at, to reseed pools added after a block a reorg rewinds to
+        self._seeded_at = {}
+        self._hashes = {}
+        self._undo = deque()
+        # Pairs already looked up on the V3 factory, so unknown pairs cost the calls once
+        self._discovered = set()
+        # Guards the states readers see; never held during an RPC
+        self._lock = threading.Lock()
+        # Serializes watch and poll, and owns block, _hashes, _undo and _seeded_at
+        self._update_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # -- reads -- #
+
+    def state(self, pool_id):
+        """Copy of the tracked state of a pool (V3 address or V4 pool id), or None."""
+        with self._lock:
+            state = self._states.get(pool_id.lower())
+            return state.copy() if state else None
+
+    def states_for_pair(self, token_a, token_b):
+        token0, token1 = sorted((token_a.lower(), token_b.lower()))
+        with self._lock:
+            return [
+                state.copy() for state in self._states.values()
+                if state.pool.token0 == token0 and state.pool.token1 == token1
+            ]
+
+    def best_pool(self, token_a, token_b):
+        """The tracked hookless pool of the pair with the most in-range liquidity, or None.
+
+        Active liquidity is in the same units for every pool of a pair, so this
+        is the pool where a small trade moves the price least.
+        """
+        states = [
+            state for state in self.states_for_pair(token_a, token_b)
+            if state.pool.hooks == ZERO_ADDRESS and state.liquidity > 0
+        ]
+        return max(states, key=lambda state: state.liquidity).pool if states else None
+
+    def spot_price(self, token_in, token_out, pool_id=None):
+        """Units of ``token_out`` per unit of ``token_in`` in the deepest tracked pool (or ``pool_id``).
+
+        Returns None when no tracked pool prices the pair.
+        """
+        if pool_id is not None:
+            state = self.state(pool_id)
+        else:
+            pool = self.best_pool(token_in, token_out)
+            state = self.state(pool.pool) if pool else None
+        if state is None:
+            return None
+        return state.price(token_in, self.decimals(state.pool.token0), self.decimals(state.pool.token1))
+
+    def decimals(self, token):
+        decimals = self.chain.tokens.decimals(token)
+        if decimals is None:
+            result = self.w3.eth.call({"to": Web3.to_checksum_address(token), "data": DECIMALS_SELECTOR})
+            decimals = decode(["uint8"], result)[0]
+            self.chain.tokens.set_decimals(token, decimals)
+        return decimals
+
+    # -- watching -- #
+
+    def watch_pair(self, token_a, token_b):
+        """Track every pool of the pair known to the pool index, and return their states.
+
+        When the index has none (it was never synced), the V3 factory is asked
+        once for the standard fee tiers and the pools it knows are added to the index.
+        """
+        pools = self.index.pools_for_pair(self.chain.chain_id, token_a, token_b)
+        pair = tuple(sorted((token_a.lower(), token_b.lower())))
+        with self._lock:
+            discover = not pools and pair not in self._discovered
+            if discover:
+                self._discovered.add(pair)
+        if discover:
+            pools = self.discover_v3_pools(token_a, token_b)
+        self.watch(pools)
+        return self.states_for_pair(token_a, token_b)
+
+    def discover_v3_pools(self, token_a, token_b):
+        """Look up the pair's V3 pools at the FEE_PREFERENCE tiers on the factory (one call per tier)."""
+        token0, token1 = sorted((token_a.lower(), token_b.lower()))
+        rows = []
+        for fee in FEE_PREFERENCE:
+            result = self.w3.eth.call({
+                "to": self.chain.v3_factory_address,
+                "data": GET_POOL_SELECTOR + encode(["address", "address", "uint24"], [token0, token1, fee]),
+            })
+            address = decode(["address"], result)[0].lower()
+            if address != ZERO_ADDRESS:
+                rows.append((bytes.fromhex(address[2:]), "v3", bytes.fromhex(token0[2:]), bytes.fromhex(token1[2:]),
+                             fee, V3_TICK_SPACINGS[fee], None, 0))
+        self.index.add_pools(self.chain.chain_id, rows)
+        return self.index.pools_for_pair(self.chain.chain_id, token0, token1, version="v3")
+
+    def watch(self, pools):
+        """Seed and start tracking ``pools`` (index Pool rows); already tracked ones are skipped."""
+        with self._update_lock:
+            if self.block is None:
+                block = self.w3.eth.get_block("latest")
+                self.block = block["number"]
+                self._hashes[self.block] = block["hash"]
+            seeded = {
+                pool.pool: self._seed(pool, self.block) for pool in pools
+                if pool.pool not in self._states and (pool.version != "v4" or self.chain.v4_state_view_address)
+            }
+            with self._lock:
+                self._states.update(seeded)
+            self._seeded_at.update(dict.fromkeys(seeded, self.block))
+            if self._thread is None and self._states:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"pool-state-{self.chain.chain_id}", daemon=True
+                )
+                self._thread.start()
+
+    def _seed(self, pool, block):
+        with span("pool_state.seed"):
+            if pool.version == "v3":
+                to = Web3.to_checksum_address(pool.pool)
+                slot0 = self.w3.eth.call({"to": to, "data": SLOT0_SELECTOR}, block)
+                liquidity = self.w3.eth.call({"to": to, "data": LIQUIDITY_SELECTOR}, block)
+            else:
+                pool_id = bytes.fromhex(pool.pool[2:])
+                to = self.chain.v4_state_view_address
+                slot0 = self.w3.eth.call({"to": to, "data": GET_SLOT0_SELECTOR + pool_id}, block)
+                liquidity = self.w3.eth.call({"to": to, "data": GET_LIQUIDITY_SELECTOR + pool_id}, block)
+        sqrt_price_x96, tick = decode(["uint160", "int24"], slot0[:64])
+        state = PoolState(pool, sqrt_price_x96, tick, decode(["uint128"], liquidity)[0], block)
+        events.emit(EventType.POOL_STATE_SEEDED, "debug", chain_id=self.chain.chain_id, pool=pool.pool,
+                    version=pool.version, tick=tick, liquidity=state.liquidity, block=block)
+        return state
+
+    def _reseed(self, block):
+        self.block = block["number"]
+        self._hashes = {self.block: block["hash"]}
+        self._undo.clear()
+        seeded = {pool_id: self._seed(state.pool, self.block) for pool_id, state in list(self._states.items())}
+        with self._lock:
+            self._states.update(seeded)
+        self._seeded_at.update(dict.fromkeys(seeded, self.block))
+
+    def stop(self):
+        self._stopped.set()
+
+    # -- following the chain -- #
+
+    def _run(self):
+        # Pools are fresh when seeded, so the first poll waits a full interval
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                events.emit(EventType.POOL_STATE_FAILED, "warning", chain_id=self.chain.chain_id, reason=str(e))
+
+    def poll(self):
+        """Apply the logs of every block since the last poll, handling a reorg first if there was one."""
+        if self.block is None:
+            return  # nothing watched yet
+        with self._update_lock, span("pool_state.poll"):
+            head = self.w3.eth.get_block("latest")
+            if head["number"] < self.block or (
+                head["number"] == self.block and head["hash"] == self._hashes.get(self.block)
+            ):
+                return  # nothing new, or a node behind the one we last read (it catches up)
+            if not (head["number"] == self.block + 1 and head["parentHash"] == self._hashes.get(self.block)):
+                canonical = self.w3.eth.get_block(self.block)["hash"] if head["number"] > self.block else None
+                if canonical != self._hashes.get(self.block):
+                    if not self._rewind():
+                        self._reseed(head)
+                        return
+            if head["number"] - self.block > self.max_catchup_blocks:
+                self._reseed(head)
+                return
+            if head["number"] > self.block:
+                self._apply_range(self.block + 1, head["number"])
+            self.block = head["number"]
+            self._hashes[self.block] = head["hash"]
+            while self._hashes and min(self._hashes) < self.block - self.reorg_depth:
+                del self._hashes[min(self._hashes)]
+            while self._undo and self._undo[0][0] < self.block - self.reorg_depth:
+                self._undo.popleft()
+
+    def _rewind(self):
+        """Undo blocks back to the newest remembered block that is still canonical. False if none is."""
+        for number in sorted(self._hashes, reverse=True):
+            if number == self.block:
+                continue
+            if self.w3.eth.get_block(number)["hash"] != self._hashes[number]:
+                continue
+            # Pools first read after the fork point have no undo record, so they are read again at it
+            reseeded = {
+                pool_id: self._seed(self._states[pool_id].pool, number)
+                for pool_id, seeded_at in self._seeded_at.items() if seeded_at > number
+            }
+            undone = 0
+            with self._lock:
+                while self._undo and self._undo[-1][0] > number:
+                    _, snapshots = self._undo.pop()
+                    for pool_id, snapshot in snapshots.items():
+                        self._states[pool_id].restore(snapshot)
+                    undone += 1
+                self._states.update(reseeded)
+            self._seeded_at.update(dict.fromkeys(reseeded, number))
+            events.emit(EventType.POOL_STATE_REORG, "warning", chain_id=self.chain.chain_id,
+                        from_block=self.block, to_block=number, blocks_undone=undone)
+            self._hashes = {n: h for n, h in self._hashes.items() if n <= number}
+            self.block = number
+            return True
+        events.emit(EventType.POOL_STATE_REORG, "warning", chain_id=self.chain.chain_id, from_block=self.block,
+                    to_block=None, blocks_undone=None)
+        return False
+
+    def _apply_range(self, from_block, to_block):
+        v3_pools = [Web3.to_checksum_address(p) for p, s in self._states.items() if s.pool.version == "v3"]
+        v4_pools = [p for p, s in self._states.items() if s.pool.version == "v4"]
+        logs = []
+        if v3_pools:
+            logs += self.w3.eth.get_logs({"fromBlock": from_block, "toBlock": to_block, "address": v3_pools,
+                                          "topics": [V3_TOPICS]})
+        if v4_pools:
+            logs += self.w3.eth.get_logs({"fromBlock": from_block, "toBlock": to_block,
+                                          "address": self.chain.v4_pool_manager_address,
+                                          "topics": [V4_TOPICS, v4_pools]})
+        logs.sort(key=lambda log: (log["blockNumber"], log["logIndex"]))
+        with self._lock:
+            for log in logs:
+                block = log["blockNumber"]
+                if not self._undo or self._undo[-1][0] != block:
+                    self._undo.append((block, {}))
+                if log["topics"][0] in (V4_SWAP_TOPIC, V4_MODIFY_LIQUIDITY_TOPIC):
+                    pool_id = Web3.to_hex(log["topics"][1])
+                else:
+                    pool_id = log["address"].lower()
+                state = self._states.get(pool_id)
+                if state is None:
+                    continue
+                self._undo[-1][1].setdefault(pool_id, state.snapshot())
+                self._apply(state, log)
+                state.block = block
+
+    @staticmethod
+    def _apply(state, log):
+        topic, data = log["topics"][0], bytes(log["data"])
+        if topic == V3_SWAP_TOPIC:
+            _, _, state.sqrt_price_x96, state.liquidity, state.tick = decode(
+                ["int256", "int256", "uint160", "uint128", "int24"], data)
+        elif topic == V4_SWAP_TOPIC:
+            _, _, state.sqrt_price_x96, state.liquidity, state.tick, _ = decode(
+                ["int128", "int128", "uint160", "uint128", "int24", "uint24"], data)
+        elif topic in (V3_MINT_TOPIC, V3_BURN_TOPIC):
+            tick_lower, tick_upper = _int24_topic(log["topics"][2]), _int24_topic(log["topics"][3])
+            if topic == V3_MINT_TOPIC:
+                amount = decode(["address", "uint128", "uint256", "uint256"], data)[1]
+            else:
+                amount = -decode(["uint128", "uint256", "uint256"], data)[0]
+            if tick_lower <= state.tick < tick_upper:
+                state.liquidity += amount
+        elif topic == V4_MODIFY_LIQUIDITY_TOPIC:
+            tick_lower, tick_upper, delta, _ = decode(["int24", "int24", "int256", "bytes32"], data)
+            if tick_lower <= state.tick < tick_upper:
+                state.liquidity += delta
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def tracker_for(chain_id):
+    """Return the chain's pool state tracker, creating it on first use.
+
+    Uses the chain registry's client. Configured from POOL_STATE_POLL_SECONDS
+    and POOL_STATE_REORG_DEPTH. Nothing is polled until a pool is watched.
+    """
+    chain_id = int(chain_id)
+    with _trackers_lock:
+        tracker = _trackers.get(chain_id)
+        if tracker is None:
+            tracker = _trackers[chain_id] = PoolStateTracker(
+                chain_registry.client(chain_id),
+                chain_registry.get(chain_id),
+                poll_interval=float(os.getenv("POOL_STATE_POLL_SECONDS", "2")),
+                reorg_depth=int(os.getenv("POOL_STATE_REORG_DEPTH", "64")),
+            )
+        return tracker
+
+
+def tracked(chain_id):
+    """The chain's tracker if one exists, without creating it (for the trade path)."""
+    return _trackers.get(int(chain_id))
+
+
+def reset_trackers():
+    """Stop and forget every chain's tracker; the next ``tracker_for`` starts from scratch."""
+    with _trackers_lock:
+        for tracker in _trackers.values():
+            tracker.stop()
+        _trackers.clear()
@@ -0,0 +1,283 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+from hexbytes import HexBytes
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# Seconds a reserved nonce stays taken without a transaction being sent with it
+NONCE_RESERVATION_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS nonces (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    nonce INTEGER NOT NULL,
+    reserved_at REAL NOT NULL,
+    sent INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, address, nonce)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS transactions (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    nonce INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    tx TEXT NOT NULL,
+    tx_hashes TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    PRIMARY KEY (chain_id, address, nonce)
+) WITHOUT ROWID;
+"""
+
+StoredTx = namedtuple("StoredTx", "nonce kind tx tx_hashes owner")
+
+
+class LeaseTimeout(TimeoutError):
+    """A lease stayed held by someone else for longer than the caller would wait."""
+
+
+def _json_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return HexBytes(value).to_0x_hex()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class SharedStore:
+    """State shared by every worker process serving the agent, in one SQLite file.
+
+    Holds the agent's conversation checkpoints (see ``checkpointer``),
+    nonce reservations and sent transactions per wallet (see ``TxMonitor``),
+    and named leases with an expiry. The database runs in WAL mode with one
+    connection per thread. Operations that read and then write (taking a
+    lease, reserving a nonce) run in ``BEGIN IMMEDIATE`` transactions, so
+    they are atomic across processes.
+
+    Held leases are renewed by a background thread until released. A lease
+    whose holder died expires after its ``ttl`` and can then be taken over.
+    Each process is one worker, named by ``worker_id``; ``start_heartbeat``
+    keeps the ``worker:<id>`` lease alive so others can tell it is running.
+    """
+
+    def __init__(self, path=None, lease_seconds=30.0):
+        self._path = path
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._held = {}
+        self._held_lock = threading.Lock()
+        self._renewer = None
+
+    @property
+    def path(self):
+        return self._path or os.getenv("SHARED_STORE_PATH", "shared_state.sqlite3")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; multi-statement updates open their own transactions
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE: takes the write lock up front, so a read-then-write can't race another process."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def checkpointer(self):
+        """LangGraph's SqliteSaver on this store's database, so any worker can continue any thread.
+
+        Callers hold the ``thread:<id>`` lease while running a thread, so two
+        workers never extend the same history at once.
+        """
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return SqliteSaver(conn)
+
+    # -- leases -- #
+
+    def try_acquire(self, name, owner, ttl=None):
+        """Take lease ``name`` for ``owner`` if it is free, expired or already ``owner``'s. Returns True on success."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT INTO leases VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires",
+                (name, owner, now + (ttl or self.lease_seconds)),
+            )
+        return True
+
+    def release(self, name, owner):
+        with self._held_lock:
+            self._held.pop(name, None)
+        self._connection().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def holder(self, name):
+        """Owner of lease ``name``, or None if it is free or expired."""
+        row = self._connection().execute(
+            "SELECT owner FROM leases WHERE name = ? AND expires > ?", (name, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    @contextmanager
+    def lease(self, name, wait=None, ttl=None):
+        """Hold lease ``name`` for the enclosed block, waiting up to ``wait`` seconds for it.
+
+        Raises LeaseTimeout if it is still held elsewhere after ``wait`` seconds
+        (None waits forever). The lease is renewed while the block runs.
+        """
+        owner = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        ttl = ttl or self.lease_seconds
+        deadline = None if wait is None else time.monotonic() + wait
+        delay = 0.02
+        while not self.try_acquire(name, owner, ttl):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LeaseTimeout(f"{name} is held by {self.holder(name) or 'another worker'}")
+            time.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, 0.5)
+        self._hold(name, owner, ttl)
+        try:
+            yield owner
+        finally:
+            self.release(name, owner)
+
+    def start_heartbeat(self):
+        """Keep this worker's ``worker:<id>`` lease alive for as long as the process runs."""
+        name = f"worker:{self.worker_id}"
+        self.try_acquire(name, self.worker_id)
+        self._hold(name, self.worker_id, self.lease_seconds)
+
+    def worker_alive(self, worker_id):
+        return self.holder(f"worker:{worker_id}") is not None
+
+    def _hold(self, name, owner, ttl):
+        with self._held_lock:
+            self._held[name] = (owner, ttl)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_held, name="shared-store-leases", daemon=True)
+                self._renewer.start()
+
+    def _renew_held(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._held_lock:
+                held = list(self._held.items())
+            now = time.time()
+            for name, (owner, ttl) in held:
+                try:
+                    self._connection().execute(
+                        "UPDATE leases SET expires = ? WHERE name = ? AND owner = ?", (now + ttl, name, owner)
+                    )
+                except sqlite3.Error:
+                    pass  # retried on the next round, well before the lease expires
+
+    # -- nonces and transactions -- #
+
+    def reserve_nonce(self, chain_id, address, chain_nonce, reservation_seconds=NONCE_RESERVATION_SECONDS):
+        """Reserve the lowest nonce at or above ``chain_nonce`` no worker has sent or recently reserved.
+
+        A reservation that isn't followed by ``record_transaction`` within
+        ``reservation_seconds`` is handed out again, so a trade that failed
+        after taking its nonce doesn't leave a gap that blocks the wallet.
+        """
+        address = address.lower()
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM nonces WHERE chain_id = ? AND address = ? AND nonce < ?",
+                         (chain_id, address, chain_nonce))
+            taken = {
+                nonce for nonce, reserved_at, sent in conn.execute(
+                    "SELECT nonce, reserved_at, sent FROM nonces WHERE chain_id = ? AND address = ?",
+                    (chain_id, address),
+                )
+                if sent or reserved_at > now - reservation_seconds
+            }
+            nonce = chain_nonce
+            while nonce in taken:
+                nonce += 1
+            conn.execute("INSERT OR REPLACE INTO nonces VALUES (?, ?, ?, ?, 0)", (chain_id, address, nonce, now))
+        return nonce
+
+    def release_nonce(self, chain_id, address, nonce):
+        """Drop the reservation of a nonce whose transaction was not sent, so it is handed out next."""
+        self._connection().execute(
+            "DELETE FROM nonces WHERE chain_id = ? AND address = ? AND nonce = ? AND sent = 0",
+            (chain_id, address.lower(), nonce),
+        )
+
+    def record_transaction(self, chain_id, address, nonce, kind, tx, tx_hashes):
+        """Store a sent transaction (or its latest replacement) as owned by this worker."""
+        address = address.lower()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chain_id, address, nonce, kind, json.dumps(tx, default=_json_value),
+                 json.dumps([HexBytes(tx_hash).to_0x_hex() for tx_hash in tx_hashes]), self.worker_id),
+            )
+            conn.execute("INSERT OR REPLACE INTO nonces VALUES (?, ?, ?, ?, 1)", (chain_id, address, nonce, time.time()))
+
+    def claim_transaction(self, chain_id, address, nonce):
+        """Make this worker the owner of a stored transaction, e.g. one left by a worker that stopped."""
+        self._connection().execute(
+            "UPDATE transactions SET owner = ? WHERE chain_id = ? AND address = ? AND nonce = ?",
+            (self.worker_id, chain_id, address.lower(), nonce),
+        )
+
+    def transactions(self, chain_id, address):
+        """Stored transactions of a wallet as {nonce: StoredTx}."""
+        rows = self._connection().execute(
+            "SELECT nonce, kind, tx, tx_hashes, owner FROM transactions WHERE chain_id = ? AND address = ?",
+            (chain_id, address.lower()),
+        )
+        return {
+            nonce: StoredTx(nonce, kind, json.loads(tx), [HexBytes(h) for h in json.loads(hashes)], owner)
+            for nonce, kind, tx, hashes, owner in rows
+        }
+
+    def forget_transaction(self, chain_id, address, nonce):
+        """Drop a transaction whose nonce was mined."""
+        self._connection().execute(
+            "DELETE FROM transactions WHERE chain_id = ? AND address = ? AND nonce = ?",
+            (chain_id, address.lower(), nonce),
+        )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def shared_store():
+    """The process's SharedStore when SHARED_STORE_PATH is set (multi-worker mode), else None."""
+    global _store
+    if not os.getenv("SHARED_STORE_PATH"):
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SharedStore(lease_seconds=float(os.getenv("SHARED_STORE_LEASE_SECONDS", "30")))
+            _store.start_heartbeat()
+    return _store
@@ -0,0 +1,187 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+from web3.middleware import Web3Middleware
+
+# Histogram bucket upper bounds in seconds, spanning a local eth_call up to a slow receipt wait
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_NAME = "xalpha_span_duration_seconds"
+
+
+class Histogram:
+    """Cumulative latency histogram for a single span name."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Process-wide histograms keyed by span name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def render_prometheus(self):
+        """Render every histogram in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {METRIC_NAME} Latency of traced spans (LLM calls, tools, RPC, signing, receipt waits).",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        with self._lock:
+            for name in sorted(self._histograms):
+                histogram = self._histograms[name]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{METRIC_NAME}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_bucket{{span="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{METRIC_NAME}_sum{{span="{name}"}} {histogram.sum}')
+                lines.append(f'{METRIC_NAME}_count{{span="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimings:
+    """Spans recorded while serving a single chat request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._started = time.perf_counter()
+
+    def record(self, name, seconds):
+        with self._lock:
+            entry = self._spans.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += seconds * 1000
+            entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+
+    def breakdown(self):
+        """Return per-span and per-kind (llm, tool, rpc, sign, wait) totals in milliseconds.
+
+        Spans nest (a tool span contains its RPC spans), so kinds overlap and do
+        not add up to the request total.
+        """
+        with self._lock:
+            spans = {name: {key: round(value, 3) for key, value in entry.items()}
+                     for name, entry in self._spans.items()}
+        by_kind = {}
+        for name, entry in spans.items():
+            kind = name.split(".", 1)[0]
+            by_kind[kind] = round(by_kind.get(kind, 0.0) + entry["total_ms"], 3)
+        return {
+            "total_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "by_kind": by_kind,
+            "spans": spans,
+        }
+
+
+registry = MetricsRegistry()
+_current_timings = ContextVar("xalpha_request_timings", default=None)
+
+
+def record_span(name, seconds):
+    """Record a finished span in the process histograms and the current request, if any."""
+    registry.observe(name, seconds)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.record(name, seconds)
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as a span called ``name`` (e.g. "rpc.eth_call", "sign.tx")."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+@contextmanager
+def request_timings():
+    """Collect every span recorded in this context (and contexts copied from it)."""
+    timings = RequestTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+class RpcTimingMiddleware(Web3Middleware):
+    """Records an ``rpc.<method>`` span around every JSON-RPC request."""
+
+    def wrap_make_request(self, make_request):
+        def middleware(method, params):
+            with span(f"rpc.{method}"):
+                return make_request(method, params)
+
+        return middleware
+
+    async def async_wrap_make_request(self, make_request):
+        async def middleware(method, params):
+            with span(f"rpc.{method}"):
+                return await make_request(method, params)
+
+        return middleware
+
+
+def instrument_web3(w3):
+    """Add RPC timing to a Web3 instance. Safe to call more than once."""
+    if "rpc_timing" not in w3.middleware_onion:
+        # Innermost layer, so the span covers the wire call rather than formatting middleware
+        w3.middleware_onion.inject(RpcTimingMiddleware, name="rpc_timing", layer=0)
+    return w3
+
+
+class LatencyCallbackHandler(BaseCallbackHandler):
+    """LangChain callback that records an ``llm.<model>`` span per chat model call."""
+
+    def __init__(self):
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = (time.perf_counter(), _model_name(serialized, kwargs))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = (time.perf_counter(), _model_name(serialized, kwargs))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            record_span(f"llm.{started[1]}", time.perf_counter() - started[0])
+
+
+def _model_name(serialized, kwargs):
+    metadata = kwargs.get("metadata") or {}
+    name = metadata.get("ls_model_name") or (serialized or {}).get("kwargs", {}).get("model")
+    return str(name or "chat").removeprefix("models/")
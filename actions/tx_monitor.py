@@ -0,0 +1,377 @@
+import math
+import os
+import threading
+import time
+
+from web3 import Web3
+
+from .event_log import EventType, events
+from .gas import compute_fee_caps
+from .shared_store import NONCE_RESERVATION_SECONDS, shared_store
+from .telemetry import span
+
+POLICIES = ("speed_up", "cancel", "watch", "off")
+
+# Nodes reject a replacement unless both fee caps rise by at least 10%
+MIN_FEE_BUMP = 0.10
+
+# Polls without a receipt, after the nonce has been used, before a transaction is reported dropped
+RECEIPT_GRACE_POLLS = 3
+
+
+class PendingTx:
+    """A transaction sent from the monitored wallet that has not been mined yet.
+
+    ``tx`` is the unsigned transaction dict, or None for a pending nonce the
+    monitor found on the chain but did not send itself (e.g. from a previous
+    process); those can only be cancelled, not sped up.
+    """
+
+    def __init__(self, nonce, tx, tx_hash, kind, sent_block):
+        self.nonce = nonce
+        self.tx = tx
+        self.kind = kind
+        self.hashes = [tx_hash] if tx_hash is not None else []
+        self.sent_block = sent_block
+        self.replacements = 0
+        self.missing_polls = 0
+
+    @property
+    def tx_hash(self):
+        return self.hashes[-1] if self.hashes else None
+
+
+class TxMonitor:
+    """Background monitor for the pending transactions of one wallet.
+
+    Every transaction sent through ``track`` is remembered by nonce. A daemon
+    thread polls the block number and the wallet's mined nonce while anything
+    is pending and no RPC at all while nothing is. A transaction that is still
+    pending ``stall_blocks`` blocks after it was sent (or last replaced) is
+    handled by the policy:
+
+    - ``speed_up``: re-sign the same transaction with both fee caps raised by
+      ``fee_bump`` (or to the current fee quote, whichever is higher)
+    - ``cancel``: replace it with a 0 ETH self-transfer at the same bumped fees
+    - ``watch``: only report it
+
+    After ``max_replacements`` replacements for a nonce the monitor stops
+    replacing it and only reports. When a nonce is mined, the receipt of
+    whichever version made it in is passed to every receipt listener.
+
+    With a ``store`` (a SharedStore), nonces are reserved in it and sent
+    transactions recorded there, so several worker processes sending from
+    the same wallet never pick the same nonce. A worker only adopts pending
+    nonces whose sender is no longer running, and resumes them with their
+    stored payload.
+    """
+
+    def __init__(self, w3, account, gas_policy=None, policy="speed_up", stall_blocks=5, fee_bump=0.125,
+                 max_replacements=3, poll_interval=2.0, listeners=None, store=None, chain_id=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown tx monitor policy {policy!r}, expected one of {POLICIES}")
+        self.w3 = w3
+        self.account = account
+        self.address = account.address
+        self.gas_policy = gas_policy
+        self.policy = policy
+        self.stall_blocks = stall_blocks
+        self.fee_bump = max(fee_bump, MIN_FEE_BUMP)
+        self.max_replacements = max_replacements
+        self.poll_interval = poll_interval
+        self.listeners = listeners if listeners is not None else []
+        self.store = store
+        self._chain_id = chain_id
+        self._pending = {}
+        # nonce -> time.monotonic() it was handed out, until it is tracked or released
+        self._reserved = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"tx-monitor-{self.address[:10]}", daemon=True
+        )
+        self._thread.start()
+
+    def track(self, tx, tx_hash, kind="tx"):
+        """Start monitoring a transaction that has just been sent."""
+        with self._lock:
+            self._pending[tx["nonce"]] = PendingTx(tx["nonce"], dict(tx), tx_hash, kind, None)
+            self._reserved.pop(tx["nonce"], None)
+        if self.store is not None:
+            self.store.record_transaction(self.chain_id, self.address, tx["nonce"], kind, tx, [tx_hash])
+        self._wake.set()
+
+    @property
+    def chain_id(self):
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
+
+    def next_nonce(self, chain_nonce=None):
+        """Reserve the lowest nonce not pending, tracked or handed out to another caller.
+
+        The nonce stays reserved until ``track`` is called with its transaction,
+        or ``release`` if it wasn't sent, so concurrent trades never get the same
+        one. A reservation neither tracked nor released within
+        NONCE_RESERVATION_SECONDS is handed out again. Pass ``chain_nonce`` when
+        the pending transaction count was already fetched (e.g. by an async
+        client) to skip the RPC.
+        """
+        nonce = chain_nonce if chain_nonce is not None else self.w3.eth.get_transaction_count(self.address, "pending")
+        if self.store is not None:
+            return self.store.reserve_nonce(self.chain_id, self.address, nonce)
+        now = time.monotonic()
+        with self._lock:
+            for reserved, at in list(self._reserved.items()):
+                if reserved < nonce or at < now - NONCE_RESERVATION_SECONDS:
+                    del self._reserved[reserved]
+            while nonce in self._pending or nonce in self._reserved:
+                nonce += 1
+            self._reserved[nonce] = now
+        return nonce
+
+    def release(self, nonce):
+        """Give back a nonce from ``next_nonce`` whose transaction was not sent."""
+        with self._lock:
+            self._reserved.pop(nonce, None)
+        if self.store is not None:
+            self.store.release_nonce(self.chain_id, self.address, nonce)
+
+    def pending(self):
+        """Snapshot of the tracked transactions as {nonce: PendingTx}."""
+        with self._lock:
+            return dict(self._pending)
+
+    def stop(self, timeout=None):
+        """Stop the background thread; with ``timeout``, wait up to that long for a poll in progress to finish."""
+        self._stopped.set()
+        self._wake.set()
+        if timeout is not None:
+            self._thread.join(timeout)
+
+    # -- background thread -- #
+
+    def _run(self):
+        try:
+            self._adopt_pending_nonces()
+        except Exception as e:
+            events.emit(EventType.STUCK_TX_CHECKED, "warning", address=self.address, error=str(e))
+        while not self._stopped.is_set():
+            if not self._pending:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            try:
+                self.poll()
+            except Exception as e:
+                events.emit(EventType.STUCK_TX_CHECKED, "warning", address=self.address, error=str(e))
+            self._stopped.wait(self.poll_interval)
+
+    def _adopt_pending_nonces(self):
+        """Track nonces that are pending on the node but were not sent by this monitor.
+
+        With a store, nonces sent by another running worker are left to it,
+        and those of a stopped worker are taken over with their stored payload.
+        """
+        pending_nonce = self.w3.eth.get_transaction_count(self.address, "pending")
+        latest_nonce = self.w3.eth.get_transaction_count(self.address, "latest")
+        events.emit(EventType.STUCK_TX_CHECKED, "debug", address=self.address,
+                    pending_nonce=pending_nonce, latest_nonce=latest_nonce)
+        stored = self.store.transactions(self.chain_id, self.address) if self.store is not None else {}
+        adopted = False
+        for nonce in range(latest_nonce, pending_nonce):
+            sent = stored.get(nonce)
+            if sent is not None and sent.owner != self.store.worker_id and self.store.worker_alive(sent.owner):
+                continue
+            if sent is not None:
+                self.store.claim_transaction(self.chain_id, self.address, nonce)
+                pending = PendingTx(nonce, sent.tx, None, sent.kind, None)
+                pending.hashes = list(sent.tx_hashes)
+            else:
+                pending = PendingTx(nonce, None, None, "unknown", None)
+            with self._lock:
+                self._pending.setdefault(nonce, pending)
+            adopted = True
+        if adopted:
+            self._wake.set()
+
+    def poll(self):
+        """Run one monitoring pass: settle mined nonces, then handle stalled ones."""
+        block = self.w3.eth.block_number
+        mined_nonce = self.w3.eth.get_transaction_count(self.address, "latest")
+        with self._lock:
+            tracked = sorted(self._pending.values(), key=lambda p: p.nonce)
+
+        for pending in tracked:
+            if pending.nonce < mined_nonce:
+                self._settle(pending)
+                continue
+            if pending.sent_block is None:
+                pending.sent_block = block
+            if block - pending.sent_block < self.stall_blocks:
+                continue
+            self._handle_stall(pending, block)
+
+    def _settle(self, pending):
+        receipt = None
+        for tx_hash in reversed(pending.hashes):
+            receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+            if receipt is not None:
+                break
+        if receipt is None:
+            # The nonce was used by a version we don't know about, or the node hasn't indexed it yet
+            pending.missing_polls += 1
+            if pending.hashes and pending.missing_polls < RECEIPT_GRACE_POLLS:
+                return
+            events.emit(EventType.TX_DROPPED, "warning", nonce=pending.nonce, kind=pending.kind,
+                        tx_hashes=pending.hashes)
+        else:
+            events.emit(EventType.TX_CONFIRMED, nonce=pending.nonce, kind=pending.kind,
+                        tx_hash=receipt["transactionHash"], status=receipt["status"],
+                        gas_used=receipt["gasUsed"], block=receipt["blockNumber"],
+                        replacements=pending.replacements)
+            for listener in self.listeners:
+                try:
+                    listener(pending, receipt)
+                except Exception as e:
+                    events.emit(EventType.RECEIPT_LISTENER_FAILED, "warning", nonce=pending.nonce,
+                                reason=str(e))
+        with self._lock:
+            if self._pending.get(pending.nonce) is pending:
+                del self._pending[pending.nonce]
+        if self.store is not None:
+            self.store.forget_transaction(self.chain_id, self.address, pending.nonce)
+
+    def _handle_stall(self, pending, block):
+        action = self.policy
+        if action == "speed_up" and pending.tx is None:
+            action = "cancel"  # no payload to resend for a nonce we didn't send
+        if pending.replacements >= self.max_replacements:
+            action = "watch"
+        events.emit(EventType.STUCK_TX_DETECTED, "warning", nonce=pending.nonce, kind=pending.kind,
+                    tx_hash=pending.tx_hash, blocks_pending=block - pending.sent_block,
+                    replacements=pending.replacements, action=action)
+        if action == "watch":
+            # Report again after another stall window instead of every poll
+            pending.sent_block = block
+            return
+        try:
+            self.replace(pending, cancel=(action == "cancel"))
+        except Exception as e:
+            # Usually underpriced replacement; the next attempt bumps from a higher level
+            pending.replacements += 1
+            events.emit(EventType.TX_REPLACEMENT_FAILED, "error", nonce=pending.nonce, action=action,
+                        reason=str(e))
+        pending.sent_block = block
+
+    def replacement_fees(self, pending):
+        """Fee caps for replacing ``pending``: the bumped previous caps or the current quote, whichever is higher."""
+        base_fee = self.w3.eth.get_block("latest")["baseFeePerGas"]
+        quoted_max_fee, quoted_priority = compute_fee_caps(base_fee, self.w3.eth.max_priority_fee, self.gas_policy)
+        if pending.tx is None:
+            # Fees of a nonce we didn't send are unknown; escalate from the current quote per attempt
+            multiplier = (1 + self.fee_bump) ** (pending.replacements + 1)
+            return math.ceil(quoted_max_fee * multiplier), math.ceil(quoted_priority * multiplier)
+        multiplier = 1 + self.fee_bump
+        priority = max(math.ceil(pending.tx["maxPriorityFeePerGas"] * multiplier), quoted_priority)
+        max_fee = max(math.ceil(pending.tx["maxFeePerGas"] * multiplier), quoted_max_fee, priority)
+        return max_fee, priority
+
+    def replace(self, pending, cancel=False):
+        """Send a fee-bumped replacement for ``pending``: the same transaction, or a 0 ETH self-transfer."""
+        max_fee, priority = self.replacement_fees(pending)
+        action = "cancel" if cancel or pending.tx is None else "speed_up"
+        if action == "cancel":
+            tx = {
+                "from": self.address,
+                "to": self.address,
+                "value": 0,
+                "gas": 21000,
+                "type": 2,
+                "chainId": pending.tx["chainId"] if pending.tx else self.w3.eth.chain_id,
+                "nonce": pending.nonce,
+            }
+        else:
+            tx = dict(pending.tx)
+        tx["maxFeePerGas"] = max_fee
+        tx["maxPriorityFeePerGas"] = priority
+
+        required = tx["gas"] * max_fee + tx["value"]
+        balance = self.w3.eth.get_balance(self.address)
+        if balance < required:
+            events.emit(EventType.INSUFFICIENT_BALANCE, "error", purpose="replacement", nonce=pending.nonce,
+                        balance_wei=balance, required_wei=required)
+            raise ValueError("insufficient balance for replacement")
+
+        with span("sign.tx"):
+            signed_tx = self.w3.eth.account.sign_transaction(tx, self.account.key)
+        tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        previous = pending.tx_hash
+        pending.tx = tx
+        pending.hashes.append(tx_hash)
+        pending.replacements += 1
+        if self.store is not None:
+            self.store.record_transaction(self.chain_id, self.address, pending.nonce, pending.kind, tx,
+                                          pending.hashes)
+        events.emit(EventType.TX_REPLACED, action=action, nonce=pending.nonce, kind=pending.kind,
+                    tx_hash=tx_hash, replaced_tx_hash=previous, max_fee_per_gas=max_fee,
+                    max_priority_fee_per_gas=priority)
+        return tx_hash
+
+
+# Called with (PendingTx, receipt) for every transaction a monitor sees mined
+receipt_listeners = []
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def add_receipt_listener(callback):
+    """Register ``callback(pending_tx, receipt)`` on every monitor, current and future."""
+    receipt_listeners.append(callback)
+
+
+def stop_monitors(timeout=5.0):
+    """Stop and forget every monitor, waiting for their threads so no receipt listener runs afterwards."""
+    with _monitors_lock:
+        monitors = list(_monitors.values())
+        _monitors.clear()
+    for monitor in monitors:
+        monitor.stop(timeout)
+
+
+def monitor_for(w3, account, gas_policy=None, chain_id=None):
+    """Return the monitor for ``account`` on this web3 client, creating it on first use.
+
+    Configured from TX_MONITOR_POLICY, TX_MONITOR_STALL_BLOCKS, TX_MONITOR_FEE_BUMP,
+    TX_MONITOR_MAX_REPLACEMENTS and TX_MONITOR_POLL_SECONDS. Returns None when
+    the policy is "off", unless a shared store is configured (SHARED_STORE_PATH):
+    then nonces must go through it, so the monitor runs with the "watch" policy.
+    """
+    policy = os.getenv("TX_MONITOR_POLICY", "speed_up").lower()
+    store = shared_store()
+    if policy == "off":
+        if store is None:
+            return None
+        policy = "watch"
+    key = (id(w3), Web3.to_checksum_address(account.address))
+    with _monitors_lock:
+        monitor = _monitors.get(key)
+        # The client is held by the monitor, so its id can't be reused while the entry exists
+        if monitor is None or monitor.w3 is not w3:
+            monitor = TxMonitor(
+                w3,
+                account,
+                gas_policy=gas_policy,
+                policy=policy,
+                stall_blocks=int(os.getenv("TX_MONITOR_STALL_BLOCKS", "5")),
+                fee_bump=float(os.getenv("TX_MONITOR_FEE_BUMP", "0.125")),
+                max_replacements=int(os.getenv("TX_MONITOR_MAX_REPLACEMENTS", "3")),
+                poll_interval=float(os.getenv("TX_MONITOR_POLL_SECONDS", "2")),
+                listeners=receipt_listeners,
+                store=store,
+                chain_id=chain_id,
+            )
+            _monitors[key] = monitor
+    return monitor
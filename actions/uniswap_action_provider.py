@@ -1,11 +1,43 @@
+import json
 from typing import Any
+from pydantic import BaseModel, Field
 from coinbase_agentkit.action_providers import ActionProvider, create_action
 from coinbase_agentkit.wallet_providers import EvmWalletProvider, EthAccountWalletProvider
 from coinbase_agentkit.network import Network
+from .chains import chain_registry
+from .pool_index import pool_index
+from .pool_state import tracked, tracker_for
 from .uniswap_router import Uniswap
 from coinbase_agentkit.action_providers.wow.schemas import WowBuyTokenSchema, WowSellTokenSchema
 
-SUPPORTED_CHAINS = ["8453", "84532"]
+
+class UniswapBuyTokenSchema(WowBuyTokenSchema):
+    """Input schema for buying a token on Uniswap."""
+
+    chain_id: str | None = Field(
+        None, description="Chain ID to trade on, e.g. 8453 for Base. Defaults to the wallet's chain", pattern=r"^\d+$"
+    )
+
+
+class UniswapSellTokenSchema(WowSellTokenSchema):
+    """Input schema for selling a token on Uniswap."""
+
+    chain_id: str | None = Field(
+        None, description="Chain ID to trade on, e.g. 8453 for Base. Defaults to the wallet's chain", pattern=r"^\d+$"
+    )
+
+
+class UniswapPoolStateSchema(BaseModel):
+    """Input schema for reading Uniswap pool state."""
+
+    contract_address: str = Field(..., description="The token contract address to look up pools for")
+    quote_token_address: str | None = Field(
+        None, description="The other token of the pair. Defaults to the chain's WETH"
+    )
+    chain_id: str | None = Field(
+        None, description="Chain ID to read, e.g. 8453 for Base. Defaults to the wallet's chain", pattern=r"^\d+$"
+    )
+
 
 class UniswapActionProvider(ActionProvider[EthAccountWalletProvider]):
     """Provides actions for interacting with Uniswap protocol."""
@@ -13,9 +45,44 @@ class UniswapActionProvider(ActionProvider[EthAccountWalletProvider]):
     def __init__(self):
         """Initialize Uniswap action provider."""
         super().__init__("uniswap", [])
-        self.weth_address = "0x4200000000000000000000000000000000000006"
         self.native_token_address = "0x0000000000000000000000000000000000000000"
-        
+
+    def _uniswap(self, wallet_provider: EthAccountWalletProvider, chain_id: str | None = None) -> Uniswap:
+        """Uniswap client for the wallet's account on ``chain_id`` (defaults to the wallet's chain).
+
+        The wallet's own chain uses the wallet provider's web3 client; any other
+        enabled chain uses the registry's shared client for that chain.
+        """
+        account = wallet_provider.config.account
+        wallet_chain_id = int(wallet_provider.get_network().chain_id)
+        chain_id = int(chain_id) if chain_id else wallet_chain_id
+        if chain_id == wallet_chain_id:
+            web3, provider = wallet_provider.web3, wallet_provider.config.rpc_url
+        elif chain_id in chain_registry:
+            web3, provider = chain_registry.client(chain_id), None
+        else:
+            raise ValueError(f"Chain {chain_id} is not enabled, add it to CHAIN_IDS")
+        return Uniswap(
+            wallet_address=account.address,
+            private_key=account._private_key,
+            provider=provider,
+            web3=web3,
+            chain_id=chain_id,
+        )
+
+    def _pool_params(self, uniswap: Uniswap, from_token: str, to_token: str) -> dict[str, Any]:
+        """Fee tier, pool version and tick spacing of the pool to trade the pair through.
+
+        The deepest pool the pool state tracker follows wins; otherwise the pool
+        index picks one, and the 0.3% V3 pool is the fallback when neither knows the pair.
+        """
+        tracker = tracked(uniswap.chain_id)
+        pool = tracker.best_pool(from_token, to_token) if tracker else None
+        pool = pool or pool_index.route(uniswap.chain_id, from_token, to_token)
+        if pool is None:
+            return {"fee": 3000, "pool_version": "v3"}
+        return {"fee": pool.fee, "pool_version": pool.version, "tick_spacing": pool.tick_spacing}
+
     @create_action(
         name="buy_token",
         description="""
@@ -25,41 +92,35 @@ class UniswapActionProvider(ActionProvider[EthAccountWalletProvider]):
         Inputs:
         - Token contract address
         - Amount of ETH to spend (in wei)
+        - Chain ID (optional, defaults to the wallet's chain)
 
         Important notes:
         - The amount is a string and cannot have any decimal points, since the unit of measurement is wei.
         - Make sure to use the exact amount provided, and if there's any doubt, check by getting more information before continuing with the action.
         - 1 wei = 0.000000000000000001 ETH
         - Minimum purchase amount is 100000000000000 wei (0.0000001 ETH)""",
-        schema=WowBuyTokenSchema,
+        schema=UniswapBuyTokenSchema,
     )
     def buy_token(self, wallet_provider: EthAccountWalletProvider, args: dict[str, Any]) -> str:
         """Buy WOW tokens with ETH.
 
         Args:
             wallet_provider (EthAccountWalletProvider): The wallet provider to buy tokens from.
-            args (dict[str, Any]): Input arguments containing contract_address and amount_eth_in_wei.
+            args (dict[str, Any]): Input arguments containing contract_address, amount_eth_in_wei and optional chain_id.
 
         Returns:
             str: A message containing the purchase details or error message.
 
         """
         try:
-            
-            account = wallet_provider.config.account
-            uniswap = Uniswap(
-                wallet_address=account.address,
-                private_key=account._private_key,
-                provider=wallet_provider.config.rpc_url,  # Used to auto-detect chain
-                web3=wallet_provider.web3
-            )
+
+            uniswap = self._uniswap(wallet_provider, args.get("chain_id"))
             tx_hash = uniswap.make_trade(
-                from_token=self.weth_address,
+                from_token=uniswap.chain_config.weth_address,
                 to_token=args["contract_address"],
                 amount=int(args["amount_eth_in_wei"]),
-                fee=3000,         # e.g., 3000 for a 0.3% Uniswap V3 pool
                 slippage=0.5,     # non-functional right now. 0.5% slippage tolerance
-                pool_version="v3"  # can be "v3" or "v4"
+                **self._pool_params(uniswap, uniswap.chain_config.weth_address, args["contract_address"]),
             )
             # print(f"Swap transaction sent! Tx hash: {tx_hash.hex()}")
             return f"Purchased Uniswap ERC20 token with transaction hash: {tx_hash.hex()}"
@@ -75,46 +136,87 @@ class UniswapActionProvider(ActionProvider[EthAccountWalletProvider]):
         Inputs:
         - WOW token contract address
         - Amount of tokens to sell (in wei)
+        - Chain ID (optional, defaults to the wallet's chain)
 
         Important notes:
         - The amount is a string and cannot have any decimal points, since the unit of measurement is wei.
         - Make sure to use the exact amount provided, and if there's any doubt, check by getting more information before continuing with the action.
         - 1 wei = 0.000000000000000001 ETH
         - Minimum purchase amount to account for slippage is 100000000000000 wei (0.0000001 ETH)""",
-        schema=WowSellTokenSchema,
+        schema=UniswapSellTokenSchema,
     )
     def sell_token(self, wallet_provider: EthAccountWalletProvider, args: dict[str, Any]) -> str:
         """Sell WOW tokens for ETH.
 
         Args:
             wallet_provider (EthAccountWalletProvider): The wallet provider to sell tokens from.
-            args (dict[str, Any]): Input arguments containing contract_address and amount_tokens_in_wei.
+            args (dict[str, Any]): Input arguments containing contract_address, amount_tokens_in_wei and optional chain_id.
 
         Returns:
             str: A message containing the sell details or error message.
 
         """
         try:
-            account = wallet_provider.config.account
-            uniswap = Uniswap(
-                wallet_address=account.address,
-                private_key=account._private_key,
-                provider=wallet_provider.config.rpc_url,  # Used to auto-detect chain
-                web3=wallet_provider.web3
-            )
+            uniswap = self._uniswap(wallet_provider, args.get("chain_id"))
             tx_hash = uniswap.make_trade(
                 from_token=args["contract_address"],
-                to_token=self.weth_address,
-                amount=args["amount_tokens_in_wei"],
-                fee=3000,         # e.g., 3000 for a 0.3% Uniswap V3 pool
+                to_token=uniswap.chain_config.weth_address,
+                amount=int(args["amount_tokens_in_wei"]),
                 slippage=0.5,     # non-functional right now. 0.5% slippage tolerance
-                pool_version="v3"  # can be "v3" or "v4"
+                **self._pool_params(uniswap, args["contract_address"], uniswap.chain_config.weth_address),
             )
-            print(f"Swap transaction sent! Tx hash: {tx_hash.hex()}")
             return f"Sold Uniswap ERC20 token with transaction hash: {tx_hash}"
         except Exception as e:
             return f"Error selling Uniswap ERC20 token: {e!s}"
 
+    @create_action(
+        name="get_pool_state",
+        description="""
+        This tool reads the live state of the Uniswap v3/v4 pools of a token pair without trading: price, tick and
+        in-range liquidity of each pool, and the spot price of the token in the deepest pool.
+
+        Inputs:
+        - Token contract address
+        - Quote token contract address (optional, defaults to WETH)
+        - Chain ID (optional, defaults to the wallet's chain)
+
+        Important notes:
+        - The first request for a pair reads its pools from the chain; after that the pools are followed in the
+          background and answers are instant.
+        - spot_price is the number of quote tokens per token at the current pool price, before fees and price impact.""",
+        schema=UniswapPoolStateSchema,
+    )
+    def get_pool_state(self, wallet_provider: EthAccountWalletProvider, args: dict[str, Any]) -> str:
+        """Report the tracked state of a pair's Uniswap pools.
+
+        Args:
+            wallet_provider (EthAccountWalletProvider): The wallet provider, for its default chain.
+            args (dict[str, Any]): Input arguments containing contract_address, optional quote_token_address and chain_id.
+
+        Returns:
+            str: JSON with the spot price and per-pool state, or an error message.
+
+        """
+        try:
+            chain_id = int(args.get("chain_id") or wallet_provider.get_network().chain_id)
+            if chain_id not in chain_registry:
+                raise ValueError(f"Chain {chain_id} is not enabled, add it to CHAIN_IDS")
+            token = args["contract_address"]
+            quote = args.get("quote_token_address") or chain_registry.get(chain_id).weth_address
+            tracker = tracker_for(chain_id)
+            states = tracker.watch_pair(token, quote)
+            if not states:
+                return f"No Uniswap pools found for {token} / {quote} on chain {chain_id}"
+            return json.dumps({
+                "chain_id": chain_id,
+                "token": token,
+                "quote_token": quote,
+                "spot_price": tracker.spot_price(token, quote),
+                "pools": [state.as_dict() for state in states],
+            })
+        except Exception as e:
+            return f"Error reading Uniswap pool state: {e!s}"
+
     def supports_network(self, network: Network) -> bool:
         """Check if network is supported by WOW protocol.
 
@@ -125,7 +227,11 @@ class UniswapActionProvider(ActionProvider[EthAccountWalletProvider]):
             bool: True if network is supported, False otherwise.
 
         """
-        return network.protocol_family == "evm" and network.chain_id in SUPPORTED_CHAINS
+        return (
+            network.protocol_family == "evm"
+            and network.chain_id is not None
+            and int(network.chain_id) in chain_registry.chains
+        )
 
 
 def uniswap_action_provider() -> UniswapActionProvider:
@@ -4,16 +4,22 @@ from eth_account import Account
 from eth_abi.codec import ABICodec
 from uniswap_universal_router_decoder import FunctionRecipient, RouterCodec
 from eth_account.signers.local import LocalAccount
+import threading
 import time
+from .chains import CHAINS, cache_static_requests, chain_registry
+from .event_log import EventType, events
+from .gas import compute_fee_caps
+from .gas_limits import gas_estimator
+from .pool_index import pool_index
+from .pool_state import tracker_for
+from .telemetry import instrument_web3, span
+from .tx_monitor import monitor_for
 
-# 🚀 Uniswap V4 Universal Router Addresses for Each Chain
-ROUTER_ADDRESSES = {
-    "ethereum": "0x66a9893cc07d91d95644aedd05d03f95e1dba8af",
-    "base": "0x6ff5693b99212da76ad316178a184ab56d299b43",  # Replace with Base UniswapV4 router address
-    "optimism": "0x851116d9223fabed8e56c0e6b8ad0c31d98b3507",  # Replace with Optimism UniswapV4 router address
-    "polygon": "0x1095692a6237d83c6a72f3f5efedb9a670c49223",  # Replace with Polygon UniswapV4 router address
-    "arbitrum": "0xa51afafe0263b40edaef0df8781ea9aa03e381a3",  # Replace with Arbitrum UniswapV4 router address
-}
+# 🚀 Uniswap V4 Universal Router Addresses for Each Chain (by name; actions/chains.py has the full per-chain config)
+ROUTER_ADDRESSES = {config.name: config.router_address for config in CHAINS.values()}
+
+# Tick spacing of the V4 pool used when the pool index doesn't know the pair
+DEFAULT_TICK_SPACING = 60
 
 # ✅ Universal Router ABI (Stored as JSON String)
 UNIVERSAL_ROUTER_ABI_JSON = "[{\"inputs\":[{\"components\":[{\"internalType\":\"address\",\"name\":\"permit2\",\"type\":\"address\"},{\"internalType\":\"address\",\"name\":\"weth9\",\"type\":\"address\"},{\"internalType\":\"address\",\"name\":\"v2Factory\",\"type\":\"address\"},{\"internalType\":\"address\",\"name\":\"v3Factory\",\"type\":\"address\"},{\"internalType\":\"bytes32\",\"name\":\"pairInitCodeHash\",\"type\":\"bytes32\"},{\"internalType\":\"bytes32\",\"name\":\"poolInitCodeHash\",\"type\":\"bytes32\"},{\"internalType\":\"address\",\"name\":\"v4PoolManager\",\"type\":\"address\"},{\"internalType\":\"address\",\"name\":\"v3NFTPositionManager\",\"type\":\"address\"},{\"internalType\":\"address\",\"name\":\"v4PositionManager\",\"type\":\"address\"}],\"internalType\":\"struct RouterParameters\",\"name\":\"params\",\"type\":\"tuple\"}],\"stateMutability\":\"nonpayable\",\"type\":\"constructor\"},{\"inputs\":[],\"name\":\"BalanceTooLow\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"ContractLocked\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"Currency\",\"name\":\"currency\",\"type\":\"address\"}],\"name\":\"DeltaNotNegative\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"Currency\",\"name\":\"currency\",\"type\":\"address\"}],\"name\":\"DeltaNotPositive\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"ETHNotAccepted\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"uint256\",\"name\":\"commandIndex\",\"type\":\"uint256\"},{\"internalType\":\"bytes\",\"name\":\"message\",\"type\":\"bytes\"}],\"name\":\"ExecutionFailed\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"FromAddressIsNotOwner\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InputLengthMismatch\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InsufficientBalance\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InsufficientETH\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InsufficientToken\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"bytes4\",\"name\":\"action\",\"type\":\"bytes4\"}],\"name\":\"InvalidAction\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InvalidBips\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"uint256\",\"name\":\"commandType\",\"type\":\"uint256\"}],\"name\":\"InvalidCommandType\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InvalidEthSender\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InvalidPath\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"InvalidReserves\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"LengthMismatch\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"uint256\",\"name\":\"tokenId\",\"type\":\"uint256\"}],\"name\":\"NotAuthorizedForToken\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"NotPoolManager\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"OnlyMintAllowed\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"SliceOutOfBounds\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"TransactionDeadlinePassed\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"UnsafeCast\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"uint256\",\"name\":\"action\",\"type\":\"uint256\"}],\"name\":\"UnsupportedAction\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V2InvalidPath\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V2TooLittleReceived\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V2TooMuchRequested\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V3InvalidAmountOut\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V3InvalidCaller\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V3InvalidSwap\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V3TooLittleReceived\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V3TooMuchRequested\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"uint256\",\"name\":\"minAmountOutReceived\",\"type\":\"uint256\"},{\"internalType\":\"uint256\",\"name\":\"amountReceived\",\"type\":\"uint256\"}],\"name\":\"V4TooLittleReceived\",\"type\":\"error\"},{\"inputs\":[{\"internalType\":\"uint256\",\"name\":\"maxAmountInRequested\",\"type\":\"uint256\"},{\"internalType\":\"uint256\",\"name\":\"amountRequested\",\"type\":\"uint256\"}],\"name\":\"V4TooMuchRequested\",\"type\":\"error\"},{\"inputs\":[],\"name\":\"V3_POSITION_MANAGER\",\"outputs\":[{\"internalType\":\"contract INonfungiblePositionManager\",\"name\":\"\",\"type\":\"address\"}],\"stateMutability\":\"view\",\"type\":\"function\"},{\"inputs\":[],\"name\":\"V4_POSITION_MANAGER\",\"outputs\":[{\"internalType\":\"contract IPositionManager\",\"name\":\"\",\"type\":\"address\"}],\"stateMutability\":\"view\",\"type\":\"function\"},{\"inputs\":[{\"internalType\":\"bytes\",\"name\":\"commands\",\"type\":\"bytes\"},{\"internalType\":\"bytes[]\",\"name\":\"inputs\",\"type\":\"bytes[]\"}],\"name\":\"execute\",\"outputs\":[],\"stateMutability\":\"payable\",\"type\":\"function\"},{\"inputs\":[{\"internalType\":\"bytes\",\"name\":\"commands\",\"type\":\"bytes\"},{\"internalType\":\"bytes[]\",\"name\":\"inputs\",\"type\":\"bytes[]\"},{\"internalType\":\"uint256\",\"name\":\"deadline\",\"type\":\"uint256\"}],\"name\":\"execute\",\"outputs\":[],\"stateMutability\":\"payable\",\"type\":\"function\"},{\"inputs\":[],\"name\":\"msgSender\",\"outputs\":[{\"internalType\":\"address\",\"name\":\"\",\"type\":\"address\"}],\"stateMutability\":\"view\",\"type\":\"function\"},{\"inputs\":[],\"name\":\"poolManager\",\"outputs\":[{\"internalType\":\"contract IPoolManager\",\"name\":\"\",\"type\":\"address\"}],\"stateMutability\":\"view\",\"type\":\"function\"},{\"inputs\":[{\"internalType\":\"int256\",\"name\":\"amount0Delta\",\"type\":\"int256\"},{\"internalType\":\"int256\",\"name\":\"amount1Delta\",\"type\":\"int256\"},{\"internalType\":\"bytes\",\"name\":\"data\",\"type\":\"bytes\"}],\"name\":\"uniswapV3SwapCallback\",\"outputs\":[],\"stateMutability\":\"nonpayable\",\"type\":\"function\"},{\"inputs\":[{\"internalType\":\"bytes\",\"name\":\"data\",\"type\":\"bytes\"}],\"name\":\"unlockCallback\",\"outputs\":[{\"internalType\":\"bytes\",\"name\":\"\",\"type\":\"bytes\"}],\"stateMutability\":\"nonpayable\",\"type\":\"function\"},{\"stateMutability\":\"payable\",\"type\":\"receive\"}]"
@@ -29,8 +35,106 @@ UNIVERSAL_ROUTER_ABI = json.loads(UNIVERSAL_ROUTER_ABI_JSON)
 PERMIT2_ABI = json.loads(PERMIT2_ABI_JSON)
 ERC20_ABI = json.loads(ERC20_ABI_JSON)
 
+NATIVE_TOKEN_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# Wrapped native token per chain, the input of a buy and the output of a sell
+WETH_ADDRESSES = {config.name: config.weth_address for config in CHAINS.values()}
+
+# RouterCodec() registers its V4 encoders in eth_abi's global registry with an unlocked check-then-add
+_codec_lock = threading.Lock()
+
+
+def new_codec():
+    """A RouterCodec, safe to create from concurrent trades."""
+    with _codec_lock:
+        return RouterCodec()
+
+
+def encode_swap(permit_data, signed_message, from_token, to_token, amount_in_wei, min_amount_out, fee,
+                pool_version, deadline, tick_spacing=DEFAULT_TICK_SPACING):
+    """
+    Encode Universal Router execute() calldata for an exact input swap.
+
+    Args:
+        permit_data, signed_message: Permit2 permit from create_permit_signature
+        from_token (str): Checksum address of the input token
+        to_token (str): Checksum address of the output token
+        amount_in_wei (int): Exact input amount
+        min_amount_out (int): Minimum output amount
+        fee (int): Fee tier (e.g., 3000 for 0.3%)
+        pool_version (str): "v3" or "v4"
+        deadline (int): Unix timestamp after which the router rejects the swap
+        tick_spacing (int): Tick spacing of the V4 pool (part of its pool key)
+    """
+    # Calldata encoding is offline, so the codec does not need our web3 client
+    codec = new_codec()
+
+    if pool_version.lower() == "v3":
+        # Encode V3 swap
+        return (
+            codec.encode.chain()
+            .permit2_permit(permit_data,
+            signed_message)
+            .v3_swap_exact_in(
+            FunctionRecipient.SENDER,
+            amount_in_wei,
+            min_amount_out,
+            [
+                from_token,
+                fee,
+                to_token,
+            ],
+            ).build(deadline)
+        )
+    elif pool_version.lower() == "v4":
+        # Encode V4 swap
+        # v4_pool_key sorts the currencies, so the swap direction follows the address order
+        pool_key = codec.encode.v4_pool_key(
+            from_token,
+            to_token,
+            fee,
+            tick_spacing,
+        )
+        zero_for_one = int(from_token, 16) < int(to_token, 16)
+
+        # Native input (ETH/MATIC) is paid with msg.value, so no Permit2 permit is needed
+        chain = codec.encode.chain()
+        if from_token.lower() != NATIVE_TOKEN_ADDRESS:
+            chain = chain.permit2_permit(permit_data, signed_message)
+        return (
+            chain
+            .v4_swap()
+            .swap_exact_in_single(
+                pool_key=pool_key,
+                zero_for_one=zero_for_one,
+                amount_in=amount_in_wei,
+                amount_out_min=min_amount_out,
+            )
+            .take_all(to_token, 0)
+            .settle_all(from_token, amount_in_wei)
+            .build_v4_swap()
+            .build(deadline)
+        )
+
+    raise ValueError("Unsupported pool_version. Use 'v3' or 'v4'.")
+
+
+def swap_gas_key(chain_id, from_token, to_token, pool_version):
+    """Gas estimator key of a swap: its Universal Router commands as encode_swap builds them, and its tokens."""
+    if pool_version.lower() == "v4":
+        shape = "v4_swap" if from_token.lower() == NATIVE_TOKEN_ADDRESS else "permit2_permit+v4_swap"
+    else:
+        shape = "permit2_permit+v3_swap_exact_in"
+    return (int(chain_id), shape, from_token.lower(), to_token.lower())
+
+
+def approve_gas_key(chain_id, token, spender):
+    """Gas estimator key of an ERC20 approval of ``spender`` (Permit2) on ``token``."""
+    return (int(chain_id), "permit2_approve", token.lower(), spender.lower())
+
+
 class Uniswap:
-    def __init__(self, wallet_address, private_key, provider, web3):
+    def __init__(self, wallet_address, private_key, provider, web3, monitor=None, chain_id=None):
         self.w3=web3
         self.wallet_address = wallet_address
         self.private_key = private_key
@@ -38,46 +142,55 @@ class Uniswap:
         self.address = Web3.to_checksum_address(wallet_address)  # This is what was missing
 
         self.w3 = web3 if web3 else Web3(Web3.HTTPProvider(provider))
+        instrument_web3(self.w3)
+        cache_static_requests(self.w3)
         assert self.w3.is_connected(), "❌ Web3 connection failed"
 
-        # 🟢 Auto-select correct UniswapV4 Universal Router based on L2
-        self.chain = self.get_chain_from_provider(provider)
-        if self.chain not in ROUTER_ADDRESSES:
-            raise ValueError(f"❌ Unsupported chain: {self.chain}")
+        # 🟢 Router, Permit2, WETH, gas policy and token cache of the chain this client is on
+        self.chain_config = chain_registry.get(chain_id if chain_id is not None else self.w3.eth.chain_id)
+        self.chain_id = self.chain_config.chain_id
+        self.chain = self.chain_config.name
 
-        self.router_address = Web3.to_checksum_address(ROUTER_ADDRESSES[self.chain])
+        self.router_address = self.chain_config.router_address
         self.router = self.w3.eth.contract(address=self.router_address, abi=UNIVERSAL_ROUTER_ABI)
 
-        self.permit2 = self.w3.eth.contract(address=Web3.to_checksum_address("0x000000000022D473030F116dDEE9F6B43aC78BA3"), abi=PERMIT2_ABI)
+        self.permit2 = self.w3.eth.contract(address=self.chain_config.permit2_address, abi=PERMIT2_ABI)
 
-        # Check for stuck transaction
-        stuck_nonce = self.check_for_stuck_transactions()
-        if stuck_nonce is not None:
-            print("stuck transaction detected")
-            self.cancel_transaction(stuck_nonce)
-        else:
-            print("No stuck transactions to cancel")
-            time.sleep(1)
-#        stuck_nonce = 1  # Explicitly set the known stuck nonce
-#        self.cancel_transaction(stuck_nonce)
+        # Stuck transactions are handled in the background by the wallet's monitor
+        self.monitor = (monitor if monitor is not None
+                        else monitor_for(self.w3, self.account, self.chain_config.gas_policy, self.chain_id))
 
+    def _next_nonce(self):
+        if self.monitor is not None:
+            return self.monitor.next_nonce()
+        return self.w3.eth.get_transaction_count(self.account.address)
+
+    def _track(self, tx, tx_hash, kind):
+        if self.monitor is not None:
+            self.monitor.track(tx, tx_hash, kind)
+
+    def _send(self, tx):
+        """Sign and send ``tx``; if that fails, its nonce goes back to the monitor for the next trade."""
+        try:
+            with span("sign.tx"):
+                signed_tx = self.w3.eth.account.sign_transaction(tx, self.account.key)
+            return self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        except Exception:
+            if self.monitor is not None:
+                self.monitor.release(tx["nonce"])
+            raise
 
     def get_chain_from_provider(self, provider_url):
         """Detects the blockchain network from the provider URL."""
-        if "base" in provider_url:
-            return "base"
-        elif "optimism" in provider_url:
-            return "optimism"
-        elif "polygon" in provider_url:
-            return "polygon"
-        elif "arbitrum" in provider_url:
-            return "arbitrum"
-        else:
-            return "ethereum"
+        return chain_registry.for_url(provider_url).name
 
     def get_token_decimals(self, token_address):
-        token_contract = self.w3.eth.contract(address=Web3.to_checksum_address(token_address), abi=ERC20_ABI)
-        return token_contract.functions.decimals().call()
+        decimals = self.chain_config.tokens.decimals(token_address)
+        if decimals is None:
+            token_contract = self.w3.eth.contract(address=Web3.to_checksum_address(token_address), abi=ERC20_ABI)
+            decimals = token_contract.functions.decimals().call()
+            self.chain_config.tokens.set_decimals(token_address, decimals)
+        return decimals
 
     def approve_permit2(self, token_address, amount):
         """
@@ -98,33 +211,53 @@ class Uniswap:
             max_approval
         )
         
-        gas_params = self.calculate_gas_parameters(estimated_gas_limit=500000)
-        if not gas_params or not gas_params['has_sufficient_balance']:
-            return False
-
-        tx_params = contract_function.build_transaction({
+        gas_key = approve_gas_key(self.chain_id, token_address, self.permit2.address)
+        gas_limit = gas_estimator.estimate(self.w3, gas_key, {
             "from": self.account.address,
-            "gas": gas_params['estimated_total_wei'],
-            "maxPriorityFeePerGas": gas_params['max_priority_fee_per_gas'],
-            "maxFeePerGas": gas_params['max_fee_per_gas'],
-            "type": 2,
-            "chainId": self.w3.eth.chain_id,
+            "to": token_address,
+            "data": token_contract.encode_abi("approve", args=[self.permit2.address, max_approval]),
             "value": 0,
-            "nonce": self.w3.eth.get_transaction_count(self.account.address),
         })
+        gas_params = self.calculate_gas_parameters(estimated_gas_limit=gas_limit)
+        if not gas_params or not gas_params['has_sufficient_balance']:
+            return False
+
+        nonce = self._next_nonce()
+        try:
+            tx_params = contract_function.build_transaction({
+                "from": self.account.address,
+                "gas": gas_params['estimated_total_wei'],
+                "maxPriorityFeePerGas": gas_params['max_priority_fee_per_gas'],
+                "maxFeePerGas": gas_params['max_fee_per_gas'],
+                "type": 2,
+                "chainId": self.chain_id,
+                "value": 0,
+                "nonce": nonce,
+            })
+        except Exception:
+            if self.monitor is not None:
+                self.monitor.release(nonce)
+            raise
         
-        signed_tx = self.w3.eth.account.sign_transaction(tx_params, self.account.key)
-        tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        print(f"Permit2 token approve transaction hash: {tx_hash.hex()}")
+        tx_hash = self._send(tx_params)
+        events.emit(EventType.TX_SENT, kind="permit2_approve", tx_hash=tx_hash, nonce=tx_params["nonce"],
+                    token=token_address)
+        self._track(tx_params, tx_hash, "permit2_approve")
+        gas_estimator.remember(tx_hash, gas_key, tx_params["gas"])
         
         try:
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
+            with span("wait.receipt"):
+                receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
+            if self.monitor is None:
+                # Without a monitor no receipt listener sees it, so learn from it here
+                gas_estimator.observe(gas_key, receipt.gasUsed, tx_params["gas"], receipt.status)
             if receipt.status == 1:
-                print("Approval transaction confirmed")
+                events.emit(EventType.PERMIT2_APPROVAL_CONFIRMED, tx_hash=tx_hash, block=receipt.blockNumber)
                 time.sleep(2)  # Wait for state update
                 return True
+            events.emit(EventType.PERMIT2_APPROVAL_FAILED, "error", tx_hash=tx_hash, reason="reverted")
         except Exception as e:
-            print(f"Error waiting for approval: {str(e)}")
+            events.emit(EventType.PERMIT2_APPROVAL_FAILED, "error", tx_hash=tx_hash, reason=str(e))
         return False
 
     def create_permit_signature(self, token_address):
@@ -140,9 +273,8 @@ class Uniswap:
             self.router_address
         ).call()
         
-        print("p2_amount, p2_expiration, p2_nonce: ", p2_amount, p2_expiration, p2_nonce)
         
-        codec = RouterCodec()
+        codec = new_codec()
         allowance_amount = 2**160 - 1  # max/infinite
         permit_data, signable_message = codec.create_permit2_signable_message(
             token_address,
@@ -151,9 +283,12 @@ class Uniswap:
             p2_nonce,
             self.router_address,
             codec.get_default_deadline(),
-            self.w3.eth.chain_id,
+            self.chain_id,
         )
-        signed_message = self.account.sign_message(signable_message)
+        with span("sign.permit"):
+            signed_message = self.account.sign_message(signable_message)
+        events.emit(EventType.PERMIT_SIGNED, "debug", token=token_address, p2_amount=p2_amount,
+                    p2_expiration=p2_expiration, p2_nonce=p2_nonce)
         return permit_data, signed_message
 
     def check_permit2_allowance(self, token_address):
@@ -172,14 +307,32 @@ class Uniswap:
             self.permit2.address
         ).call()
         
-        print(f"Current Permit2 allowance: {permit2_allowance}")
+        events.emit(EventType.PERMIT2_ALLOWANCE_CHECKED, "debug", token=token_address, allowance=permit2_allowance)
         
         # Check if allowance is effectively infinite (very large number)
         LARGE_APPROVAL_THRESHOLD = 2**200  # Any number larger than this is considered "infinite"
         
         return permit2_allowance > LARGE_APPROVAL_THRESHOLD
 
-    def make_trade(self, from_token, to_token, amount, fee, slippage, pool_version="v3"):
+    def pool_states(self, token_a, token_b):
+        """Live state (price, tick, liquidity) of the pair's pools from the chain's pool state tracker.
+
+        The first call for a pair reads its pools once; later calls are in-memory lookups.
+        """
+        return tracker_for(self.chain_id).watch_pair(token_a, token_b)
+
+    def spot_price(self, token_in, token_out):
+        """Units of ``token_out`` per unit of ``token_in`` in the deepest pool of the pair, or None."""
+        tracker = tracker_for(self.chain_id)
+        tracker.watch_pair(token_in, token_out)
+        return tracker.spot_price(token_in, token_out)
+
+    def tick_spacing(self, token_a, token_b, fee):
+        """Tick spacing of the hookless V4 pool for the pair at ``fee``, from the pool index (local, no RPC)."""
+        pool = pool_index.route(self.chain_id, token_a, token_b, version="v4", fee=fee)
+        return pool.tick_spacing if pool else DEFAULT_TICK_SPACING
+
+    def make_trade(self, from_token, to_token, amount, fee, slippage, pool_version="v3", tick_spacing=None):
         """
         Execute an exact input swap using Universal Router with RouterCodec.
         
@@ -189,139 +342,96 @@ class Uniswap:
             amount (int): Amount in wei (already converted to smallest unit)
             fee (int): Fee tier (e.g., 3000 for 0.3%)
             slippage (float): Slippage tolerance in percent
+            tick_spacing (int): V4 pool tick spacing, looked up in the pool index when not given
         """
         # Convert addresses to checksum format
         from_token = Web3.to_checksum_address(from_token)
+        events.emit(EventType.TRADE_STARTED, from_token=from_token, to_token=to_token, amount_wei=amount,
+                    fee=fee, slippage=slippage, pool_version=pool_version)
         
         # Check token balance first
         token_contract = self.w3.eth.contract(address=from_token, abi=ERC20_ABI)
         decimals_in = self.get_token_decimals(from_token)
-        print(f"Input amount in wei: {amount}")
-        print(f"Input amount in token: {amount / (10 ** decimals_in)}")
-        print(f"Token decimals: {decimals_in}")
 
         balance = token_contract.functions.balanceOf(self.wallet_address).call()
-        print(f"Token balance in wei: {balance}")
-        print(f"Token balance in token: {balance / (10 ** decimals_in)}")
+        events.emit(EventType.BALANCE_CHECKED, "debug", token=from_token, decimals=decimals_in,
+                    balance_wei=balance, amount_wei=amount)
         
         if balance < amount:
+            events.emit(EventType.TRADE_FAILED, "error", reason="insufficient_token_balance",
+                        balance_wei=balance, amount_wei=amount)
             raise ValueError(f"Insufficient balance. Have: {balance / (10 ** decimals_in)}, Need: {amount / (10 ** decimals_in)}")
 
         # Check for existing Permit2 approval
         has_permit2_allowance = self.check_permit2_allowance(from_token)
         if not has_permit2_allowance:
-            print("Permit2 approval needed. Initiating approval...")
+            events.emit(EventType.PERMIT2_APPROVAL_NEEDED, token=from_token)
             approval_success = self.approve_permit2(from_token, amount)
             if not approval_success:
-                print("Failed to get Permit2 approval")
+                events.emit(EventType.TRADE_FAILED, "error", reason="permit2_approval_failed")
                 return None
             time.sleep(2)  # Wait for approval to be mined
-        else:
-            print("Sufficient Permit2 allowance already exists")
         
         # Create permit signature for the swap
         permit_data, signed_message = self.create_permit_signature(from_token)
         if not permit_data or not signed_message:
-            print("Failed to create permit signature")
+            events.emit(EventType.TRADE_FAILED, "error", reason="permit_signature_failed")
             return None
 
-        print(f"permit_data: {permit_data}")
-        print(f"signed_message: {signed_message}")
-        print(f"amount_in_wei: {amount}")
-
         # Continue with swap logic...
         to_token = Web3.to_checksum_address(to_token)
 
         # Since amount is already in wei, we don't need to convert it
         amount_in_wei = amount
-        
-        # Get token decimals for display purposes only
-        decimals_in = self.get_token_decimals(from_token)
-        print(f"Input amount in wei: {amount_in_wei}")
-        print(f"Input amount in token: {amount_in_wei / (10 ** decimals_in)}")
-        print(f"Token decimals: {decimals_in}")
-
-        # Initialize codec
-        codec = RouterCodec()
 
         #add slippage and correct min_amount_out with calculation using uniswap quoters
         min_amount_out = 0
 
         # Get deadline (current block timestamp + 300 seconds)
         deadline = self.w3.eth.get_block("latest")["timestamp"] + 300
+
+        if tick_spacing is None:
+            tick_spacing = self.tick_spacing(from_token, to_token, fee) if pool_version.lower() == "v4" else DEFAULT_TICK_SPACING
+
+        encoded_data = encode_swap(permit_data, signed_message, from_token, to_token, amount_in_wei,
+                                   min_amount_out, fee, pool_version, deadline, tick_spacing)
+        events.emit(EventType.SWAP_ENCODED, "debug", pool_version=pool_version, deadline=deadline,
+                    min_amount_out=min_amount_out)
         
-        if pool_version.lower() == "v3":
-            # Encode V3 swap
-            encoded_data = (
-                codec.encode.chain()
-                .permit2_permit(permit_data,
-                signed_message)
-                .v3_swap_exact_in(
-                FunctionRecipient.SENDER,
-                amount_in_wei,
-                min_amount_out,
-                [
-                    from_token,
-                    fee,
-                    to_token,
-                ],
-                ).build(deadline)
-            )
-            print(f"amount_in_wei: {amount_in_wei}")
-        elif pool_version.lower() == "v4":
-            # Encode V4 swap
-            tick_spacing = 60  # Default tick spacing, adjust if needed
-            
-            pool_key = codec.encode.v4_pool_key(
-                from_token,
-                to_token,
-                fee,
-                tick_spacing,
-            )
-            
-            # Determine if input is native token (ETH/MATIC)
-            is_native_input = from_token.lower() == "0x0000000000000000000000000000000000000000"
-            
-            encoded_data = (
-                codec.encode.chain()
-                .v4_swap()
-                .swap_exact_in_single(
-                    pool_key=pool_key,
-                    zero_for_one=True,
-                    amount_in=amount_in_wei,
-                    amount_out_min=min_amount_out,
-                )
-                .take_all(to_token, 0)
-                .settle_all(from_token, amount_in_wei)
-                .build_v4_swap()
-                .build_transaction(self.account.address, amount_in_wei if is_native_input else 0, ur_address=self.router_address)
-            )
-        
-        else:
-            raise ValueError("Unsupported pool_version. Use 'v3' or 'v4'.")
-        
-        #calculate gas parameters with estimated gas limit for a permit
-        gas_params = self.calculate_gas_parameters(estimated_gas_limit=500000)  # Higher gas limit for swaps
+        # Gas limit learned for this route shape and pair; the first swap of a kind estimates its exact calldata
+        value = amount_in_wei if from_token.lower() == NATIVE_TOKEN_ADDRESS else 0
+        gas_key = swap_gas_key(self.chain_id, from_token, to_token, pool_version)
+        gas_limit = gas_estimator.estimate(self.w3, gas_key, {
+            "from": self.account.address,
+            "to": self.router_address,
+            "data": encoded_data,
+            "value": value,
+        })
+        gas_params = self.calculate_gas_parameters(estimated_gas_limit=gas_limit, value=value)
         
         if not gas_params or not gas_params['has_sufficient_balance']:
+            events.emit(EventType.TRADE_FAILED, "error", reason="gas_quote_or_balance")
             return None
         # Build transaction
         tx = {
             "from": self.account.address,
             "to": self.router_address,
             "data": encoded_data,
-            "value": amount_in_wei if from_token.lower() == "0x0000000000000000000000000000000000000000" else 0,
-            "nonce": self.w3.eth.get_transaction_count(self.account.address),
-            "gas": gas_params['estimated_total_wei'],  # Use estimated gas from gas_params
+            "value": value,
+            "nonce": self._next_nonce(),
+            "gas": gas_params['estimated_total_wei'],  # Gas limit from the gas estimator
             "maxFeePerGas": gas_params['max_fee_per_gas'],
             "maxPriorityFeePerGas": gas_params['max_priority_fee_per_gas'],
             "type": 2,  # EIP-1559 transaction type
-            "chainId": self.w3.eth.chain_id
+            "chainId": self.chain_id
         }
         
         # Sign and send transaction
-        signed_tx = self.w3.eth.account.sign_transaction(tx, self.account.key)
-        tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        tx_hash = self._send(tx)
+        events.emit(EventType.TX_SENT, kind="swap", tx_hash=tx_hash, nonce=tx["nonce"],
+                    from_token=from_token, to_token=to_token, amount_wei=amount_in_wei)
+        self._track(tx, tx_hash, "swap")
+        gas_estimator.remember(tx_hash, gas_key, tx["gas"])
         
         return tx_hash
   
@@ -348,21 +458,16 @@ class Uniswap:
 
             # ✅ Correct Total Gas Cost Calculation
             total_gas_wei = gas_limit * new_max_fee_per_gas
-            total_gas_eth = Web3.from_wei(total_gas_wei, "ether")
-
-            print(f"🟢 Estimated Total Gas Cost: {total_gas_eth} ETH")
-            print(f"🔹 Max Fee per Gas: {Web3.from_wei(new_max_fee_per_gas, 'gwei')} Gwei")
-            print(f"🔹 Max Priority Fee per Gas: {Web3.from_wei(new_max_priority_fee, 'gwei')} Gwei")
 
             # Check if we have enough balance
             balance = self.w3.eth.get_balance(self.account.address)
-
-            print(f"\nCurrent balance: {Web3.from_wei(balance, 'ether')} ETH")
-            print(f"Required balance: {(total_gas_eth, 'ether')} ETH")
+            events.emit(EventType.GAS_QUOTED, "debug", purpose="cancel", nonce=stuck_nonce,
+                        max_fee_per_gas=new_max_fee_per_gas, max_priority_fee_per_gas=new_max_priority_fee,
+                        gas_limit=gas_limit, total_gas_wei=total_gas_wei, balance_wei=balance)
 
             if balance < total_gas_wei:
-                print(f"ERROR: Insufficient balance for cancellation!")
-                print(f"Need {(total_gas_eth - Web3.from_wei(balance), 'ether')} more ETH")
+                events.emit(EventType.INSUFFICIENT_BALANCE, "error", purpose="cancel", nonce=stuck_nonce,
+                            balance_wei=balance, required_wei=total_gas_wei)
                 return
 
             cancel_tx = {
@@ -373,21 +478,19 @@ class Uniswap:
                 "maxPriorityFeePerGas": new_max_priority_fee,
                 "maxFeePerGas": new_max_fee_per_gas,
                 "type": 2,
-                "chainId": self.w3.eth.chain_id,
+                "chainId": self.chain_id,
                 "nonce": stuck_nonce
             }
 
-            print(f"\nAttempting cancellation with:")
-            print(f"New Max Fee: {Web3.from_wei(new_max_fee_per_gas, 'gwei')} gwei")
-            print(f"New Priority Fee: {Web3.from_wei(new_max_priority_fee, 'gwei')} gwei")
-
-            signed_tx = self.w3.eth.account.sign_transaction(cancel_tx, self.account.key)
+            with span("sign.tx"):
+                signed_tx = self.w3.eth.account.sign_transaction(cancel_tx, self.account.key)
             tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-            print(f"Cancellation transaction hash: {tx_hash.hex()}")
+            events.emit(EventType.TX_SENT, kind="cancel", tx_hash=tx_hash, nonce=stuck_nonce,
+                        max_fee_per_gas=new_max_fee_per_gas)
 
         except Exception as e:
-            print(f"Error: {str(e)}")
-            print("Consider sending more ETH to cover higher gas fees")
+            # Usually underpriced replacement or not enough ETH to cover the higher fees
+            events.emit(EventType.CANCEL_FAILED, "error", nonce=stuck_nonce, reason=str(e))
 
     def check_for_stuck_transactions(self):
         """
@@ -397,27 +500,24 @@ class Uniswap:
         try:
             pending_nonce = self.w3.eth.get_transaction_count(self.account.address, 'pending')
             latest_nonce = self.w3.eth.get_transaction_count(self.account.address, 'latest')
-            
-            print(f"Pending nonce: {pending_nonce}")
-            print(f"Latest nonce: {latest_nonce}")
+            events.emit(EventType.STUCK_TX_CHECKED, "debug", pending_nonce=pending_nonce, latest_nonce=latest_nonce)
             
             if pending_nonce > latest_nonce:
-                print(f"Found stuck transaction with nonce {latest_nonce}")
                 return latest_nonce
             else:
-                print("No stuck transactions found")
                 return None
             
         except Exception as e:
-            print(f"Error checking for stuck transactions: {e}")
+            events.emit(EventType.STUCK_TX_CHECKED, "warning", error=str(e))
             return None
 
-    def calculate_gas_parameters(self, estimated_gas_limit=21000):
+    def calculate_gas_parameters(self, estimated_gas_limit=21000, value=0):
         """
         Calculate optimal gas parameters and check balance sufficiency.
         
         Args:
             estimated_gas_limit (int): Estimated gas limit for the transaction
+            value (int): Wei the transaction sends, which the balance must cover on top of gas
         
         Returns:
             dict: Gas parameters and status, or None if insufficient balance
@@ -432,46 +532,21 @@ class Uniswap:
             # Get current gas values 
             base_fee = self.w3.eth.get_block("latest")["baseFeePerGas"]
             priority_fee = self.w3.eth.max_priority_fee
-
-            # More efficient multipliers for Base network
-            base_multiplier = 1.2   # Reduced from 2
-            priority_multiplier = 1.1  # Reduced from 2
-
-            # Calculate new gas prices (in wei) and convert to integers
-            new_max_fee_per_gas = int(base_fee * base_multiplier + priority_fee * priority_multiplier)
-            new_max_priority_fee = int(priority_fee * priority_multiplier)
-
-            # Set minimum values for Base (in wei)
-            min_max_fee = Web3.to_wei(0.003, 'gwei')  # 0.003 gwei minimum
-            min_priority_fee = Web3.to_wei(0.001, 'gwei')  # 0.001 gwei minimum
-
-            # Use maximum between calculated and minimum values
-            new_max_fee_per_gas = max(new_max_fee_per_gas, min_max_fee)
-            new_max_priority_fee = max(new_max_priority_fee, min_priority_fee)
-
-            # Ensure max fee is higher than priority fee
-            if new_max_fee_per_gas < new_max_priority_fee:
-                new_max_fee_per_gas = new_max_priority_fee * 2
+            new_max_fee_per_gas, new_max_priority_fee = compute_fee_caps(base_fee, priority_fee, self.chain_config.gas_policy)
 
             # Calculate total gas cost
             total_gas_wei = int(estimated_gas_limit * new_max_fee_per_gas)
-            total_gas_eth = Web3.from_wei(total_gas_wei, "ether")
 
             # Get current balance
             balance = self.w3.eth.get_balance(self.account.address)
 
-            # Print gas details
-            print(f"\n🟢 Gas Parameters:")
-            print(f"🔹 Max Fee per Gas: {Web3.from_wei(new_max_fee_per_gas, 'gwei')} Gwei")
-            print(f"🔹 Max Priority Fee per Gas: {Web3.from_wei(new_max_priority_fee, 'gwei')} Gwei")
-            print(f"🔹 Estimated Total Gas Cost: {total_gas_eth} ETH")
-            print(f"🔹 Current Balance: {Web3.from_wei(balance, 'ether')} ETH")
-
-            has_sufficient_balance = balance >= total_gas_wei
+            has_sufficient_balance = balance >= total_gas_wei + value
+            events.emit(EventType.GAS_QUOTED, max_fee_per_gas=int(new_max_fee_per_gas),
+                        max_priority_fee_per_gas=int(new_max_priority_fee), gas_limit=int(estimated_gas_limit),
+                        total_gas_wei=total_gas_wei, balance_wei=balance)
             if not has_sufficient_balance:
-                needed_eth = Web3.from_wei(total_gas_wei - balance, "ether")
-                print(f"⚠️ ERROR: Insufficient balance!")
-                print(f"⚠️ Need {needed_eth} more ETH")
+                events.emit(EventType.INSUFFICIENT_BALANCE, "error", purpose="gas",
+                            balance_wei=balance, required_wei=total_gas_wei + value)
 
             return {
                 'max_fee_per_gas': int(new_max_fee_per_gas),  # Ensure integer
@@ -481,5 +556,5 @@ class Uniswap:
             }
 
         except Exception as e:
-            print(f"Error calculating gas parameters: {str(e)}")
+            events.emit(EventType.GAS_QUOTE_FAILED, "error", reason=str(e))
             return None
\ No newline at end of file
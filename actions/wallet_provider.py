@@ -0,0 +1,42 @@
+from coinbase_agentkit import EthAccountWalletProvider
+from web3 import Web3
+
+from .chains import chain_registry
+from .tx_monitor import monitor_for
+
+
+class MonitoredWalletProvider(EthAccountWalletProvider):
+    """EthAccountWalletProvider whose transactions take their nonce from the wallet's TxMonitor.
+
+    AgentKit's sending actions (ERC20 transfer and approve, native_transfer,
+    wrap_eth and unwrap_eth) all go through ``send_transaction``, which asks
+    the node for the mined nonce. Here the nonce is reserved by the same
+    monitor the Uniswap client uses on this web3 client (and through it the
+    shared store, with several workers), so those actions never reuse the
+    nonce of a pending transaction. Sent transactions are tracked by the
+    monitor like swaps. With TX_MONITOR_POLICY=off and no shared store it
+    behaves like EthAccountWalletProvider.
+    """
+
+    def send_transaction(self, transaction):
+        chain_id = int(self._network.chain_id)
+        config = chain_registry.chains.get(chain_id)
+        monitor = monitor_for(self.web3, self.account, config.gas_policy if config else None, chain_id)
+        if monitor is None:
+            return super().send_transaction(transaction)
+
+        transaction["from"] = self.account.address
+        transaction["chainId"] = chain_id
+        transaction.setdefault("value", 0)
+        transaction["maxPriorityFeePerGas"], transaction["maxFeePerGas"] = self.estimate_fees()
+        transaction["gas"] = int(self.web3.eth.estimate_gas(transaction) * self._gas_limit_multiplier)
+
+        # Reserved last, so a failed fee or gas estimate doesn't hold a nonce
+        transaction["nonce"] = monitor.next_nonce()
+        try:
+            tx_hash = self.web3.eth.send_transaction(transaction)
+        except Exception:
+            monitor.release(transaction["nonce"])
+            raise
+        monitor.track(transaction, tx_hash, "wallet")
+        return Web3.to_hex(tx_hash)
@@ -0,0 +1,440 @@
+import asyncio
+import copy
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables.config import get_config_list
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.prebuilt import ToolNode
+from pydantic import PrivateAttr
+
+from actions.telemetry import span
+
+# Actions that only read chain or oracle state. Anything not listed here is
+# treated as state-changing and keeps the order the model issued it in.
+READ_ONLY_ACTIONS = {
+    "get_allowance",
+    "get_balance",
+    "get_token_address",
+    "fetch_price",
+    "fetch_price_feed",
+    "get_wallet_details",
+    "get_pool_state",
+}
+
+
+# Stems of words asking for something that changes wallet state: the
+# state-changing actions' verbs and their usual synonyms. Chat messages with a
+# word starting with one are never coalesced with other requests.
+STATE_CHANGING_TERMS = tuple(
+    "approv revok transfer send sent pay paid spend spent giv gave tip donat buy bought purchas sell sold swap "
+    "trad exchang convert mov wrap unwrap deposit withdr bridg mint burn stak unstak lend borrow repay claim "
+    "redeem cancel deploy sign".split()
+)
+
+
+def action_name(tool_name):
+    """Strip the AgentKit provider prefix, e.g. "ERC20ActionProvider_get_balance" -> "get_balance"."""
+    return tool_name.rsplit("ActionProvider_", 1)[-1]
+
+
+def is_read_only_tool(tool_name):
+    """Return True if the tool can safely run concurrently with other reads."""
+    return action_name(tool_name) in READ_ONLY_ACTIONS
+
+
+def may_change_state(message):
+    """Return True if a chat message has a word starting with one of the STATE_CHANGING_TERMS stems.
+
+    Stems catch the inflections ("approval", "swapping", "converted"); a
+    read that happens to match ("tips", "movers") only loses coalescing.
+    """
+    return any(word.startswith(STATE_CHANGING_TERMS) for word in re.findall(r"[a-z]+", message.lower()))
+
+
+class StateChanges:
+    """Names of the state-changing tools run in one ``watch_state_changes`` context."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tools = []
+
+    def record(self, tool_name):
+        with self._lock:
+            self.tools.append(tool_name)
+
+
+_current_state_changes = ContextVar("xalpha_state_changes", default=None)
+
+
+@contextmanager
+def watch_state_changes():
+    """Record every state-changing tool the agent runs in this context (and contexts copied from it)."""
+    changes = StateChanges()
+    token = _current_state_changes.set(changes)
+    try:
+        yield changes
+    finally:
+        _current_state_changes.reset(token)
+
+
+def _note_tool_call(call):
+    changes = _current_state_changes.get()
+    if changes is not None and not is_read_only_tool(call["name"]):
+        changes.record(call["name"])
+
+
+def _segments(tool_calls):
+    """Split tool calls into ordered segments.
+
+    Consecutive read-only calls are grouped so they can run together; every
+    state-changing call gets a segment of its own and acts as a barrier.
+    """
+    segments = []
+    for index, call in enumerate(tool_calls):
+        read_only = is_read_only_tool(call["name"])
+        if read_only and segments and segments[-1][0]:
+            segments[-1][1].append(index)
+        else:
+            segments.append((read_only, [index]))
+    return segments
+
+
+class ConcurrentToolNode(ToolNode):
+    """ToolNode that runs independent read-only tool calls concurrently.
+
+    When the model returns several tool calls in one message, runs of read-only
+    calls (balances, prices, allowances) are executed in a bounded thread pool,
+    so the step takes as long as the slowest read instead of the sum. Wallet
+    actions that change state run one at a time, in the order the model issued
+    them, and reads issued after a write only start once that write returns.
+    """
+
+    def __init__(self, tools, *, max_workers=None, **kwargs):
+        super().__init__(tools, **kwargs)
+        self.max_workers = max_workers or int(os.getenv("TOOL_CONCURRENCY", "4"))
+        # Shared by every request served by this agent, so the bound is process wide.
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="agent-tool"
+        )
+
+    def _run_one(self, call, input_type, config):
+        _note_tool_call(call)
+        with span(f"tool.{action_name(call['name'])}"):
+            return super()._run_one(call, input_type, config)
+
+    async def _arun_one(self, call, input_type, config):
+        _note_tool_call(call)
+        with span(f"tool.{action_name(call['name'])}"):
+            return await super()._arun_one(call, input_type, config)
+
+    def _func(self, input, config, *, store=None):
+        tool_calls, input_type = self._parse_input(input, store)
+        config_list = get_config_list(config, len(tool_calls))
+        outputs = [None] * len(tool_calls)
+
+        for read_only, indexes in _segments(tool_calls):
+            if read_only and len(indexes) > 1:
+                futures = {
+                    i: self._executor.submit(
+                        copy_context().run, self._run_one, tool_calls[i], input_type, config_list[i]
+                    )
+                    for i in indexes
+                }
+                for i, future in futures.items():
+                    outputs[i] = future.result()
+            else:
+                for i in indexes:
+                    outputs[i] = self._run_one(tool_calls[i], input_type, config_list[i])
+
+        return self._combine_tool_outputs(outputs, input_type)
+
+    async def _afunc(self, input, config, *, store=None):
+        tool_calls, input_type = self._parse_input(input, store)
+        outputs = [None] * len(tool_calls)
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def run_bounded(call):
+            async with semaphore:
+                return await self._arun_one(call, input_type, config)
+
+        for read_only, indexes in _segments(tool_calls):
+            if read_only and len(indexes) > 1:
+                results = await asyncio.gather(*(run_bounded(tool_calls[i]) for i in indexes))
+                for i, result in zip(indexes, results):
+                    outputs[i] = result
+            else:
+                for i in indexes:
+                    outputs[i] = await self._arun_one(tool_calls[i], input_type, config)
+
+        return self._combine_tool_outputs(outputs, input_type)
+
+
+# Told to the model by every tool that takes a token contract address
+_ADDRESS_FIRST = "Never assume a token address: if only a symbol is given, get it with get_token_address first."
+
+# Short descriptions sent instead of the providers' multi-paragraph ones, by full
+# tool name since two providers have a get_balance. The argument schemas (with
+# their own descriptions) are sent unchanged.
+COMPACT_DESCRIPTIONS = {
+    "ERC20ActionProvider_approve": "Approve a spender to transfer an ERC20 token from the wallet. Amount in whole "
+                                   "units; 0 revokes. " + _ADDRESS_FIRST,
+    "ERC20ActionProvider_get_allowance": "Get the ERC20 allowance the wallet gave a spender. " + _ADDRESS_FIRST,
+    "ERC20ActionProvider_get_balance": "Get the balance of an ERC20 token (contract_address) held by the wallet "
+                                       "or another address. " + _ADDRESS_FIRST,
+    "ERC20ActionProvider_get_token_address": "Get the contract address of a common ERC20 token (USDC, EURC, "
+                                             "CBBTC, ...) by symbol.",
+    "ERC20ActionProvider_transfer": "Transfer an ERC20 token from the wallet to an address. Amount in whole "
+                                    "units. " + _ADDRESS_FIRST,
+    "PythActionProvider_fetch_price": "Fetch the current price for a Pyth price feed ID (get the ID with "
+                                      "fetch_price_feed).",
+    "PythActionProvider_fetch_price_feed": "Find the Pyth price feed ID of a token or asset symbol (BTC, ETH, ...).",
+    "WalletActionProvider_get_balance": "Get the wallet's native currency (ETH) balance. Takes no token address.",
+    "WalletActionProvider_get_wallet_details": "Get the wallet's address, network, chain ID and native balance.",
+    "WalletActionProvider_native_transfer": "Send native currency (ETH) from the wallet to an address. Amount in "
+                                            "whole units.",
+    "WethActionProvider_wrap_eth": "Wrap ETH into WETH. Amount in whole units.",
+    "WethActionProvider_unwrap_eth": "Unwrap WETH into ETH. Amount in whole units.",
+    "UniswapActionProvider_buy_token": "Buy (swap into) a token on Uniswap v3/v4, paying ETH. Amount is an integer "
+                                       "string in wei (1 ETH = 10^18 wei), minimum 100000000000000. Use the exact "
+                                       "amount given. " + _ADDRESS_FIRST,
+    "UniswapActionProvider_sell_token": "Sell (swap) a token for ETH on Uniswap v3/v4. Amount is an integer string "
+                                        "of the token's smallest unit (wei), minimum 100000000000000. Use the "
+                                        "exact amount given. " + _ADDRESS_FIRST,
+    "UniswapActionProvider_get_pool_state": "Read the price, tick and liquidity of a token pair's Uniswap pools and "
+                                            "the token's spot price, without trading. " + _ADDRESS_FIRST,
+}
+
+# Tools offered alongside a selected one because it usually needs them first
+RELATED_ACTIONS = {
+    "fetch_price": ("fetch_price_feed",),
+    "buy_token": ("get_token_address", "get_wallet_details"),
+    "sell_token": ("get_token_address", "get_balance"),
+    "transfer": ("get_token_address", "get_balance"),
+    "approve": ("get_token_address",),
+    "get_pool_state": ("get_token_address",),
+}
+
+# Offered on every model call
+ALWAYS_SELECTED = ("get_wallet_details",)
+
+_STOPWORDS = frozenset(
+    "a an and any are as at be by can do for from get how i in is it me my of on or please the this to "
+    "tool use uses used what when which will with you your".split()
+)
+
+
+def _terms(text):
+    """Lowercased word terms of ``text`` without stopwords, with a plural "s" stripped."""
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word in _STOPWORDS:
+            continue
+        terms.append(word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word)
+    return terms
+
+
+def estimate_tokens(value):
+    """Rough token count of a JSON-serialisable value, at ~4 characters per token."""
+    return math.ceil(len(json.dumps(value, separators=(",", ":"))) / 4)
+
+
+def _message_text(message):
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+class ToolSelector:
+    """Picks the tools worth offering the model for the current turn.
+
+    Every tool is indexed once by the terms of its name and descriptions. The
+    latest user message is scored against that index (BM25) and the tools
+    scoring at least ``cutoff`` of the best score are offered, at most
+    ``max_tools`` of them, plus the tools they usually need first
+    (RELATED_ACTIONS), ALWAYS_SELECTED and every tool called since the
+    previous user message, so a confirmation like "yes, go ahead" keeps the
+    tools of the question before it. A message that matches nothing gets
+    every tool. Offered tools carry their COMPACT_DESCRIPTIONS entry.
+    """
+
+    def __init__(self, tools, max_tools=6, cutoff=0.35):
+        self.max_tools = max_tools
+        self.cutoff = cutoff
+        self.names = [tool.name for tool in tools]
+        self.full_schemas = {tool.name: convert_to_openai_tool(tool) for tool in tools}
+        self.compact_schemas = {}
+        for name, schema in self.full_schemas.items():
+            compact = copy.deepcopy(schema)
+            description = schema["function"].get("description", "")
+            compact["function"]["description"] = (
+                COMPACT_DESCRIPTIONS.get(name) or description.strip().split(".", 1)[0].strip() + "."
+            )
+            self.compact_schemas[name] = compact
+        self.full_tokens = {name: estimate_tokens(schema) for name, schema in self.full_schemas.items()}
+        self.compact_tokens = {name: estimate_tokens(schema) for name, schema in self.compact_schemas.items()}
+
+        self._by_action = {}
+        for name in self.names:
+            self._by_action.setdefault(action_name(name), []).append(name)
+        self._documents = {}
+        for name, schema in self.full_schemas.items():
+            words = action_name(name).replace("_", " ")
+            text = " ".join((words, words, COMPACT_DESCRIPTIONS.get(name, ""),
+                             schema["function"].get("description", "")))
+            self._documents[name] = Counter(_terms(text))
+        self._average_length = sum(sum(doc.values()) for doc in self._documents.values()) / max(len(self.names), 1)
+        document_frequency = Counter(term for doc in self._documents.values() for term in doc)
+        self._idf = {
+            term: math.log(1 + (len(self.names) - count + 0.5) / (count + 0.5))
+            for term, count in document_frequency.items()
+        }
+
+    def _scores(self, query):
+        scores = {}
+        terms = set(_terms(query))
+        for name, doc in self._documents.items():
+            length = sum(doc.values())
+            score = 0.0
+            for term in terms:
+                frequency = doc.get(term)
+                if frequency:
+                    score += self._idf[term] * frequency * 2.2 / (
+                        frequency + 1.2 * (0.25 + 0.75 * length / self._average_length))
+            if score > 0:
+                scores[name] = score
+        return scores
+
+    def select(self, messages):
+        """Names of the tools to offer for ``messages``, in registration order."""
+        last_human = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=None)
+        if last_human is None:
+            return list(self.names)
+        scores = self._scores(_message_text(messages[last_human]))
+        called = {
+            call["name"]
+            for message in messages[last_human:] if isinstance(message, AIMessage)
+            for call in message.tool_calls
+        }
+        if not scores:
+            # Nothing to go on: follow-ups keep the previous turn's tools, anything else sees every tool
+            previous_human = max((i for i, message in enumerate(messages[:last_human])
+                                  if isinstance(message, HumanMessage)), default=0)
+            called |= {
+                call["name"]
+                for message in messages[previous_human:] if isinstance(message, AIMessage)
+                for call in message.tool_calls
+            }
+            if not called:
+                return list(self.names)
+
+        best = max(scores.values(), default=0.0)
+        ranked = sorted((name for name, score in scores.items() if score >= best * self.cutoff),
+                        key=scores.get, reverse=True)[:self.max_tools]
+        selected = set(ranked) | (called & set(self.names))
+        for action in [related for name in ranked for related in RELATED_ACTIONS.get(action_name(name), ())]:
+            selected.update(self._by_action.get(action, ()))
+        for action in ALWAYS_SELECTED:
+            selected.update(self._by_action.get(action, ()))
+        return [name for name in self.names if name in selected]
+
+
+class ToolSelectionReport:
+    """Tool selection of every model call made while serving one chat turn."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = []
+
+    def record(self, offered, available, full_tokens, sent_tokens):
+        with self._lock:
+            self._calls.append((offered, available, full_tokens, sent_tokens))
+
+    def summary(self):
+        """Tools offered per model call and the estimated tool-declaration prompt tokens saved this turn."""
+        with self._lock:
+            calls = list(self._calls)
+        full = sum(call[2] for call in calls)
+        sent = sum(call[3] for call in calls)
+        return {
+            "model_calls": len(calls),
+            "tools_available": calls[0][1] if calls else 0,
+            "tools_offered": [call[0] for call in calls],
+            "tool_prompt_tokens_full": full,
+            "tool_prompt_tokens_sent": sent,
+            "tool_prompt_tokens_saved": full - sent,
+        }
+
+
+_current_report = ContextVar("xalpha_tool_selection_report", default=None)
+
+
+@contextmanager
+def tool_selection_report():
+    """Collect the tool selection of every model call made in this context (and contexts copied from it)."""
+    report = ToolSelectionReport()
+    token = _current_report.set(report)
+    try:
+        yield report
+    finally:
+        _current_report.reset(token)
+
+
+class ToolSelectingChatModel(BaseChatModel):
+    """Chat model wrapper that offers ``llm`` only the tools ``selector`` picks for each call.
+
+    Pass it to create_react_agent in place of the model; all tools still go to
+    the ToolNode, so any tool the model calls can run. ``bind_tools`` is a
+    no-op because the tools are bound per call, with compact descriptions.
+    """
+
+    llm: BaseChatModel
+    selector: Any
+    _bound_by_selection: dict = PrivateAttr(default_factory=dict)
+
+    @property
+    def _llm_type(self):
+        return "tool-selecting"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _bound(self, messages):
+        with span("agent.select_tools"):
+            names = self.selector.select(messages)
+        report = _current_report.get()
+        if report is not None:
+            report.record(
+                len(names), len(self.selector.names),
+                sum(self.selector.full_tokens.values()),
+                sum(self.selector.compact_tokens[name] for name in names),
+            )
+        key = tuple(names)
+        bound = self._bound_by_selection.get(key)
+        if bound is None:
+            # bind_tools may rewrite the schema dicts it's given, so each binding gets its own copies
+            bound = self._bound_by_selection[key] = self.llm.bind_tools(
+                [copy.deepcopy(self.selector.compact_schemas[name]) for name in names]
+            )
+        return bound
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # The wrapped model reports to its own callbacks (LatencyCallbackHandler), so none are passed down
+        message = self._bound(messages).invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = await self._bound(messages).ainvoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
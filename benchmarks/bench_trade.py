@@ -0,0 +1,357 @@
+"""Benchmarks for the Uniswap trade path against the in-process MockChain.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_trade                    # run and compare with baseline.json
+    python -m benchmarks.bench_trade --update-baseline  # run and rewrite baseline.json
+    python -m benchmarks.bench_trade --latency-ms 50 --scenario make_trade_v3
+
+Each scenario reports median/max wall time, RPC requests by method and the
+peak Python allocation of a single run. baseline.json is committed, so a
+change that adds RPC round trips or time shows up in its diff.
+"""
+import argparse
+import asyncio
+import atexit
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+from coinbase_agentkit import EthAccountWalletProvider, EthAccountWalletProviderConfig
+from actions.async_uniswap_router import AsyncUniswap
+from actions.chains import CHAINS
+from actions.event_log import events
+from actions.gas_limits import gas_estimator
+from actions.pool_index import PoolIndex, PoolIndexer
+from actions.pool_state import PoolStateTracker, reset_trackers
+from actions.tx_monitor import stop_monitors
+from actions.uniswap_action_provider import UniswapActionProvider
+from actions.uniswap_router import Uniswap, approve_gas_key, swap_gas_key
+from benchmarks.mock_chain import CHAIN_ID, MockChain, PRIVATE_KEY, PROVIDER_URL, TOKEN_ADDRESS, WETH_ADDRESS
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+TRADE_AMOUNT = 10**15
+# 0.000004 ETH: covers a swap's learned gas limit at the mock's max fee, not the fixed 500000 gas
+LOW_ETH_BALANCE = 4 * 10**12
+# Pool index scenarios: pools spread over this many blocks after the chain's index start block
+INDEX_POOLS = 2000
+INDEX_BLOCKS = 200_000
+INDEX_LOOKUPS = 1000
+# Pool state scenarios: pools tracked and blocks of swaps / liquidity changes applied by one poll
+TRACKED_POOLS = 50
+TRACKED_BLOCKS = 20
+
+_index_dir = tempfile.mkdtemp(prefix="bench-pool-index-")
+atexit.register(shutil.rmtree, _index_dir, ignore_errors=True)
+
+
+def _uniswap(chain):
+    return Uniswap(
+        wallet_address=chain.account.address,
+        private_key=PRIVATE_KEY,
+        provider=PROVIDER_URL,
+        web3=chain.web3(),
+    )
+
+
+def _wallet_provider(chain):
+    """EthAccountWalletProvider whose web3 client talks to the MockChain."""
+    wallet_provider = EthAccountWalletProvider(
+        EthAccountWalletProviderConfig(account=chain.account, chain_id=str(CHAIN_ID), rpc_url=PROVIDER_URL)
+    )
+    wallet_provider.web3 = chain.web3()
+    return wallet_provider
+
+
+def _reset_caches():
+    """Forget what earlier runs cached process-wide, so every run starts from the same state."""
+    # Monitors of earlier runs would otherwise teach the gas estimator from late receipts
+    stop_monitors()
+    gas_estimator.reset()
+    for config in CHAINS.values():
+        config.tokens.clear()
+    reset_trackers()
+
+
+def _warm(chain):
+    """Cache what a server knows after its first trades: the tokens' decimals and gas used per trade kind."""
+    uniswap = _uniswap(chain)
+    for token in (WETH_ADDRESS, TOKEN_ADDRESS):
+        uniswap.get_token_decimals(token)
+        gas_estimator.observe(approve_gas_key(chain.chain_id, token, uniswap.permit2.address), chain.gas_used)
+    for from_token, to_token in ((WETH_ADDRESS, TOKEN_ADDRESS), (TOKEN_ADDRESS, WETH_ADDRESS)):
+        for version in ("v3", "v4"):
+            gas_estimator.observe(swap_gas_key(chain.chain_id, from_token, to_token, version), chain.gas_used)
+
+
+def _gas_parameters(chain):
+    uniswap = _uniswap(chain)
+    return lambda: uniswap.calculate_gas_parameters(estimated_gas_limit=500000)
+
+
+def _approve_permit2(chain):
+    uniswap = _uniswap(chain)
+    _warm(chain)
+    return lambda: uniswap.approve_permit2(TOKEN_ADDRESS, TRADE_AMOUNT)
+
+
+def _make_trade(version):
+    def setup(chain):
+        uniswap = _uniswap(chain)
+        _warm(chain)
+        return lambda: uniswap.make_trade(WETH_ADDRESS, TOKEN_ADDRESS, TRADE_AMOUNT, 3000, 0.5, version)
+    return setup
+
+
+def _first_trade_of_kind(chain):
+    """make_trade with nothing cached yet: token decimals are read and the gas limit comes from eth_estimateGas."""
+    uniswap = _uniswap(chain)
+    return lambda: uniswap.make_trade(WETH_ADDRESS, TOKEN_ADDRESS, TRADE_AMOUNT, 3000, 0.5, "v3")
+
+
+def _async_make_trade(version):
+    def setup(chain):
+        uniswap = asyncio.run(AsyncUniswap.create(
+            wallet_address=chain.account.address,
+            private_key=PRIVATE_KEY,
+            provider=PROVIDER_URL,
+            web3=chain.async_web3(),
+            sync_web3=chain.web3(),
+        ))
+        _warm(chain)
+        return lambda: asyncio.run(uniswap.make_trade(WETH_ADDRESS, TOKEN_ADDRESS, TRADE_AMOUNT, 3000, 0.5, version))
+    return setup
+
+
+def _action(name, args):
+    def setup(chain):
+        provider, wallet_provider = UniswapActionProvider(), _wallet_provider(chain)
+        _warm(chain)
+        # Uniswap is constructed inside the action, so its setup cost is part of the measurement
+        return lambda: getattr(provider, name)(wallet_provider, args)
+    return setup
+
+
+def _seeded_index(chain):
+    """PoolIndexer over a MockChain holding INDEX_POOLS pool creations, with an empty index file."""
+    config = CHAINS[chain.chain_id]
+    chain.block_number = config.pools_start_block + INDEX_BLOCKS
+    for i in range(INDEX_POOLS):
+        token = "0x" + (i + 1).to_bytes(20, "big").hex()
+        chain.create_pool(WETH_ADDRESS, token, fee=(3000, 500, 10000)[i % 3],
+                          version="v4" if i % 4 == 0 else "v3",
+                          block=config.pools_start_block + i * INDEX_BLOCKS // INDEX_POOLS)
+    chain.create_pool(WETH_ADDRESS, TOKEN_ADDRESS, block=config.pools_start_block)
+    index = PoolIndex(tempfile.mktemp(suffix=".sqlite3", dir=_index_dir))
+    return PoolIndexer(chain.web3(), config, index=index, confirmations=0), index
+
+
+def _index_sync(chain):
+    indexer, _ = _seeded_index(chain)
+    return indexer.sync
+
+
+def _index_route(chain):
+    indexer, index = _seeded_index(chain)
+    indexer.sync()
+    return lambda: [index.route(CHAIN_ID, TOKEN_ADDRESS, WETH_ADDRESS) for _ in range(INDEX_LOOKUPS)][-1]
+
+
+def _tracked_pools(chain):
+    """PoolStateTracker seeded with TRACKED_POOLS indexed pools (every fifth one V4) of the mock chain."""
+    config = CHAINS[chain.chain_id]
+    chain.block_number = config.pools_start_block + 1
+    pools = [
+        chain.create_pool(WETH_ADDRESS, "0x" + (i + 1).to_bytes(20, "big").hex(), version="v4" if i % 5 == 0 else "v3")
+        for i in range(TRACKED_POOLS)
+    ]
+    index = PoolIndex(tempfile.mktemp(suffix=".sqlite3", dir=_index_dir))
+    PoolIndexer(chain.web3(), config, index=index, confirmations=0).sync()
+    tracker = PoolStateTracker(chain.web3(), config, index=index, poll_interval=3600)
+    tracker.watch(index.pools_for_token(chain.chain_id, WETH_ADDRESS))
+    return tracker, pools
+
+
+def _pool_state_poll(chain):
+    tracker, pools = _tracked_pools(chain)
+    for block in range(TRACKED_BLOCKS):
+        pool = pools[block % len(pools)]
+        chain.swap(pool, 2**96 + block, block)
+        chain.modify_liquidity(pool, -600, 600, 10**15)
+
+    def run():
+        tracker.poll()
+        return tracker.block
+    return run
+
+
+def _pool_state_spot_price(chain):
+    tracker, _ = _tracked_pools(chain)
+    token = "0x" + (1).to_bytes(20, "big").hex()
+    # The first lookup reads both tokens' decimals; the timed ones are the steady state
+    tracker.spot_price(token, WETH_ADDRESS)
+    return lambda: [tracker.spot_price(token, WETH_ADDRESS) for _ in range(INDEX_LOOKUPS)][-1]
+
+
+# name -> (MockChain overrides, setup(chain) -> zero-argument callable to time)
+SCENARIOS = {
+    "calculate_gas_parameters": ({}, _gas_parameters),
+    "approve_permit2": ({"permit2_approved": False}, _approve_permit2),
+    "make_trade_v3": ({}, _make_trade("v3")),
+    "make_trade_v3_needs_approval": ({"permit2_approved": False}, _make_trade("v3")),
+    "make_trade_v4": ({}, _make_trade("v4")),
+    "make_trade_v3_first_of_kind": ({}, _first_trade_of_kind),
+    # Enough ETH for the learned gas limit, not for the fixed 500000 gas reserved before
+    "make_trade_v3_low_eth_balance": ({"eth_balance": LOW_ETH_BALANCE}, _make_trade("v3")),
+    "async_make_trade_v3": ({}, _async_make_trade("v3")),
+    "async_make_trade_v3_needs_approval": ({"permit2_approved": False}, _async_make_trade("v3")),
+    "action_buy_token": (
+        {}, _action("buy_token", {"contract_address": TOKEN_ADDRESS, "amount_eth_in_wei": str(TRADE_AMOUNT)}),
+    ),
+    "action_sell_token": (
+        {}, _action("sell_token", {"contract_address": TOKEN_ADDRESS, "amount_tokens_in_wei": str(TRADE_AMOUNT)}),
+    ),
+    # Full backfill against an RPC that caps eth_getLogs at 10k blocks, then INDEX_LOOKUPS local lookups
+    "pool_index_sync": ({"max_log_range": 10_000}, _index_sync),
+    "pool_index_route_x1000": ({}, _index_route),
+    # One poll applying TRACKED_BLOCKS blocks of events to TRACKED_POOLS pools, then 1000 in-memory spot prices
+    "pool_state_poll": ({}, _pool_state_poll),
+    "pool_state_spot_price_x1000": ({}, _pool_state_spot_price),
+}
+
+
+def _run_once(name, latency, trace_allocations=False):
+    chain_kwargs, setup = SCENARIOS[name]
+    chain = MockChain(latency=latency, **chain_kwargs)
+    _reset_caches()
+    with redirect_stdout(io.StringIO()):
+        run = setup(chain)
+    chain.reset_counts()
+
+    if trace_allocations:
+        tracemalloc.start()
+    started = time.perf_counter()
+    error = None
+    try:
+        with redirect_stdout(io.StringIO()):
+            result = run()
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if trace_allocations:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    if error is None and (result is None or result is False):
+        error = f"returned {result!r}"
+    elif isinstance(result, str) and result.startswith("Error"):
+        error = result
+    return elapsed, dict(chain.calls), peak, error
+
+
+def run_scenario(name, latency, iterations):
+    """Time ``iterations`` runs, then do one traced run for allocations (tracing skews wall time)."""
+    walls, calls, error = [], {}, None
+    for _ in range(iterations):
+        elapsed, calls, _, run_error = _run_once(name, latency)
+        walls.append(elapsed)
+        error = error or run_error
+    _, _, peak, _ = _run_once(name, latency, trace_allocations=True)
+    return {
+        "wall_ms_median": round(statistics.median(walls) * 1000, 1),
+        "wall_ms_max": round(max(walls) * 1000, 1),
+        "rpc_total": sum(calls.values()),
+        "rpc_calls": dict(sorted(calls.items())),
+        "peak_alloc_kib": round(peak / 1024, 1),
+        "failed": error is not None,
+        "error": error[:200] if error else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print changes against the baseline and return the names of regressed scenarios."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            print(f"{name}: new scenario, no baseline")
+            continue
+        notes = []
+        if current["rpc_total"] > previous["rpc_total"]:
+            notes.append(f"rpc_total {previous['rpc_total']} -> {current['rpc_total']}")
+        for method in sorted(set(current["rpc_calls"]) | set(previous["rpc_calls"])):
+            before, after = previous["rpc_calls"].get(method, 0), current["rpc_calls"].get(method, 0)
+            if before != after:
+                notes.append(f"{method} {before} -> {after}")
+        if current["wall_ms_median"] > previous["wall_ms_median"] * (1 + tolerance):
+            notes.append(f"wall_ms_median {previous['wall_ms_median']} -> {current['wall_ms_median']}")
+        if current["failed"] and not previous["failed"]:
+            notes.append("now fails")
+        regressed = (
+            current["rpc_total"] > previous["rpc_total"]
+            or current["wall_ms_median"] > previous["wall_ms_median"] * (1 + tolerance)
+            or (current["failed"] and not previous["failed"])
+        )
+        if regressed:
+            regressions.append(name)
+        status = "REGRESSION" if regressed else ("changed" if notes else "ok")
+        print(f"{name}: {status}" + (f" ({'; '.join(notes)})" if notes else ""))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Uniswap trade path against MockChain.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable). Defaults to all.")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Injected latency per RPC request.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative wall-time increase before flagging a regression.")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    # Events are still formatted and written, just not onto the results table
+    events.stream = open(os.devnull, "w")
+    names = args.scenario or list(SCENARIOS)
+    latency = args.latency_ms / 1000
+    results = {}
+    for name in names:
+        results[name] = run_scenario(name, latency, args.iterations)
+        r = results[name]
+        print(f"{name:32} {r['wall_ms_median']:>9.1f} ms  rpc={r['rpc_total']:<3} "
+              f"alloc={r['peak_alloc_kib']:>8.1f} KiB" + (f"  FAILED: {r['error']}" if r["failed"] else ""))
+
+    config = {"latency_ms": args.latency_ms, "iterations": args.iterations}
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        scenarios = dict(baseline.get("scenarios", {})) if baseline.get("config") == config else {}
+        scenarios.update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"config": config, "scenarios": scenarios}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+
+    if not baseline:
+        print("No baseline yet; run with --update-baseline to create one.")
+        return 0
+    if baseline.get("config") != config:
+        print(f"Baseline was recorded with {baseline.get('config')}, this run used {config}; "
+              "wall times are not comparable.")
+    return 1 if compare(results, baseline, args.tolerance) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+"""In-process JSON-RPC stand-in for benchmarking the Uniswap trade path.
+
+MockChain answers the RPC methods the trade path uses from memory, with mock
+ERC20, Permit2 and Universal Router contracts, and sleeps for a configurable
+latency per request so RPC round trips cost something. Every request is
+counted by method; requests made by background threads (tx monitor, pool
+state tracker, pool indexer) are counted separately so they don't show up
+as trade-path round trips.
+
+With ``auto_mine=False`` sent transactions wait in a mempool until ``mine``
+is called, and replacements must raise both fee caps by 10%, like a node.
+``create_pool`` adds V3 PoolCreated / V4 Initialize logs for the pool
+indexer, and ``max_log_range`` makes eth_getLogs reject wider block ranges
+the way hosted RPCs do. ``swap`` and ``modify_liquidity`` mine pool events
+and ``reorg`` replaces recent blocks, for the pool state tracker.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from collections import Counter
+
+import rlp
+from eth_abi import decode, encode
+from eth_account import Account
+from web3 import AsyncWeb3, Web3
+from web3._utils.caching import async_handle_request_caching, handle_request_caching
+from web3.providers.async_base import AsyncBaseProvider
+from web3.providers.base import BaseProvider
+
+from actions.chains import CHAINS
+from actions.pool_index import INITIALIZE_TOPIC, POOL_CREATED_TOPIC
+from actions.pool_state import (
+    V3_BURN_TOPIC,
+    V3_MINT_TOPIC,
+    V3_SWAP_TOPIC,
+    V4_MODIFY_LIQUIDITY_TOPIC,
+    V4_SWAP_TOPIC,
+)
+
+CHAIN_ID = 8453
+# "base" in the URL makes Uniswap.get_chain_from_provider pick the Base router
+PROVIDER_URL = "http://base.mock-chain.local"
+WETH_ADDRESS = "0x4200000000000000000000000000000000000006"
+TOKEN_ADDRESS = "0x00000000000000000000000000000000000c0ffe"
+PERMIT2_ADDRESS = "0x000000000022D473030F116dDEE9F6B43aC78BA3"
+# Deterministic throwaway key so runs (and baselines) are reproducible
+PRIVATE_KEY = "0x" + "11" * 32
+
+MAX_UINT256 = 2**256 - 1
+
+# Requests from threads with these name prefixes are counted in background_calls
+BACKGROUND_THREADS = ("tx-monitor", "pool-state", "pool-indexer")
+
+
+def _selector(signature):
+    return Web3.keccak(text=signature)[:4].hex().removeprefix("0x")
+
+
+SELECTORS = {
+    _selector("decimals()"): "decimals",
+    _selector("balanceOf(address)"): "balanceOf",
+    _selector("allowance(address,address)"): "erc20_allowance",
+    _selector("approve(address,uint256)"): "approve",
+    _selector("allowance(address,address,address)"): "permit2_allowance",
+    _selector("slot0()"): "slot0",
+    _selector("liquidity()"): "liquidity",
+    _selector("getSlot0(bytes32)"): "getSlot0",
+    _selector("getLiquidity(bytes32)"): "getLiquidity",
+    _selector("getPool(address,address,uint24)"): "getPool",
+}
+
+
+def _hex(value):
+    return value if isinstance(value, str) else Web3.to_hex(value)
+
+
+def _topic(address):
+    return bytes(12) + bytes.fromhex(address.removeprefix("0x"))
+
+
+class RpcError(Exception):
+    """Error returned to the client as a JSON-RPC error response."""
+
+    def __init__(self, message, code=-32000):
+        super().__init__(message)
+        self.code = code
+
+
+class MockChain:
+    """Chain state shared by one or more MockChainProvider instances."""
+
+    def __init__(self, latency=0.0, method_latency=None, decimals=18,
+                 token_balance=10**24, eth_balance=10**20, permit2_approved=True,
+                 base_fee=Web3.to_wei(0.01, "gwei"), priority_fee=Web3.to_wei(0.001, "gwei"),
+                 gas_used=180000, auto_mine=True, chain_id=CHAIN_ID, max_log_range=None):
+        self.latency = latency
+        self.method_latency = method_latency or {}
+        self.decimals = decimals
+        self.token_balance = token_balance
+        self.eth_balance = eth_balance
+        self.base_fee = base_fee
+        self.priority_fee = priority_fee
+        self.gas_used = gas_used
+        self.auto_mine = auto_mine
+        self.chain_id = chain_id
+        self.max_log_range = max_log_range
+        self.logs = []
+        # Pools created with create_pool: id -> {version, sqrt_price_x96, tick, liquidity}
+        self.pool_states = {}
+        self.v3_pools = {}
+        self._pool_history = {}
+        self.forks = []
+        self.fork_id = 0
+        self.account = Account.from_key(PRIVATE_KEY)
+        self.block_number = 1_000_000
+        self.nonce = 0
+        self.receipts = {}
+        self.sent = []
+        # nonce -> sent entry, for transactions not mined yet (auto_mine=False)
+        self.mempool = {}
+        # (owner, spender) -> amount, for every token
+        self.erc20_allowances = {}
+        if permit2_approved:
+            self.erc20_allowances[(self.account.address.lower(), PERMIT2_ADDRESS.lower())] = MAX_UINT256
+        self.calls = Counter()
+        self.background_calls = Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.background_calls.clear()
+
+    def provider(self):
+        return MockChainProvider(self)
+
+    def web3(self):
+        return Web3(self.provider())
+
+    def async_web3(self):
+        return AsyncWeb3(AsyncMockChainProvider(self))
+
+    # -- JSON-RPC -- #
+
+    def handle(self, method, params):
+        delay = self._count(method)
+        if delay:
+            time.sleep(delay)
+        return self._dispatch(method, params)
+
+    async def async_handle(self, method, params):
+        delay = self._count(method)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._dispatch(method, params)
+
+    def _count(self, method):
+        background = threading.current_thread().name.startswith(BACKGROUND_THREADS)
+        with self._lock:
+            (self.background_calls if background else self.calls)[method] += 1
+        return self.method_latency.get(method, self.latency)
+
+    def _dispatch(self, method, params):
+        handler = getattr(self, f"_rpc_{method}", None)
+        if handler is None:
+            raise NotImplementedError(f"MockChain does not implement {method}")
+        with self._lock:
+            return handler(*params)
+
+    def _rpc_web3_clientVersion(self):
+        return "MockChain/v1"
+
+    def _rpc_eth_chainId(self):
+        return hex(self.chain_id)
+
+    def _rpc_eth_blockNumber(self):
+        return hex(self.block_number)
+
+    def _rpc_eth_getBlockByNumber(self, block, full_transactions=False):
+        number = self.block_number if block in ("latest", "pending") else int(block, 16)
+        return {
+            "number": hex(number),
+            "hash": self._block_hash(number),
+            "parentHash": self._block_hash(number - 1),
+            "timestamp": hex(1_700_000_000 + number * 2),
+            "baseFeePerGas": hex(self.base_fee),
+            "gasLimit": hex(30_000_000),
+            "gasUsed": hex(15_000_000),
+            "transactions": [],
+        }
+
+    def _rpc_eth_maxPriorityFeePerGas(self):
+        return hex(self.priority_fee)
+
+    def _rpc_eth_getBalance(self, address, block="latest"):
+        return hex(self.eth_balance)
+
+    def _rpc_eth_getTransactionCount(self, address, block="latest"):
+        if block == "pending" and self.mempool:
+            return hex(max(self.nonce, max(self.mempool) + 1))
+        return hex(self.nonce)
+
+    def _rpc_eth_estimateGas(self, tx, block="latest"):
+        return hex(self.gas_used)
+
+    def _rpc_eth_call(self, tx, block="latest"):
+        data = tx.get("data") or tx.get("input") or "0x"
+        selector, args = data[2:10], bytes.fromhex(data[10:])
+        name = SELECTORS.get(selector)
+        if name == "decimals":
+            return "0x" + encode(["uint8"], [self.decimals]).hex()
+        if name == "balanceOf":
+            return "0x" + encode(["uint256"], [self.token_balance]).hex()
+        if name == "erc20_allowance":
+            owner, spender = decode(["address", "address"], args)
+            amount = self.erc20_allowances.get((owner.lower(), spender.lower()), 0)
+            return "0x" + encode(["uint256"], [amount]).hex()
+        if name == "permit2_allowance":
+            return "0x" + encode(["uint160", "uint48", "uint48"], [0, 0, 0]).hex()
+        if name in ("slot0", "liquidity", "getSlot0", "getLiquidity"):
+            state = self.pool_states[tx["to"].lower() if name in ("slot0", "liquidity") else "0x" + args.hex()]
+            if name in ("liquidity", "getLiquidity"):
+                return "0x" + encode(["uint128"], [state["liquidity"]]).hex()
+            return "0x" + encode(["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"],
+                                 [state["sqrt_price_x96"], state["tick"], 0, 1, 1, 0, True]).hex()
+        if name == "getPool":
+            token0, token1, fee = decode(["address", "address", "uint24"], args)
+            pool = self.v3_pools.get((token0.lower(), token1.lower(), fee), "0x" + "00" * 20)
+            return "0x" + encode(["address"], [pool]).hex()
+        raise NotImplementedError(f"MockChain eth_call: unknown selector 0x{selector}")
+
+    def _rpc_eth_sendRawTransaction(self, raw):
+        payload = bytes.fromhex(raw.removeprefix("0x"))
+        # EIP-1559: 0x02 || rlp([chainId, nonce, maxPriorityFee, maxFee, gas, to, value, data, accessList, v, r, s])
+        fields = rlp.decode(payload[1:])
+        nonce = int.from_bytes(fields[1], "big")
+        if nonce < self.nonce:
+            raise RpcError("nonce too low")
+        tx = {
+            "hash": "0x" + Web3.keccak(payload).hex().removeprefix("0x"),
+            "to": "0x" + fields[5].hex(),
+            "nonce": nonce,
+            "max_priority_fee": int.from_bytes(fields[2], "big"),
+            "max_fee": int.from_bytes(fields[3], "big"),
+            "data": fields[7],
+        }
+        replaced = self.mempool.get(nonce)
+        if replaced and (tx["max_fee"] < replaced["max_fee"] * 1.1
+                         or tx["max_priority_fee"] < replaced["max_priority_fee"] * 1.1):
+            raise RpcError("replacement transaction underpriced")
+        self.sent.append(tx)
+        if self.auto_mine:
+            self._include(tx)
+        else:
+            self.mempool[nonce] = tx
+        return tx["hash"]
+
+    def mine(self, blocks=1, include_pending=True):
+        """Advance the chain by ``blocks``, first including mempool transactions in nonce order."""
+        with self._lock:
+            if include_pending:
+                while self.nonce in self.mempool:
+                    self._include(self.mempool.pop(self.nonce))
+                    blocks -= 1
+            self.block_number += max(blocks, 0)
+
+    def _include(self, tx):
+        data = tx["data"]
+        if data[:4].hex() == _selector("approve(address,uint256)"):
+            spender, amount = decode(["address", "uint256"], data[4:])
+            self.erc20_allowances[(self.account.address.lower(), spender.lower())] = amount
+        self.nonce = max(self.nonce, tx["nonce"] + 1)
+        self.block_number += 1
+        self.receipts[tx["hash"]] = {
+            "transactionHash": tx["hash"],
+            "transactionIndex": "0x0",
+            "blockNumber": hex(self.block_number),
+            "blockHash": "0x" + self.block_number.to_bytes(32, "big").hex(),
+            "from": self.account.address,
+            "to": tx["to"],
+            "status": "0x1",
+            "gasUsed": hex(self.gas_used),
+            "cumulativeGasUsed": hex(self.gas_used),
+            "effectiveGasPrice": hex(self.base_fee + self.priority_fee),
+            "logs": [],
+            "logsBloom": "0x" + "00" * 256,
+            "contractAddress": None,
+            "type": "0x2",
+        }
+
+    def create_pool(self, token_a, token_b, fee=3000, tick_spacing=60, version="v3", block=None, hooks=None,
+                    sqrt_price_x96=2**96, tick=0, liquidity=10**18):
+        """Emit the log of a new pool: PoolCreated from the V3 factory or Initialize from the V4 PoolManager.
+
+        Returns the pool address (V3) or pool id (V4), which ``swap`` and ``modify_liquidity`` take.
+        """
+        config = CHAINS[self.chain_id]
+        token0, token1 = sorted((token_a.lower(), token_b.lower()))
+        index = len(self.logs)
+        if version == "v3":
+            pool = "0x" + Web3.keccak(text=f"pool-{index}")[-20:].hex()
+            self.v3_pools[(token0, token1, fee)] = pool
+            self._log(config.v3_factory_address, [POOL_CREATED_TOPIC, _topic(token0), _topic(token1),
+                                                  fee.to_bytes(32, "big")],
+                      encode(["int24", "address"], [tick_spacing, pool]), block)
+        else:
+            pool = Web3.to_hex(Web3.keccak(text=f"pool-{index}"))
+            self._log(config.v4_pool_manager_address, [INITIALIZE_TOPIC, pool, _topic(token0), _topic(token1)],
+                      encode(["uint24", "int24", "address", "uint160", "int24"],
+                             [fee, tick_spacing, hooks or "0x" + "00" * 20, sqrt_price_x96, tick]), block)
+        self.pool_states[pool] = {"version": version, "sqrt_price_x96": sqrt_price_x96, "tick": tick,
+                                  "liquidity": liquidity}
+        return pool
+
+    def swap(self, pool, sqrt_price_x96, tick, liquidity=None):
+        """Mine a block with a swap that moves ``pool`` to a new price (and optionally liquidity)."""
+        with self._lock:
+            self.block_number += 1
+            state = self._record(pool)
+            state.update(sqrt_price_x96=sqrt_price_x96, tick=tick,
+                         liquidity=state["liquidity"] if liquidity is None else liquidity)
+            sender = _topic(self.account.address)
+            if state["version"] == "v3":
+                self._log(pool, [V3_SWAP_TOPIC, sender, sender],
+                          encode(["int256", "int256", "uint160", "uint128", "int24"],
+                                 [1, -1, sqrt_price_x96, state["liquidity"], tick]))
+            else:
+                self._log(CHAINS[self.chain_id].v4_pool_manager_address, [V4_SWAP_TOPIC, pool, sender],
+                          encode(["int128", "int128", "uint160", "uint128", "int24", "uint24"],
+                                 [1, -1, sqrt_price_x96, state["liquidity"], tick, 3000]))
+
+    def modify_liquidity(self, pool, tick_lower, tick_upper, delta):
+        """Mine a block adding (V3 Mint) or removing (V3 Burn) ``delta`` liquidity over a tick range."""
+        with self._lock:
+            self.block_number += 1
+            state = self._record(pool)
+            if tick_lower <= state["tick"] < tick_upper:
+                state["liquidity"] += delta
+            owner = _topic(self.account.address)
+            ticks = [encode(["int24"], [tick_lower]), encode(["int24"], [tick_upper])]
+            if state["version"] == "v4":
+                self._log(CHAINS[self.chain_id].v4_pool_manager_address, [V4_MODIFY_LIQUIDITY_TOPIC, pool, owner],
+                          encode(["int24", "int24", "int256", "bytes32"], [tick_lower, tick_upper, delta, bytes(32)]))
+            elif delta >= 0:
+                self._log(pool, [V3_MINT_TOPIC, owner, *ticks],
+                          encode(["address", "uint128", "uint256", "uint256"], [self.account.address, delta, 0, 0]))
+            else:
+                self._log(pool, [V3_BURN_TOPIC, owner, *ticks], encode(["uint128", "uint256", "uint256"], [-delta, 0, 0]))
+
+    def reorg(self, depth, replacement_swaps=()):
+        """Replace the last ``depth`` blocks with a fork: their logs are gone, and their hashes change.
+
+        Pool states go back to the fork point; ``replacement_swaps`` are
+        (pool, sqrt_price_x96, tick) swaps mined on the new branch.
+        """
+        with self._lock:
+            fork_block = self.block_number - depth + 1
+            self.logs = [log for log in self.logs if int(log["blockNumber"], 16) < fork_block]
+            for pool, history in self._pool_history.items():
+                before = [(block, snapshot) for block, snapshot in history if block < fork_block]
+                if len(before) < len(history):
+                    self.pool_states[pool].update(history[len(before)][1])
+                history[:] = before
+            self.fork_id += 1
+            self.forks.append((fork_block, self.fork_id))
+            self.block_number = fork_block - 1
+        for pool, sqrt_price_x96, tick in replacement_swaps:
+            self.swap(pool, sqrt_price_x96, tick)
+        with self._lock:
+            self.block_number = max(self.block_number, fork_block - 1 + depth)
+
+    def _record(self, pool):
+        """Remember the pool's state before a change in the current block, for reorg()."""
+        state = self.pool_states[pool]
+        self._pool_history.setdefault(pool, []).append((self.block_number, dict(state)))
+        return state
+
+    def _block_hash(self, number):
+        fork_id = 0
+        for fork_block, fork in self.forks:
+            if number >= fork_block:
+                fork_id = fork
+        if not fork_id:
+            return "0x" + number.to_bytes(32, "big").hex()
+        return Web3.to_hex(Web3.keccak(number.to_bytes(32, "big") + fork_id.to_bytes(32, "big")))
+
+    def _log(self, address, topics, data, block=None):
+        block = self.block_number if block is None else block
+        index = len(self.logs)
+        self.logs.append({
+            "address": address.lower(),
+            "topics": [_hex(topic) for topic in topics],
+            "data": "0x" + data.hex(),
+            "blockNumber": hex(block),
+            "blockHash": self._block_hash(block),
+            "transactionHash": Web3.to_hex(Web3.keccak(text=f"log-tx-{index}-{self.fork_id}")),
+            "transactionIndex": "0x0",
+            "logIndex": hex(index),
+            "removed": False,
+        })
+
+    def _rpc_eth_getLogs(self, log_filter):
+        from_block, to_block = int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16)
+        if self.max_log_range and to_block - from_block + 1 > self.max_log_range:
+            raise RpcError(f"block range too large, max {self.max_log_range}")
+        addresses = log_filter.get("address") or []
+        addresses = {a.lower() for a in ([addresses] if isinstance(addresses, str) else addresses)}
+        topics = [[t] if isinstance(t, str) else t for t in log_filter.get("topics") or []]
+        return [
+            log for log in self.logs
+            if from_block <= int(log["blockNumber"], 16) <= to_block
+            and (not addresses or log["address"] in addresses)
+            and all(not wanted or (i < len(log["topics"]) and log["topics"][i] in wanted)
+                    for i, wanted in enumerate(topics))
+        ]
+
+    def _rpc_eth_getTransactionReceipt(self, tx_hash):
+        return self.receipts.get(tx_hash)
+
+    def _rpc_eth_getTransactionByHash(self, tx_hash):
+        return None
+
+
+class MockChainProvider(BaseProvider):
+    """web3 provider that serves requests from a MockChain instead of the network."""
+
+    def __init__(self, chain):
+        super().__init__()
+        self.chain = chain
+
+    @handle_request_caching
+    def make_request(self, method, params):
+        request_id = next(self.chain._ids)
+        try:
+            return {"jsonrpc": "2.0", "id": request_id, "result": self.chain.handle(method, params)}
+        except NotImplementedError as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32601, "message": str(e)}}
+        except RpcError as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+
+    def is_connected(self, show_traceback=False):
+        # A real HTTPProvider spends a web3_clientVersion round trip on this
+        self.make_request("web3_clientVersion", [])
+        return True
+
+
+class AsyncMockChainProvider(AsyncBaseProvider):
+    """AsyncWeb3 provider for MockChain; latency is awaited, so concurrent requests overlap."""
+
+    def __init__(self, chain):
+        super().__init__()
+        self.chain = chain
+
+    @async_handle_request_caching
+    async def make_request(self, method, params):
+        request_id = next(self.chain._ids)
+        try:
+            return {"jsonrpc": "2.0", "id": request_id, "result": await self.chain.async_handle(method, params)}
+        except NotImplementedError as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32601, "message": str(e)}}
+        except RpcError as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+
+    async def is_connected(self, show_traceback=False):
+        await self.make_request("web3_clientVersion", [])
+        return True
@@ -5,7 +5,6 @@ import time
 from coinbase_agentkit import (
     AgentKit,
     AgentKitConfig,
-    EthAccountWalletProvider,
     EthAccountWalletProviderConfig,
     erc20_action_provider,
     pyth_action_provider,
@@ -15,6 +14,12 @@ from coinbase_agentkit import (
 )
 # from actions.trade_actions import uniswap_action_provider # Commenting out the previous provider
 from actions.uniswap_action_provider import uniswap_action_provider # Fixed import path
+from actions.chains import chain_registry
+from actions.pool_index import start_indexers
+from actions.shared_store import shared_store
+from actions.telemetry import LatencyCallbackHandler
+from actions.wallet_provider import MonitoredWalletProvider
+from agent_tools import ConcurrentToolNode, ToolSelectingChatModel, ToolSelector
 from coinbase_agentkit_langchain import get_langchain_tools
 from dotenv import load_dotenv
 from eth_account import Account
@@ -37,17 +42,27 @@ def initialize_agent(config: EthAccountWalletProviderConfig, thread_id: str = "E
     llm = ChatGoogleGenerativeAI(
         model="gemini-2.0-flash",
         google_api_key=os.getenv("GOOGLE_API_KEY"),
-        temperature=0.7
+        temperature=0.7,
+        callbacks=[LatencyCallbackHandler()],  # llm.<model> spans for /ai/metrics
     )
 
-    # Initialize Ethereum Account Wallet Provider
-    wallet_provider = EthAccountWalletProvider(
+    # Initialize Ethereum Account Wallet Provider; its transactions take nonces from the wallet's tx monitor
+    wallet_provider = MonitoredWalletProvider(
         config=EthAccountWalletProviderConfig(
             account=config.account,  # Ethereum account from private key
             chain_id=config.chain_id,  # Chain ID for the network
             rpc_url=config.rpc_url
         )
     )
+    # The wallet's own client serves its chain; other chains in CHAIN_IDS get pooled clients, warmed up now
+    chain_registry.register_client(config.chain_id, wallet_provider.web3)
+    for chain_id, error in chain_registry.warm().items():
+        if error:
+            print(f"Warning: RPC for chain {chain_id} is not usable: {error}")
+    # Keep the local pool index (fee tiers / tick spacings per token) following every enabled chain
+    if os.getenv("POOL_INDEXER", "off").lower() == "on":
+        start_indexers(chain_registry)
+    other_chains = [str(chain_id) for chain_id in chain_registry.enabled_ids() if str(chain_id) != str(config.chain_id)]
 
     # Initialize AgentKit
     agentkit = AgentKit(
@@ -66,21 +81,37 @@ def initialize_agent(config: EthAccountWalletProviderConfig, thread_id: str = "E
 
     # # Get tools for the agent
     tools = get_langchain_tools(agentkit)
-    # Store buffered conversation history in memory
-    memory = MemorySaver()
+    # Each model call is offered only the tools relevant to the turn, with short descriptions
+    model = llm
+    if os.getenv("TOOL_SELECTION", "on").lower() == "on":
+        model = ToolSelectingChatModel(
+            llm=llm, selector=ToolSelector(tools, max_tools=int(os.getenv("TOOL_SELECTION_MAX_TOOLS", "6")))
+        )
+    # Store buffered conversation history in memory, or in the store shared by all
+    # worker processes so any of them can continue any thread
+    store = shared_store()
+    memory = store.checkpointer() if store is not None else MemorySaver()
     agent_config = {"configurable": {"thread_id": thread_id}}
 
-    # Create ReAct Agent using the LLM and Ethereum Account Wallet tools
+    # Create ReAct Agent using the LLM and Ethereum Account Wallet tools.
+    # version="v1" hands every tool call of a step to a single ConcurrentToolNode,
+    # which runs independent reads in parallel and keeps wallet actions ordered.
     return (
         create_react_agent(
-            llm,
-            tools=tools,
+            model,
+            tools=ConcurrentToolNode(tools),
             checkpointer=memory,
             state_modifier=(
                 "You are a helpful agent that can interact onchain using an Ethereum Account Wallet. "
                 "You have tools to send transactions, query blockchain data, and interact with contracts. "
                 "If you run into a 5XX (internal) error, ask the user to try again later."
+                + (
+                    f" Uniswap trades default to chain {config.chain_id}; pass chain_id to trade on "
+                    f"{', '.join(other_chains)}."
+                    if other_chains else ""
+                )
             ),
+            version="v1",
         ),
         agent_config,
     )
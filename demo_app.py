@@ -1,12 +1,23 @@
+import json
 import os
+import queue
+import socket
+import time
 import uuid
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
 
 # Import wallet_setup from coinbase.py
 from coinbase import wallet_setup
+from agent_tools import may_change_state, tool_selection_report, watch_state_changes
+from single_flight import SingleFlight
+from actions.event_log import correlation
+from actions.shared_store import LeaseTimeout, shared_store
+from actions.telemetry import registry, request_timings, span
 
 app = Flask(__name__)
 # Make CORS more permissive for development
@@ -23,6 +34,11 @@ def handle_options(path):
 def health_check():
     return jsonify({"status": "online", "message": "Flask chat API is running"}), 200
 
+# Prometheus scrape endpoint with latency histograms per span (llm.*, tool.*, rpc.*, sign.*, wait.*)
+@app.route('/ai/metrics')
+def metrics():
+    return Response(registry.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 # Global variable to hold the initialized agent executor
 agent_executor = None
 
@@ -36,7 +52,10 @@ def startup_agent_system():
         # We primarily need the agent_executor. The thread_id for conversation
         # will be handled per-request.
         # Using a placeholder thread_id for the initial setup.
-        initialized_agent_executor, agent_config = wallet_setup(thread_id="flask_app_initial_setup")
+        # With several workers, one at a time, so only the first one creates a wallet
+        store = shared_store()
+        with store.lease("wallet_setup") if store is not None else nullcontext():
+            initialized_agent_executor, agent_config = wallet_setup(thread_id="flask_app_initial_setup")
         agent_executor = initialized_agent_executor
         
         if agent_executor:
@@ -50,8 +69,19 @@ def startup_agent_system():
         traceback.print_exc()
         agent_executor = None
 
-def run_agent(user_input: str, thread_id: str):
-    """Runs the agent with the given user input and thread_id for conversation history."""
+def _thread_lease(thread_id: str):
+    """Hold ``thread_id`` while extending its history, so two workers never run the same thread at once.
+
+    Raises LeaseTimeout if another request keeps the thread busy for more than
+    THREAD_LEASE_WAIT_SECONDS. A no-op without a shared store (single worker).
+    """
+    store = shared_store()
+    if store is None:
+        return nullcontext()
+    return store.lease(f"thread:{thread_id}", wait=float(os.environ.get("THREAD_LEASE_WAIT_SECONDS", "30")))
+
+def _invoke_agent(user_input: str, thread_id: str):
+    """Runs the agent on ``user_input`` in the conversation ``thread_id`` and returns the graph's final state."""
     global agent_executor
     if not agent_executor:
         # This should ideally be caught by chat_handler's check, but as a safeguard:
@@ -64,31 +94,94 @@ def run_agent(user_input: str, thread_id: str):
     try:
         messages = [HumanMessage(content=user_input)]
         # Invoke the agent executor
-        if agent_config:
-            response_data = agent_executor.invoke({"messages": messages}, agent_config)
-        else:
-            response_data = agent_executor.invoke({"messages": messages}, call_specific_config)
-        
-        # Extract the last message's content, assuming it's the agent's response.
-        # For create_react_agent, response_data is typically a dict with a 'messages' key.
-        if response_data and "messages" in response_data and response_data["messages"]:
-            last_message = response_data["messages"][-1]
-            if hasattr(last_message, 'content'):
-                return str(last_message.content)
-            else:
-                # Fallback if content attribute is missing (e.g., if it's not a standard message object)
-                print(f"Warning: Last message for thread {thread_id} lacked a 'content' attribute: {last_message}")
-                return str(last_message)
-        else:
-            print(f"Unexpected response structure or empty messages from agent for thread {thread_id}: {response_data}")
-            return "Agent processed the request but returned an unexpected response format or no messages."
-
+        with _thread_lease(thread_id):
+            return agent_executor.invoke({"messages": messages}, call_specific_config)
+    except LeaseTimeout:
+        raise
     except Exception as e:
         print(f"Error during agent invocation for input '{user_input}' in thread '{thread_id}': {e}")
         import traceback
         traceback.print_exc() # Log the full traceback for debugging
         raise # Re-raise the exception to be caught by chat_handler
 
+def _response_content(response_data, thread_id: str):
+    """The agent's reply: the content of the last message of ``response_data``."""
+    # Extract the last message's content, assuming it's the agent's response.
+    # For create_react_agent, response_data is typically a dict with a 'messages' key.
+    if response_data and "messages" in response_data and response_data["messages"]:
+        last_message = response_data["messages"][-1]
+        if hasattr(last_message, 'content'):
+            return str(last_message.content)
+        else:
+            # Fallback if content attribute is missing (e.g., if it's not a standard message object)
+            print(f"Warning: Last message for thread {thread_id} lacked a 'content' attribute: {last_message}")
+            return str(last_message)
+    else:
+        print(f"Unexpected response structure or empty messages from agent for thread {thread_id}: {response_data}")
+        return "Agent processed the request but returned an unexpected response format or no messages."
+
+def run_agent(user_input: str, thread_id: str):
+    """Runs the agent with the given user input and thread_id for conversation history."""
+    return _response_content(_invoke_agent(user_input, thread_id), thread_id)
+
+# Identical stateless requests in flight at the same time share one agent run
+chat_flights = SingleFlight()
+
+def coalescing_key(user_input: str, thread_id: str):
+    """Key under which a chat request may share an agent run, or None if it must run on its own.
+
+    Only requests starting a conversation qualify, since a reply to an existing
+    thread depends on its history, and only if the message asks for nothing
+    that changes wallet state.
+    """
+    if os.environ.get("CHAT_COALESCING", "on").lower() != "on" or may_change_state(user_input):
+        return None
+    if agent_executor.get_state({"configurable": {"thread_id": thread_id}}).values.get("messages"):
+        return None
+    return " ".join(user_input.lower().split()).rstrip("?!. ")
+
+def run_agent_coalesced(user_input: str, thread_id: str):
+    """run_agent, with one run shared by identical stateless requests in flight.
+
+    Returns (response, coalesced); ``coalesced`` is True when the response came
+    from another request's run. That conversation is copied into ``thread_id``,
+    so follow-up questions see it.
+    """
+    key = coalescing_key(user_input, thread_id)
+    if key is None:
+        return run_agent(user_input, thread_id), False
+
+    def shared_run():
+        with watch_state_changes() as changes:
+            response_data = _invoke_agent(user_input, thread_id)
+        return response_data, not changes.tools
+
+    (response_data, read_only), leader = chat_flights.do(key, shared_run)
+    if leader:
+        return _response_content(response_data, thread_id), False
+    if not read_only:
+        # The agent changed wallet state after all; that is never handed to other requests
+        return run_agent(user_input, thread_id), False
+    with _thread_lease(thread_id):
+        agent_executor.update_state(
+            {"configurable": {"thread_id": thread_id}}, {"messages": response_data["messages"]}, as_node="agent"
+        )
+    return _response_content(response_data, thread_id), True
+
+def answer(user_input: str, thread_id: str, debug: bool = False):
+    """Runs one chat request and returns its response body (without error handling)."""
+    # Trade events emitted while serving this request carry its request_id and thread_id
+    with correlation(request_id=uuid.uuid4().hex, thread_id=thread_id), \
+            request_timings() as timings, tool_selection_report() as selection, span("chat.request"):
+        response_content, coalesced = run_agent_coalesced(user_input, thread_id)
+
+    body = {"response": response_content, "thread_id": thread_id}
+    if debug:
+        body["timings"] = timings.breakdown()
+        body["tool_selection"] = selection.summary()
+        body["coalesced"] = coalesced
+    return body
+
 @app.route('/ai/chat', methods=['POST'])
 def chat_handler():
     global agent_executor # Access the global agent_executor
@@ -102,31 +195,132 @@ def chat_handler():
 
     user_input = data['message']
     thread_id = data.get('thread_id', str(uuid.uuid4())) 
+    # Per-request timing breakdown and tool selection savings, requested with "debug": true
+    # or enabled globally with AI_DEBUG_TIMINGS=1
+    debug = bool(data.get('debug')) or os.environ.get("AI_DEBUG_TIMINGS") == "1"
 
     try:
-        # Call the new run_agent function, passing the user_input and thread_id
-        response_content = run_agent(user_input, thread_id)
+        body = answer(user_input, thread_id, debug)
         
-        if response_content is None:
+        if body["response"] is None:
             # This case might occur if run_agent explicitly returns None, though current logic aims to return a string.
             print(f"run_agent returned None for input: {user_input} in thread: {thread_id}")
             return jsonify({"error": "Agent returned an empty or null response.", "thread_id": thread_id}), 500
 
-        return jsonify({"response": response_content, "thread_id": thread_id})
+        return jsonify(body)
 
+    except LeaseTimeout as e:
+        return jsonify({"error": f"Thread is busy with another request: {e}", "thread_id": thread_id}), 409
     except Exception as e:
         # Errors raised by run_agent will be caught here
         # The traceback is already printed in run_agent if an exception occurs there
         return jsonify({"error": f"Agent execution failed: {str(e)}", "thread_id": thread_id}), 500
 
+def _batch_items(data):
+    """Validated (index, message, thread_id) items of a batch request body, or an error message."""
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return None, "Request body must be a non-empty list of {message, thread_id} items, or {\"items\": [...]}"
+    max_items = int(os.environ.get("CHAT_BATCH_MAX_ITEMS", "1000"))
+    if len(items) > max_items:
+        return None, f"Batch has {len(items)} items, the limit is {max_items} (CHAT_BATCH_MAX_ITEMS)"
+    parsed = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"message": item}
+        if not isinstance(item, dict) or not isinstance(item.get('message'), str):
+            return None, f"Item {index} needs a 'message' string"
+        parsed.append((index, item['message'], item.get('thread_id') or str(uuid.uuid4())))
+    return parsed, None
+
+def run_batch(items, concurrency: int, debug: bool = False):
+    """Runs chat ``items`` on a pool of ``concurrency`` threads, yielding one result dict per item as it finishes.
+
+    Items with the same thread_id run one after another in the order given,
+    since each continues the conversation of the previous one; other items run
+    in parallel. A failing item yields an ``error`` result and the rest of the
+    batch carries on. The last result is a ``summary`` of the batch.
+    """
+    conversations = {}
+    for item in items:
+        conversations.setdefault(item[2], []).append(item)
+    results = queue.Queue()
+
+    def run_conversation(conversation):
+        for index, user_input, thread_id in conversation:
+            try:
+                result = answer(user_input, thread_id, debug)
+            except LeaseTimeout as e:
+                result = {"error": f"Thread is busy with another request: {e}", "thread_id": thread_id}
+            except Exception as e:
+                result = {"error": f"Agent execution failed: {str(e)}", "thread_id": thread_id}
+            results.put({"index": index, **result})
+
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=min(concurrency, len(conversations)), thread_name_prefix="chat-batch")
+    try:
+        for conversation in conversations.values():
+            pool.submit(run_conversation, conversation)
+        failed = 0
+        for _ in items:
+            result = results.get()
+            failed += "error" in result
+            yield result
+        yield {"summary": {"items": len(items), "succeeded": len(items) - failed, "failed": failed,
+                           "seconds": round(time.perf_counter() - started, 3)}}
+    finally:
+        # A client that disconnects mid-batch stops the items that haven't started
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@app.route('/ai/chat/batch', methods=['POST'])
+def chat_batch_handler():
+    """Runs many independent chat items concurrently and streams their results as NDJSON, one line per item."""
+    if not agent_executor:
+        return jsonify({"error": "Agent system (agent_executor) is not initialized or failed to load. Check server logs."}), 503
+
+    data = request.get_json(silent=True)
+    items, error = _batch_items(data)
+    if error:
+        return jsonify({"error": error}), 400
+    debug = (isinstance(data, dict) and bool(data.get('debug'))) or os.environ.get("AI_DEBUG_TIMINGS") == "1"
+    concurrency = max(1, int(os.environ.get("CHAT_BATCH_CONCURRENCY", "8")))
+
+    def lines():
+        for result in run_batch(items, concurrency, debug):
+            yield json.dumps(result, default=str) + "\n"
+
+    return Response(lines(), mimetype="application/x-ndjson")
+
+def serve_worker(port: int):
+    """One worker process: its own agent, serving on a port shared with the other workers."""
+    startup_agent_system()
+    # SO_REUSEPORT lets every worker bind the port; the kernel spreads connections across them
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('0.0.0.0', port))
+    from waitress import serve
+    serve(app, sockets=[sock])
+
 if __name__ == '__main__':
     print("Loading .env variables...")
     load_dotenv() # Ensure .env is loaded before wallet_setup (called by startup_agent_system)
     # Note: The explicit 'from coinbase import run_agent' is removed as run_agent is now defined locally.
 
-    startup_agent_system() # Initialize the agent_executor
-
     port = int(os.environ.get("FLASK_PORT", 8080))
-    print(f"Starting Flask server on port {port}...")
-    from waitress import serve
-    serve(app, host='0.0.0.0', port=port) 
\ No newline at end of file
+    workers = int(os.environ.get("WEB_WORKERS", "1"))
+    if workers > 1:
+        # Conversations, nonces and sent transactions live in a store all workers share
+        os.environ.setdefault("SHARED_STORE_PATH", "shared_state.sqlite3")
+        import multiprocessing
+        print(f"Starting {workers} Flask workers on port {port}...")
+        processes = [multiprocessing.Process(target=serve_worker, args=(port,)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        startup_agent_system() # Initialize the agent_executor
+
+        print(f"Starting Flask server on port {port}...")
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=port) 
\ No newline at end of file
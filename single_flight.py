@@ -0,0 +1,54 @@
+import threading
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs a function once per key for all callers that ask while it is in flight.
+
+    The first caller for a key runs ``fn``; callers arriving before it returns
+    wait for that run and get its result (or its exception) instead of
+    starting their own. Nothing is cached: once the run finishes, the next
+    caller starts a new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn):
+        """Return ``(result, leader)``; ``leader`` is True for the caller that ran ``fn``."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, True
+
+    def in_flight(self):
+        """Number of keys currently running."""
+        with self._lock:
+            return len(self._flights)
@@ -0,0 +1,24 @@
+import pytest
+
+from agent_tools import may_change_state
+
+
+@pytest.mark.parametrize("message", [
+    "convert my ETH into WETH",
+    "Buy 0.01 ETH of PEPE",
+    "give the router approval for USDC",
+    "revoke the USDC allowance",
+    "move 5 USDC to 0xabc",
+    "swapping DEGEN for ETH",
+])
+def test_state_changing_messages_are_detected(message):
+    assert may_change_state(message)
+
+
+@pytest.mark.parametrize("message", [
+    "what's my wallet balance?",
+    "price of bitcoin",
+    "show the USDC/WETH pool state",
+])
+def test_reads_are_not_state_changing(message):
+    assert not may_change_state(message)
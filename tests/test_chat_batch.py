@@ -0,0 +1,40 @@
+import threading
+import time
+
+import demo_app
+
+
+def test_batch_keeps_each_thread_in_order_and_isolates_failures(monkeypatch):
+    lock = threading.Lock()
+    log = []
+    running = [0, 0]  # now, peak
+
+    def answer(user_input, thread_id, debug=False):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+            log.append(("start", user_input))
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+            log.append(("end", user_input))
+        if user_input == "boom":
+            raise RuntimeError("model unavailable")
+        return {"response": user_input.upper(), "thread_id": thread_id}
+
+    monkeypatch.setattr(demo_app, "answer", answer)
+    items = [(0, "a1", "a"), (1, "b1", "b"), (2, "a2", "a"), (3, "boom", "c"), (4, "a3", "a")]
+    results = list(demo_app.run_batch(items, concurrency=4))
+
+    by_index = {result["index"]: result for result in results[:-1]}
+    assert sorted(by_index) == [0, 1, 2, 3, 4]
+    assert by_index[2] == {"index": 2, "response": "A2", "thread_id": "a"}
+    assert by_index[3]["error"] == "Agent execution failed: model unavailable"
+    assert results[-1]["summary"]["items"] == 5
+    assert (results[-1]["summary"]["succeeded"], results[-1]["summary"]["failed"]) == (4, 1)
+
+    # Thread "a" ran one item at a time, in the order given; other threads ran alongside it
+    thread_a = [entry for entry in log if entry[1].startswith("a")]
+    assert thread_a == [("start", "a1"), ("end", "a1"), ("start", "a2"), ("end", "a2"), ("start", "a3"),
+                        ("end", "a3")]
+    assert running[1] > 1
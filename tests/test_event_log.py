@@ -0,0 +1,25 @@
+import json
+
+from actions.event_log import EventLog, EventType
+
+
+def test_environment_is_read_on_first_emit(tmp_path, monkeypatch):
+    log = EventLog()
+    path = tmp_path / "events.jsonl"
+    # Set after the log was created, like values load_dotenv() loads after import
+    monkeypatch.setenv("EVENT_LOG_FILE", str(path))
+    monkeypatch.setenv("EVENT_LOG_LEVEL", "debug")
+    log.emit(EventType.SWAP_ENCODED, "debug", pool_version="v3")
+    log.flush()
+    assert [json.loads(line)["event"] for line in path.read_text().splitlines()] == ["swap_encoded"]
+
+
+def test_unknown_level_falls_back_to_info(tmp_path, monkeypatch):
+    path = tmp_path / "events.jsonl"
+    monkeypatch.setenv("EVENT_LOG_FILE", str(path))
+    monkeypatch.setenv("EVENT_LOG_LEVEL", "warn")
+    log = EventLog()
+    assert not log.enabled("debug") and log.enabled("info")
+    log.flush()
+    record = json.loads(path.read_text())
+    assert (record["event"], record["value"], record["using"]) == ("event_log_level_invalid", "warn", "info")
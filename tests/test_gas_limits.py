@@ -0,0 +1,100 @@
+import math
+
+from actions.gas_limits import FALLBACK_GAS_LIMIT, GasEstimator
+from actions.tx_monitor import TxMonitor
+from benchmarks.mock_chain import MockChain, TOKEN_ADDRESS
+
+KEY = ("swap", 8453, "v3")
+
+
+def _send(chain, w3, gas=225000):
+    tx = {
+        "from": chain.account.address,
+        "to": TOKEN_ADDRESS,
+        "value": 0,
+        "data": "0x",
+        "gas": gas,
+        "maxFeePerGas": chain.base_fee * 2,
+        "maxPriorityFeePerGas": chain.priority_fee,
+        "type": 2,
+        "chainId": chain.chain_id,
+        "nonce": 0,
+    }
+    signed = w3.eth.account.sign_transaction(tx, chain.account.key)
+    return tx, w3.eth.send_raw_transaction(signed.raw_transaction)
+
+
+def _monitor(chain, w3, estimator, policy):
+    monitor = TxMonitor(w3, chain.account, policy=policy, stall_blocks=1, listeners=[estimator.on_receipt])
+    # Polled by the test instead of the background thread
+    monitor.stop(timeout=5)
+    return monitor
+
+
+def test_receipt_of_remembered_tx_is_learned():
+    chain = MockChain(auto_mine=False, gas_used=200000)
+    w3 = chain.web3()
+    estimator = GasEstimator(margin=1.25)
+    monitor = _monitor(chain, w3, estimator, "watch")
+    tx, tx_hash = _send(chain, w3)
+    monitor.track(tx, tx_hash, "swap")
+    estimator.remember(tx_hash, KEY, tx["gas"])
+    chain.mine()
+    monitor.poll()
+    assert estimator.cached(KEY) == 250000
+
+
+def test_cancelled_swap_does_not_learn_from_the_cancel_receipt():
+    chain = MockChain(auto_mine=False)
+    w3 = chain.web3()
+    estimator = GasEstimator(margin=1.25)
+    assert estimator.record_estimate(KEY, 180000) == 225000
+    monitor = _monitor(chain, w3, estimator, "cancel")
+    tx, tx_hash = _send(chain, w3)
+    monitor.track(tx, tx_hash, "swap")
+    estimator.remember(tx_hash, KEY, tx["gas"])
+
+    monitor.poll()
+    chain.mine(2, include_pending=False)
+    monitor.poll()  # stalled: replaced with a 0 ETH self-transfer
+    pending = monitor.pending()[0]
+    assert pending.replacements == 1 and pending.tx["gas"] == 21000
+
+    chain.gas_used = 21000
+    chain.mine()
+    assert w3.eth.get_transaction_receipt(pending.tx_hash)["gasUsed"] == 21000
+    monitor.poll()
+    assert not monitor.pending()
+    assert estimator.cached(KEY) == 225000
+
+
+def test_only_the_first_transaction_of_a_kind_is_estimated():
+    chain = MockChain()
+    w3 = chain.web3()
+    estimator = GasEstimator(margin=1.25)
+    tx = {"from": chain.account.address, "to": TOKEN_ADDRESS, "data": "0x", "value": 0}
+    assert estimator.estimate(w3, KEY, tx) == 225000
+    assert estimator.estimate(w3, KEY, tx) == 225000
+    assert chain.calls["eth_estimateGas"] == 1
+
+
+def test_failed_estimate_falls_back_without_caching():
+    class FailingEth:
+        def estimate_gas(self, tx):
+            raise ValueError("execution reverted")
+
+    class FailingWeb3:
+        eth = FailingEth()
+
+    estimator = GasEstimator()
+    assert estimator.estimate(FailingWeb3(), KEY, {}) == FALLBACK_GAS_LIMIT
+    assert estimator.cached(KEY) is None
+
+
+def test_out_of_gas_revert_raises_the_limit_and_other_reverts_teach_nothing():
+    estimator = GasEstimator(margin=1.25)
+    estimator.observe(KEY, 150000)
+    estimator.observe(KEY, 50000, gas_limit=187500, status=0)
+    assert estimator.cached(KEY) == 187500
+    estimator.observe(KEY, 187000, gas_limit=187500, status=0)
+    assert estimator.cached(KEY) == math.ceil(math.ceil(187500 * 1.5) * 1.25)
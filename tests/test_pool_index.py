@@ -0,0 +1,43 @@
+from actions.chains import CHAINS
+from actions.pool_index import PoolIndex, PoolIndexer
+from benchmarks.mock_chain import CHAIN_ID, MockChain, TOKEN_ADDRESS, WETH_ADDRESS
+
+START = CHAINS[CHAIN_ID].pools_start_block
+
+
+def _token(i):
+    return "0x" + (i + 1).to_bytes(20, "big").hex()
+
+
+def _indexer(chain, tmp_path, **kwargs):
+    index = PoolIndex(str(tmp_path / "pools.sqlite3"))
+    return PoolIndexer(chain.web3(), CHAINS[CHAIN_ID], index=index, confirmations=0, **kwargs), index
+
+
+def test_pages_shrink_below_the_rejected_range(tmp_path):
+    chain = MockChain(max_log_range=1000)
+    for i in range(10):
+        chain.create_pool(WETH_ADDRESS, _token(i), version="v4" if i % 2 else "v3", block=START + i * 900)
+    chain.block_number = START + 10_000
+    indexer, index = _indexer(chain, tmp_path, page_blocks=4000)
+
+    assert indexer.sync() == 10
+    assert indexer.max_page_blocks <= 1000
+    assert index.checkpoint(CHAIN_ID) == chain.block_number
+    assert sorted(pool.version for pool in index.pools_for_token(CHAIN_ID, WETH_ADDRESS)) == ["v3"] * 5 + ["v4"] * 5
+
+
+def test_sync_resumes_from_the_checkpoint(tmp_path):
+    chain = MockChain()
+    chain.create_pool(WETH_ADDRESS, TOKEN_ADDRESS, block=START + 10)
+    chain.block_number = START + 100
+    indexer, index = _indexer(chain, tmp_path)
+    assert indexer.sync() == 1
+
+    chain.create_pool(TOKEN_ADDRESS, _token(0), block=START + 150)
+    chain.block_number = START + 200
+    chain.reset_counts()
+    assert indexer.sync() == 1
+    assert chain.calls["eth_getLogs"] == 1
+    assert index.checkpoint(CHAIN_ID) == START + 200
+    assert index.route(CHAIN_ID, TOKEN_ADDRESS, WETH_ADDRESS).fee == 3000
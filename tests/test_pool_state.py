@@ -0,0 +1,66 @@
+import threading
+import time
+
+from actions.chains import CHAINS
+from actions.pool_index import PoolIndex, PoolIndexer
+from actions.pool_state import PoolStateTracker
+from benchmarks.mock_chain import CHAIN_ID, MockChain, TOKEN_ADDRESS, WETH_ADDRESS
+
+
+def _tracker(chain, tmp_path):
+    config = CHAINS[CHAIN_ID]
+    chain.block_number = config.pools_start_block + 1
+    pool = chain.create_pool(WETH_ADDRESS, TOKEN_ADDRESS)
+    index = PoolIndex(str(tmp_path / "pools.sqlite3"))
+    PoolIndexer(chain.web3(), config, index=index, confirmations=0).sync()
+    tracker = PoolStateTracker(chain.web3(), config, index=index, poll_interval=3600)
+    tracker.watch_pair(WETH_ADDRESS, TOKEN_ADDRESS)
+    return tracker, pool
+
+
+def test_swaps_are_applied_from_logs(tmp_path):
+    chain = MockChain()
+    tracker, pool = _tracker(chain, tmp_path)
+    chain.swap(pool, 2 * 2**96, 6931)
+    chain.modify_liquidity(pool, 0, 7000, 10**17)
+    tracker.poll()
+    state = tracker.state(pool)
+    assert (state.sqrt_price_x96, state.tick, state.liquidity) == (2 * 2**96, 6931, 11 * 10**17)
+    assert tracker.spot_price(TOKEN_ADDRESS, WETH_ADDRESS) in (4.0, 0.25)
+
+
+def test_reorg_undoes_the_replaced_blocks(tmp_path):
+    chain = MockChain()
+    tracker, pool = _tracker(chain, tmp_path)
+    chain.swap(pool, 2 * 2**96, 6931)
+    tracker.poll()
+    chain.swap(pool, 3 * 2**96, 10986)
+    tracker.poll()
+    assert tracker.state(pool).tick == 10986
+
+    # The last block is replaced by one with another swap, the one before it survives
+    chain.reorg(1, replacement_swaps=[(pool, 5 * 2**96, 16094)])
+    tracker.poll()
+    assert (tracker.state(pool).sqrt_price_x96, tracker.state(pool).tick) == (5 * 2**96, 16094)
+
+    # Both swaps are gone on the new branch: back to the seeded price
+    chain.reorg(2)
+    tracker.poll()
+    assert (tracker.state(pool).sqrt_price_x96, tracker.state(pool).tick) == (2**96, 0)
+
+
+def test_reads_do_not_wait_for_a_poll(tmp_path):
+    chain = MockChain()
+    tracker, pool = _tracker(chain, tmp_path)
+    tracker.spot_price(TOKEN_ADDRESS, WETH_ADDRESS)  # reads decimals once
+    chain.swap(pool, 2 * 2**96, 6931)
+    chain.method_latency["eth_getLogs"] = 0.5
+    poll = threading.Thread(target=tracker.poll)
+    poll.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    assert tracker.state(pool).tick == 0
+    assert tracker.spot_price(TOKEN_ADDRESS, WETH_ADDRESS) == 1.0
+    assert time.perf_counter() - start < 0.1
+    poll.join()
+    assert tracker.state(pool).tick == 6931
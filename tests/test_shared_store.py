@@ -0,0 +1,67 @@
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+from actions.shared_store import LeaseTimeout, SharedStore
+
+CHAIN_ID = 8453
+ADDRESS = "0x19E7E376E7C213B7E7e7e46cc70A5dD086DAff2A"
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two stores on one file, like two worker processes."""
+    path = str(tmp_path / "shared.sqlite3")
+    return SharedStore(path, lease_seconds=5), SharedStore(path, lease_seconds=5)
+
+
+def test_conversation_written_by_one_worker_is_read_by_another(workers):
+    first, second = workers
+    config = {"configurable": {"thread_id": "t1", "checkpoint_ns": ""}}
+    checkpoint = {**empty_checkpoint(), "channel_values": {"messages": ["hi"]}}
+    saved = first.checkpointer().put(config, checkpoint, {"source": "input", "step": 1}, {})
+    first.checkpointer().put_writes(saved, [("messages", "hello")], "task-1")
+
+    loaded = second.checkpointer().get_tuple(config)
+    assert loaded.checkpoint["id"] == checkpoint["id"]
+    assert loaded.checkpoint["channel_values"] == {"messages": ["hi"]}
+    assert loaded.metadata["step"] == 1
+    assert loaded.pending_writes == [("task-1", "messages", "hello")]
+    assert [item.checkpoint["id"] for item in second.checkpointer().list(config)] == [checkpoint["id"]]
+
+
+def test_lease_is_exclusive_until_released(workers):
+    first, second = workers
+    with first.lease("thread:t1") as owner:
+        assert first.holder("thread:t1") == owner
+        with pytest.raises(LeaseTimeout):
+            with second.lease("thread:t1", wait=0.1):
+                pass
+    with second.lease("thread:t1", wait=0.1):
+        assert second.holder("thread:t1") is not None
+
+
+def test_expired_lease_is_taken_over(workers):
+    first, second = workers
+    assert first.try_acquire("wallet_setup", "crashed-worker", ttl=0.01)
+    with second.lease("wallet_setup", wait=1):
+        assert second.holder("wallet_setup") != "crashed-worker"
+
+
+def test_workers_reserve_distinct_nonces(workers):
+    first, second = workers
+    assert first.reserve_nonce(CHAIN_ID, ADDRESS, 7) == 7
+    assert second.reserve_nonce(CHAIN_ID, ADDRESS, 7) == 8
+    first.record_transaction(CHAIN_ID, ADDRESS, 7, "swap", {"nonce": 7, "data": b"\x01"}, [b"\x02" * 32])
+    assert second.reserve_nonce(CHAIN_ID, ADDRESS, 7) == 9
+    stored = second.transactions(CHAIN_ID, ADDRESS)[7]
+    assert (stored.kind, stored.tx["data"], stored.owner) == ("swap", "0x01", first.worker_id)
+
+
+def test_released_and_expired_nonces_are_handed_out_again(workers):
+    first, second = workers
+    assert first.reserve_nonce(CHAIN_ID, ADDRESS, 0) == 0
+    assert first.reserve_nonce(CHAIN_ID, ADDRESS, 0) == 1
+    first.release_nonce(CHAIN_ID, ADDRESS, 0)
+    assert second.reserve_nonce(CHAIN_ID, ADDRESS, 0) == 0
+    # Nonces 0 and 1 were reserved long enough ago to count as abandoned
+    assert second.reserve_nonce(CHAIN_ID, ADDRESS, 0, reservation_seconds=0) == 0
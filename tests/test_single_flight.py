@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class _CountingEvent(threading.Event):
+    """Event that counts the callers waiting on it."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Semaphore(0)
+
+    def wait(self, timeout=None):
+        self.waiting.release()
+        return super().wait(timeout)
+
+
+def _followers(flight, fn, waiters):
+    """Start ``fn`` as leader, then ``waiters`` callers for the same key while it runs."""
+    started, release = threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    pool = ThreadPoolExecutor(max_workers=waiters + 1)
+    leader = pool.submit(flight.do, "key", leader_fn)
+    started.wait(5)
+    done = flight._flights["key"].done = _CountingEvent()
+    followers = [pool.submit(flight.do, "key", lambda: pytest.fail("a follower ran fn")) for _ in range(waiters)]
+    for _ in range(waiters):
+        assert done.waiting.acquire(timeout=5)
+    release.set()
+    pool.shutdown(wait=True)
+    return leader, followers
+
+
+def test_callers_in_flight_share_one_run():
+    calls = []
+    leader, followers = _followers(SingleFlight(), lambda: calls.append(1) or "result", 3)
+    assert leader.result() == ("result", True)
+    assert [f.result() for f in followers] == [("result", False)] * 3
+    assert calls == [1]
+
+
+def test_error_reaches_every_follower():
+    def fail():
+        raise ValueError("rpc down")
+
+    flight = SingleFlight()
+    leader, followers = _followers(flight, fail, 2)
+    for future in [leader, *followers]:
+        with pytest.raises(ValueError, match="rpc down"):
+            future.result()
+    # Nothing is cached: the next caller runs again
+    assert flight.do("key", lambda: "fresh") == ("fresh", True)
+    assert flight.in_flight() == 0
@@ -0,0 +1,83 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from coinbase_agentkit import EthAccountWalletProviderConfig
+from web3.middleware import SignAndSendRawMiddlewareBuilder
+
+from actions.async_uniswap_router import AsyncUniswap
+from actions.tx_monitor import TxMonitor, stop_monitors
+from actions.uniswap_router import Uniswap
+from actions.wallet_provider import MonitoredWalletProvider
+from benchmarks.mock_chain import CHAIN_ID, MockChain, PRIVATE_KEY, PROVIDER_URL, TOKEN_ADDRESS, WETH_ADDRESS
+
+TRADE_AMOUNT = 10**15
+
+
+def _uniswap(chain):
+    return Uniswap(wallet_address=chain.account.address, private_key=PRIVATE_KEY, provider=PROVIDER_URL,
+                   web3=chain.web3())
+
+
+def test_concurrent_trades_get_distinct_nonces():
+    chain = MockChain(auto_mine=False)
+    uniswap = _uniswap(chain)
+    try:
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            trades = [pool.submit(uniswap.make_trade, WETH_ADDRESS, TOKEN_ADDRESS, TRADE_AMOUNT, 3000, 0.5)
+                      for _ in range(3)]
+            tx_hashes = [trade.result() for trade in trades]
+        assert all(tx_hashes)
+        assert sorted(tx["nonce"] for tx in chain.sent) == [0, 1, 2]
+    finally:
+        uniswap.monitor.stop()
+
+
+def test_released_nonce_is_handed_out_again():
+    chain = MockChain(auto_mine=False)
+    monitor = TxMonitor(chain.web3(), chain.account, policy="watch")
+    try:
+        first, second = monitor.next_nonce(), monitor.next_nonce()
+        assert (first, second) == (0, 1)
+        monitor.release(first)
+        assert monitor.next_nonce() == 0
+        assert monitor.next_nonce() == 2
+    finally:
+        monitor.stop()
+
+
+    chain = MockChain(auto_mine=False)
+    sync_web3 = chain.web3()
+    uniswap = _uniswap(chain)
+    # A swap from the sync client, still in the mempool
+    uniswap.make_trade(WETH_ADDRESS, TOKEN_ADDRESS, TRADE_AMOUNT, 3000, 0.5)
+    try:
+        async_uniswap = asyncio.run(AsyncUniswap.create(
+            wallet_address=chain.account.address, private_key=PRIVATE_KEY, provider=PROVIDER_URL,
+            web3=chain.async_web3(), sync_web3=uniswap.w3,
+        ))
+        assert async_uniswap.monitor is uniswap.monitor
+        assert len(chain.sent) == 1
+        asyncio.run(async_uniswap.make_trade(WETH_ADDRESS, TOKEN_ADDRESS, TRADE_AMOUNT, 3000, 0.5))
+        assert [tx["nonce"] for tx in chain.sent] == [0, 1]
+    finally:
+        stop_monitors()
+
+
+def test_wallet_provider_transactions_share_the_wallet_nonces():
+    chain = MockChain(auto_mine=False)
+    wallet_provider = MonitoredWalletProvider(
+        EthAccountWalletProviderConfig(account=chain.account, chain_id=str(CHAIN_ID), rpc_url=PROVIDER_URL)
+    )
+    wallet_provider.web3 = chain.web3()
+    wallet_provider.web3.middleware_onion.inject(SignAndSendRawMiddlewareBuilder.build(chain.account), layer=0)
+    try:
+        # Two AgentKit transfers and a swap while nothing is mined, as the agent would send them
+        wallet_provider.send_transaction({"to": TOKEN_ADDRESS, "value": 1})
+        wallet_provider.send_transaction({"to": TOKEN_ADDRESS, "value": 1})
+        uniswap = Uniswap(wallet_address=chain.account.address, private_key=PRIVATE_KEY, provider=PROVIDER_URL,
+                          web3=wallet_provider.web3)
+        uniswap.make_trade(WETH_ADDRESS, TOKEN_ADDRESS, TRADE_AMOUNT, 3000, 0.5)
+        assert [tx["nonce"] for tx in chain.sent] == [0, 1, 2]
+        assert sorted(uniswap.monitor.pending()) == [0, 1, 2]
+    finally:
+        stop_monitors()